@@ -1,14 +1,9 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
 import streamlit as st
 import hashlib
 
-# 🔐 Load Supabase credentials from .env
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from modules import fetch_data as db
+from utils.logger import audit
+from components.request_key import request_key
 
 # 🔑 Password hashing
 def hash_password(password):
@@ -38,22 +33,26 @@ def run():
         password = st.text_input("Password", type="password")
         role = st.selectbox("Role", ["pharmacist", "admin", "cashier", "procurement", "supervisor"])
 
-        if st.button("Register"):
+        submitted = st.button("Register")
+        register_key = request_key("register_user", submitted)
+        if submitted:
             if not name or not email or not password:
                 st.warning("⚠️ Please fill in all fields.")
             else:
                 hashed_pw = hash_password(password)
-                existing = supabase.table("users").select("id").eq("email", email).execute().data
+                existing = db.find_user_by_email(email)
                 if existing:
                     st.error("❌ Email already registered.")
                 else:
                     try:
-                        supabase.table("users").insert({
+                        db.insert_user({
                             "name": name,
                             "email": email,
                             "password_hash": hashed_pw,
                             "role": role
-                        }).execute()
+                        }, register_key)
+                        audit.log("register_user", st.session_state["user"].get("email"),
+                                  f"Registered {email} as {role}")
                         st.success("✅ Registration successful! You can now log in.")
                     except Exception as e:
                         st.error(f"❌ Registration failed: {e}")
@@ -71,9 +70,8 @@ def run():
             else:
                 hashed_pw = hash_password(password)
                 try:
-                    user_data = supabase.table("users").select("*").eq("email", email).eq("password_hash", hashed_pw).execute().data
-                    if user_data:
-                        user = user_data[0]
+                    user = db.authenticate_user(email, hashed_pw)
+                    if user:
                         st.session_state["user"] = user
                         st.success(f"✅ Welcome, {user['name']}!")
 
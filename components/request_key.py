@@ -0,0 +1,19 @@
+import streamlit as st
+
+from modules import fetch_data as db
+
+
+def request_key(form, submitted):
+    """Idempotency key for the current submission of `form`.
+
+    Every rerun in which the submit button is pressed again (a double click,
+    or a retry after a timeout) gets the same key, so the write behind it
+    happens once. The next rerun without a submit starts a new key.
+    """
+    keys = st.session_state.setdefault("request_keys", {})
+    current = keys.get(form)
+    if current is None or (current["used"] and not submitted):
+        current = keys[form] = {"key": db.new_request_key(), "used": False}
+    if submitted:
+        current["used"] = True
+    return current["key"]
@@ -0,0 +1,38 @@
+import streamlit as st
+
+# ➕ Option value standing for "use the typed text as a new name"
+NEW_ENTRY = "__new__"
+
+
+def search_select(label, catalog, key, allow_new=False, limit=20):
+    """Type-ahead picker over a catalog's fuzzy name index.
+
+    Returns `(row, name)`: the chosen catalog row (or None when a new name
+    was chosen or nothing matched) and the name to use.
+    """
+    typed = st.text_input(label, placeholder="Start typing...", key=f"{key}_query").strip()
+    rows_by_id = {row["id"]: row for row in catalog.rows()}
+
+    if typed:
+        # 🔄 A reload between the two reads can return ids the rows no longer hold
+        options = [item_id for item_id, _, _ in catalog.search(typed, limit) if item_id in rows_by_id]
+    else:
+        options = list(rows_by_id)[:limit]
+
+    exact = any(rows_by_id[item_id]["name"].lower() == typed.lower() for item_id in options)
+    if allow_new and typed and not exact:
+        options.append(NEW_ENTRY)
+
+    if not options:
+        st.info(f"No matches for “{typed}”.")
+        return None, typed
+
+    choice = st.selectbox(
+        "Matches",
+        options,
+        key=f"{key}_choice",
+        format_func=lambda item_id: f"➕ New: {typed}" if item_id == NEW_ENTRY else rows_by_id[item_id]["name"],
+    )
+    if choice == NEW_ENTRY:
+        return None, typed
+    return rows_by_id[choice], rows_by_id[choice]["name"]
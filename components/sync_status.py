@@ -0,0 +1,57 @@
+import streamlit as st
+
+from modules.write_journal import APPLIED, CONFLICT, PENDING, journal
+
+
+def describe_entry(entry):
+    payload = entry["payload"]
+    lines = len(payload["items"])
+    what = "Sale" if entry["kind"] == "sales" else "Purchase"
+    return f"{what} of {lines} line(s) entered {entry['created_at'][:16].replace('T', ' ')}"
+
+
+def sync_status(kind):
+    """Journal sync state for one page: writes still waiting, and writes the database refused."""
+    journal.start()
+
+    pending = journal.pending_count()
+    if pending:
+        note = f" Last error: {journal.last_error}" if journal.last_error else ""
+        st.info(f"📮 {pending} write(s) saved on this till are waiting to sync.{note}")
+
+    for entry in journal.problems():
+        if entry["kind"] != kind:
+            continue
+        reason = "not enough stock" if entry["status"] == CONFLICT else entry["error"]
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            st.error(f"⚠️ {describe_entry(entry)} could not be recorded: {reason}. It was not applied.")
+        with col2:
+            if st.button("Dismiss", key=f"dismiss_{entry['request_key']}"):
+                journal.dismiss(entry["request_key"])
+                st.rerun()
+
+
+def acknowledge(entry, what, applied_message, duplicate=False):
+    """Report a journaled write to the user; returns False if the database refused it.
+
+    `applied_message` builds the success text from the entry's result rows;
+    `duplicate` marks a repeated submit that was not journaled again.
+    """
+    if duplicate:
+        st.info(f"ℹ️ This {what.lower()} was already submitted; it was not recorded a second time.")
+    status = entry["status"]
+    if status == APPLIED:
+        st.success(applied_message(entry["result"]))
+        return True
+    if status == PENDING:
+        st.success(f"✅ {what} saved on this till. It will sync to the server as soon as the connection allows.")
+        return True
+
+    # 👀 Shown here, so it need not be listed again under sync problems
+    journal.dismiss(entry["request_key"])
+    if status == CONFLICT:
+        st.error(f"❌ Not enough stock left for this {what.lower()}. Nothing was recorded; stock levels have been refreshed.")
+    else:
+        st.error(f"❌ The server refused this {what.lower()}: {entry['error']}")
+    return False
@@ -1,15 +1,15 @@
 import streamlit as st
 import pandas as pd
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-# ------------------ Supabase Setup ------------------ #
-load_dotenv()
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+from modules import fetch_data as db
+from auth.supabase_client import hash_password
+from modules.catalog import drug_catalog
+from modules.cogs import cogs, gross_margin, with_drug_details
+from modules.replica import USE_REPLICA, replica, report_source
+from modules.rollup import shift_year
+from utils.logger import audit
+from components.request_key import request_key
 
 # ------------------ Role Check Helper ------------------ #
 def require_login():
@@ -35,6 +35,23 @@ def admin_dashboard():
     - 🧾 View sales and purchases  
     """)
     st.markdown("---")
+    failed_audit_entries()
+
+# 🧾 Audit entries the database refused; kept locally instead of blocking later ones
+def failed_audit_entries():
+    count = audit.failed_count()
+    if not count:
+        return
+    st.warning(f"⚠️ {count} audit entr{'y' if count == 1 else 'ies'} could not be saved to the database.")
+    with st.expander("🧾 Refused Audit Entries"):
+        st.dataframe(pd.DataFrame(audit.failed())[["failed_at", "action", "performed_by", "details", "error"]],
+                     hide_index=True)
+        col1, col2 = st.columns(2)
+        if col1.button("🔁 Send Again"):
+            st.success(f"✅ {audit.retry_failed()} entr(ies) queued again.")
+        if col2.button("🗑️ Discard"):
+            audit.discard_failed()
+            st.rerun()
 
 # ------------------ Pharmacist Dashboard ------------------ #
 def pharmacist_dashboard():
@@ -57,16 +74,17 @@ def view_sales():
     end = start + timedelta(days=1)
 
     try:
-        query = supabase.table("sales").select("*, drugs(name), sold_by(name)") \
-            .gte("date_sold", start.isoformat()) \
-            .lt("date_sold", end.isoformat()) \
-            .execute()
-
-        data = query.data
-        if data:
+        if USE_REPLICA:
+            # 🗃️ Joined locally; the primary only sends rows added since the last sync
+            replica.sync()
+            df = replica.sales_between(start, end)
+        else:
+            data = db.fetch_sales("quantity_sold, total_price, date_sold, drugs(name), sold_by(name)", start, end)
             df = pd.DataFrame(data)
-            df["Drug Name"] = df["drugs"].apply(extract_name)
-            df["Sold By"] = df["sold_by"].apply(extract_name)
+            if data:
+                df["Drug Name"] = df["drugs"].apply(extract_name)
+                df["Sold By"] = df["sold_by"].apply(extract_name)
+        if len(df):
 
             st.dataframe(df[[
                 "Drug Name",
@@ -89,16 +107,16 @@ def view_purchases():
     end = start + timedelta(days=1)
 
     try:
-        query = supabase.table("purchases").select("*, drugs(name)") \
-            .gte("created_at", start.isoformat()) \
-            .lt("created_at", end.isoformat()) \
-            .execute()
-
-        data = query.data
-        if data:
+        if USE_REPLICA:
+            replica.sync()
+            df = replica.purchases_between(start, end)
+        else:
+            data = db.fetch_purchases("quantity_purchased, unit_cost, created_at, drugs(name)", start, end)
             df = pd.DataFrame(data)
-            df["Drug Name"] = df["drugs"].apply(extract_name)
-            df["Total Cost"] = df["quantity_purchased"] * df["unit_cost"]
+            if data:
+                df["Drug Name"] = df["drugs"].apply(extract_name)
+                df["Total Cost"] = df["quantity_purchased"] * df["unit_cost"]
+        if len(df):
 
             st.dataframe(df[[
                 "Drug Name",
@@ -115,7 +133,7 @@ def view_purchases():
 # ------------------ Summary Reports ------------------ #
 def view_reports():
     st.subheader("📊 Summary Reports")
-    report_type = st.selectbox("Choose report type", ["Daily", "Weekly", "Monthly"])
+    report_type = st.selectbox("Choose report type", ["Daily", "Weekly", "Monthly", "Yearly", "Custom Range"])
 
     if report_type == "Daily":
         selected_date = st.date_input("Select date for daily summary")
@@ -135,52 +153,114 @@ def view_reports():
         end = datetime(selected_month.year + (selected_month.month // 12), (selected_month.month % 12) + 1, 1)
         label = selected_month.strftime("%B %Y")
 
+    elif report_type == "Yearly":
+        selected_year = st.date_input("Select any date in the year")
+        start = datetime(selected_year.year, 1, 1)
+        end = datetime(selected_year.year + 1, 1, 1)
+        label = str(selected_year.year)
+
+    elif report_type == "Custom Range":
+        today = datetime.now().date()
+        selected_range = st.date_input("Select date range", value=(today - timedelta(days=16), today))
+        if len(selected_range) != 2:
+            st.info("Select an end date to complete the range.")
+            return
+        start = datetime.combine(selected_range[0], datetime.min.time())
+        end = datetime.combine(selected_range[1], datetime.min.time()) + timedelta(days=1)
+        label = f"{selected_range[0].strftime('%B %d, %Y')} – {selected_range[1].strftime('%B %d, %Y')}"
+
     try:
-        # 🔹 Fetch Sales
-        sales_query = supabase.table("sales").select("total_price") \
-            .gte("date_sold", start.isoformat()) \
-            .lt("date_sold", end.isoformat()) \
-            .execute()
-        sales_data = sales_query.data
-        total_sales = sum(item["total_price"] for item in sales_data) if sales_data else 0
-
-        # 🔹 Fetch Purchases
-        purchase_query = supabase.table("purchases").select("quantity_purchased", "unit_cost") \
-            .gte("created_at", start.isoformat()) \
-            .lt("created_at", end.isoformat()) \
-            .execute()
-        purchase_data = purchase_query.data
-        total_purchases = sum(item["quantity_purchased"] * item["unit_cost"] for item in purchase_data) if purchase_data else 0
+        # 🔹 Totals come from a prefix-sum index over the daily rollup (or the local replica)
+        source = report_source()
+        source.refresh()
+        index = source.index()
+
+        # ⚖️ Selected window, the window just before it, and the same window last year
+        start_day, end_day = start.date(), end.date()
+        length = end_day - start_day
+        starts = [start_day, start_day - length, shift_year(start_day, -1)]
+        ends = [end_day, start_day, shift_year(end_day, -1)]
+        sales, purchases, net = index.range_totals_many(starts, ends)
+        total_sales, total_purchases = sales[0], purchases[0]
 
         # 📋 Display Summary
         st.markdown(f"### 📅 Summary for {label}")
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("💰 Total Sales", f"UGX {total_sales:,.0f}")
+            st.metric("💰 Total Sales", f"UGX {total_sales:,.0f}", delta=f"{sales[0] - sales[1]:,.0f} vs previous period")
         with col2:
-            st.metric("📦 Total Purchases", f"UGX {total_purchases:,.0f}")
+            st.metric("📦 Total Purchases", f"UGX {total_purchases:,.0f}", delta=f"{purchases[0] - purchases[1]:,.0f} vs previous period")
 
-        net = total_sales - total_purchases
         st.markdown("---")
-        st.metric("📊 Net Flow (Sales - Purchases)", f"UGX {net:,.0f}", delta=net)
+        st.metric("📊 Net Flow (Sales - Purchases)", f"UGX {net[0]:,.0f}", delta=float(net[0]))
+
+        # 🧮 Profit matches each sale to the purchases it came from (FIFO), so stock bought in another period does not count
+        try:
+            cogs.refresh()
+            margins = cogs.margins(start_day, end_day)
+        except Exception as e:
+            st.warning(f"⚠️ Failed to load cost of goods sold: {e}")
+            margins = []
+        if len(margins):
+            detailed = with_drug_details(margins, drug_catalog.rows())
+            by_drug = gross_margin(detailed, ["drug_id", "name", "category"])
+            gross_profit, revenue = by_drug["gross_profit"].sum(), by_drug["revenue"].sum()
+            st.metric("🧮 Gross Profit (Sales - Cost of Goods Sold)", f"UGX {gross_profit:,.0f}",
+                      delta=f"{100 * gross_profit / revenue if revenue else 0:.1f}% margin", delta_color="off")
+            with st.expander("🏷️ Gross Margin by Drug and Category"):
+                columns = {"name": "Drug", "category": "Category", "units": "Units Sold", "revenue": "Sales (UGX)",
+                           "cogs": "Cost of Sales (UGX)", "gross_profit": "Gross Profit (UGX)", "margin_pct": "Margin (%)"}
+                st.dataframe(by_drug.sort_values("gross_profit", ascending=False)
+                             .rename(columns=columns)[list(columns.values())], hide_index=True)
+                st.dataframe(gross_margin(detailed, "category").rename(columns=columns)
+                             .drop(columns=["estimated_units"]), hide_index=True)
+
+        st.markdown("#### 🔁 Period Comparison")
+        st.dataframe(pd.DataFrame({
+            "Period": ["Selected", "Previous period", "Same period last year"],
+            "From": starts,
+            "To": [d - timedelta(days=1) for d in ends],
+            "Sales (UGX)": sales,
+            "Purchases (UGX)": purchases,
+            "Net Flow (UGX)": net,
+        }), hide_index=True)
     except Exception as e:
         st.error(f"❌ Failed to load report: {str(e)}")
 
 # ------------------ Manage Users ------------------ #
+USER_ROLES = ["admin", "pharmacist", "cashier", "procurement", "supervisor"]
+USER_PAGE_SIZE = 25
+
+def describe_user_change(before, after):
+    if after["delete"]:
+        return "delete_user", f"Deleted {before['email']}"
+    changes = [f"{field}: {before[field]} → {after[field]}" for field in ["role", "verified"]
+               if before[field] != after[field]]
+    return "update_user", f"Updated {before['email']} ({'; '.join(changes)})"
+
+# 💾 Write every staged change and its audit row in one call
+def commit_user_changes(staged, admin, commit_key):
+    timestamp = datetime.now(timezone.utc).isoformat()
+    updates, deleted, audit_rows = [], [], []
+    for user_id, (before, after) in staged.items():
+        if after["delete"]:
+            deleted.append(user_id)
+        else:
+            updates.append({"id": user_id, "role": after["role"], "verified": after["verified"]})
+        action, details = describe_user_change(before, after)
+        audit_rows.append({"action": action, "performed_by": admin["email"], "details": details, "timestamp": timestamp})
+    return db.update_users(updates, deleted, audit_rows, commit_key)
+
 def manage_users(auth_mode="Register"):
     st.title("👥 Manage Users")
 
+    admin = require_login()
+    if not admin or admin.get("role") != "admin":
+        st.error("🔐 Admin access required to manage users.")
+        st.stop()
+
     if auth_mode == "Register":
         st.subheader("📝 User Registration")
-
-        try:
-            if not require_admin():
-                st.error("🔐 Admin access required to register users.")
-                st.stop()
-        except Exception as e:
-            st.error(f"⚠️ Admin check failed: {str(e)}")
-            st.stop()
-
         st.markdown("Register a new user with secure credentials and role assignment.")
         st.markdown("---")
 
@@ -189,76 +269,113 @@ def manage_users(auth_mode="Register"):
         password = st.text_input("Password", type="password")
         role = st.selectbox("Role", ["pharmacist", "admin", "cashier", "procurement", "supervisor"])
 
-        if st.button("Register"):
+        submitted = st.button("Register")
+        register_key = request_key("register_user", submitted)
+        if submitted:
             if not name or not email or not password:
                 st.warning("⚠️ Please fill in all fields.")
             else:
                 try:
                     hashed_pw = hash_password(password)
 
-                    existing = supabase.table("users").select("id").eq("email", email).execute().data
+                    existing = db.find_user_by_email(email)
                     if existing:
                         st.error("❌ Email already registered.")
                     else:
-                        supabase.table("users").insert({
+                        db.insert_user({
                             "name": name,
                             "email": email,
                             "password_hash": hashed_pw,
                             "role": role,
                             "verified": False
-                        }).execute()
+                        }, register_key)
 
-                        supabase.table("audit_logs").insert({
-                            "action": "register_user",
-                            "performed_by": st.session_state["user"]["email"],
-                            "details": f"Registered {email} as {role}",
-                            "timestamp": datetime.utcnow().isoformat()
-                        }).execute()
+                        audit.log("register_user", admin["email"], f"Registered {email} as {role}")
 
                         st.success("✅ Registration successful! You can now log in.")
                 except Exception as e:
                     st.error(f"❌ Registration failed: {str(e)}")
 
     # ------------------ View & Manage Existing Users ------------------ #
+    st.markdown("### 🔧 Admin Controls")
+
+    # 🗂️ Edits are staged here (user id → (as loaded, as edited)) until committed
+    staged = st.session_state.setdefault("staged_user_changes", {})
+
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        search = st.text_input("🔎 Search name or email").strip()
+    with col2:
+        role_filter = st.selectbox("Role filter", ["All"] + USER_ROLES)
+    filters = db.user_filters(search or None, None if role_filter == "All" else role_filter)
+
     try:
-        query = supabase.table("users").select("*").execute()
-        users = query.data
+        total = db.count_rows("users", filters)
+        pages = max(1, -(-total // USER_PAGE_SIZE))
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+        users = db.fetch_user_page(filters, offset=(page - 1) * USER_PAGE_SIZE, limit=USER_PAGE_SIZE)
     except Exception as e:
         st.error(f"❌ Failed to load users: {str(e)}")
         return
 
     if not users:
         st.info("No users found.")
-        return
-
-    df = pd.DataFrame(users)
-    st.dataframe(df[["id", "name", "email", "role", "verified"]])
-
-    st.markdown("### 🔧 Admin Controls")
+    else:
+        # 📝 Show the page with anything already staged for it
+        loaded = pd.DataFrame(users).assign(delete=False).set_index("id")
+        shown = loaded.copy()
+        for user_id, (_, after) in staged.items():
+            if user_id in shown.index:
+                shown.loc[user_id, ["role", "verified", "delete"]] = [after["role"], after["verified"], after["delete"]]
+
+        edited = st.data_editor(
+            shown,
+            key=f"users_editor_{search}_{role_filter}_{page}_{st.session_state.get('users_editor_seq', 0)}",
+            disabled=["name", "email"],
+            column_config={
+                "role": st.column_config.SelectboxColumn("Role", options=USER_ROLES, required=True),
+                "verified": st.column_config.CheckboxColumn("Verified"),
+                "delete": st.column_config.CheckboxColumn("Delete"),
+            },
+        )
+
+        # 🔁 Restage this page: keep rows that differ from what was loaded
+        for user_id, row in edited.iterrows():
+            before = loaded.loc[user_id]
+            after = {"role": row["role"], "verified": bool(row["verified"]), "delete": bool(row["delete"])}
+            if after["delete"] or after["role"] != before["role"] or after["verified"] != bool(before["verified"]):
+                if user_id == admin.get("id") and (after["delete"] or after["role"] != "admin"):
+                    st.warning("⚠️ You cannot delete your own account or remove your own admin role.")
+                    continue
+                staged[user_id] = ({"email": before["email"], "role": before["role"],
+                                    "verified": bool(before["verified"])}, after)
+            else:
+                staged.pop(user_id, None)
 
-    for user in users:
-        col1, col2, col3, col4 = st.columns([3, 2, 2, 3])
-        with col1:
-            st.write(f"**{user['name']}** ({user['email']}) — *{user['role']}*")
+    if not staged:
+        return
 
-        with col2:
-            verify_toggle = st.checkbox("Verified", value=user["verified"], key=f"verify_{user['id']}")
-            if verify_toggle != user["verified"]:
-                supabase.table("users").update({"verified": verify_toggle}).eq("id", user["id"]).execute()
-                st.success(f"{user['name']} verification updated.")
-
-        with col3:
-            if st.button("🗑️ Delete", key=f"delete_{user['id']}"):
-                supabase.table("users").delete().eq("id", user["id"]).execute()
-                st.warning(f"{user['name']} deleted.")
-
-        with col4:
-            new_role = st.selectbox("Change Role", ["admin", "pharmacist", "cashier", "procurement", "supervisor"],
-                                    index=["admin", "pharmacist", "cashier", "procurement", "supervisor"].index(user["role"]),
-                                    key=f"role_{user['id']}")
-            if new_role != user["role"]:
-                supabase.table("users").update({"role": new_role}).eq("id", user["id"]).execute()
-                st.success(f"{user['name']}'s role updated to {new_role}.")
+    st.markdown(f"#### 🗂️ {len(staged)} staged change(s)")
+    st.dataframe(pd.DataFrame([{"user": before["email"], "change": describe_user_change(before, after)[1]}
+                               for before, after in staged.values()]), hide_index=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        commit = st.button(f"💾 Commit {len(staged)} Change(s)")
+        commit_key = request_key("commit_user_changes", commit)
+    with col2:
+        discard = st.button("↩️ Discard Staged Changes")
+
+    if discard or commit:
+        if commit:
+            try:
+                commit_user_changes(staged, admin, commit_key)
+                st.success(f"✅ {len(staged)} change(s) saved.")
+            except Exception as e:
+                st.error(f"❌ Failed to save changes: {str(e)}")
+                return
+        staged.clear()
+        st.session_state["users_editor_seq"] = st.session_state.get("users_editor_seq", 0) + 1
 
 # ------------------ Main Dashboard Router ------------------ #
 def show_dashboard():
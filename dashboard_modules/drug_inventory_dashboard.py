@@ -1,14 +1,22 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+import math
 import streamlit as st
 import pandas as pd
+from datetime import date, datetime, timedelta, timezone
 
-# 🔐 Load Supabase credentials from .env
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from modules import fetch_data as db
+from modules.catalog import drug_catalog, lot_catalog, supplier_catalog
+from modules.drug_edits import apply_markup, changed_records, changed_rows
+from modules.expiry_index import expiry_index
+from modules.stock_take import STOCK_TAKE_REASON, count_sheet, merge_counts, to_levels, variances
+from utils.logger import audit
+from components.request_key import request_key
+from utils.validators import validate_counts
+
+# 📊 Filter choices
+STOCK_LEVELS = ["All", "Out of stock", "Low stock", "In stock"]
+EXPIRY_WINDOWS = {"All": None, "Expired": 0, "Within 30 days": 30, "Within 90 days": 90, "Within 180 days": 180}
+SORT_COLUMNS = {"Name": "name", "Price": "price", "Stock": "stock_quantity", "Expiry": "expiry_date"}
+PAGE_SIZES = [25, 50, 100]
 
 # 🔐 Role check helper
 def require_role(allowed_roles):
@@ -21,6 +29,262 @@ def require_role(allowed_roles):
         return False
     return True
 
+# 🔢 Total matching rows; cached per filter set and dropped when the catalog changes
+@st.cache_data(ttl=60, show_spinner=False)
+def count_drugs(filter_args, catalog_version):
+    return db.count_rows("drugs", db.drug_filters(**dict(filter_args)))
+
+# 🧾 Page rows as a frame the grid can show or edit
+def to_frame(drug_data):
+    df = pd.DataFrame(drug_data)
+    df["supplier"] = df["suppliers"].apply(lambda s: s.get("name") if isinstance(s, dict) else None)
+    df["expiry_date"] = pd.to_datetime(df["expiry_date"]).dt.date  # Format date
+    return df.drop(columns=["suppliers"])
+
+# ✏️ Edit the loaded page and save only the changed rows
+def edit_page(page_key, load_page):
+    # 📌 The rows as first loaded are kept until saved, so edits are checked against them
+    snapshot = st.session_state.get("inventory_snapshot")
+    if snapshot is None or snapshot["page"] != page_key:
+        drug_data = load_page()
+        if not drug_data:
+            st.info("No drugs on this page.")
+            return
+        snapshot = {"page": page_key, "rows": to_frame(drug_data), "seq": st.session_state.get("inventory_seq", 0) + 1}
+        st.session_state["inventory_snapshot"] = snapshot
+        st.session_state["inventory_seq"] = snapshot["seq"]
+    original = snapshot["rows"]
+
+    edited = st.data_editor(
+        original,
+        key=f"inventory_editor_{snapshot['seq']}",
+        hide_index=True,
+        disabled=["id", "supplier_id", "supplier"],
+        column_config={
+            "category": st.column_config.SelectboxColumn("category", options=db.DRUG_CATEGORIES, required=True),
+            "price": st.column_config.NumberColumn("price", min_value=0),
+            "stock_quantity": st.column_config.NumberColumn("stock_quantity", min_value=0, step=1),
+        },
+    )
+    changed, before = changed_rows(original, edited)
+    st.caption(f"✏️ {len(changed)} changed row(s)")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        save = st.button("💾 Save Changes", disabled=changed.empty)
+        save_key = request_key("inventory_save", save)
+    with col2:
+        if st.button("🔄 Discard Edits and Reload"):
+            st.session_state.pop("inventory_snapshot", None)
+            st.rerun()
+
+    if save:
+        try:
+            # 💾 One write for every changed row, rejected if anyone else changed them first
+            saved = db.update_drugs(*changed_records(changed, before), save_key)
+            drug_catalog.invalidate()
+            # 📦 Stock edits add or write off lots in the database
+            lot_catalog.invalidate()
+            audit.log("edit_drugs", st.session_state["user"].get("email"),
+                      f"Edited {len(saved)} drug(s): {', '.join(changed['name'].astype(str))}")
+            st.session_state["inventory_snapshot"] = {**snapshot, "rows": edited, "seq": snapshot["seq"] + 1}
+            st.session_state["inventory_seq"] = snapshot["seq"] + 1
+            st.success(f"✅ Saved {len(saved)} drug(s).")
+        except db.StaleRows as e:
+            st.session_state.pop("inventory_snapshot", None)
+            st.error(f"⚠️ Nothing was saved: someone else changed these drugs after you loaded them ({e}). "
+                     "Reload to see their changes and edit again.")
+        except Exception as e:
+            st.error(f"❌ Failed to save changes: {e}")
+
+# 📈 Percentage price change across every drug matching the filters
+def bulk_price_change(filter_args, total):
+    with st.expander("📈 Bulk Price Change"):
+        st.caption(f"Applies to all {total} drug(s) matching the filters above, not just this page.")
+        percent = st.number_input("Change (%)", min_value=-90.0, max_value=500.0, value=5.0, step=0.5)
+        # 🔑 A repeated click reapplies nothing: the server answers it from the first one
+        submitted = st.button(f"📈 Apply {percent:+g}% to {total} Drug(s)")
+        reprice_key = request_key("bulk_price_change", submitted)
+        if submitted and percent:
+            try:
+                current = to_frame(db.fetch_all("drugs", db.DRUG_GRID_COLUMNS, filters=db.drug_filters(**filter_args)))
+                repriced = apply_markup(current, percent)
+                changed, before = changed_rows(current, repriced)
+                saved = db.update_drugs(*changed_records(changed, before), reprice_key)
+                drug_catalog.invalidate()
+                audit.log("reprice_drugs", st.session_state["user"].get("email"),
+                          f"Changed the price of {len(saved)} drug(s) by {percent:+g}% "
+                          f"(filters: {', '.join(f'{k}={v}' for k, v in filter_args.items() if v is not None) or 'none'})")
+                st.session_state.pop("inventory_snapshot", None)
+                st.success(f"✅ Repriced {len(saved)} drug(s).")
+            except db.StaleRows as e:
+                st.error(f"⚠️ Nothing was saved: some drugs changed while repricing ({e}). Please try again.")
+            except Exception as e:
+                st.error(f"❌ Failed to change prices: {e}")
+
+# ⏳ Lots expiring soon and the value tied up in them
+def expiring_stock():
+    with st.expander("⏳ Expiring Stock"):
+        days = st.slider("Expiring within (days)", min_value=7, max_value=365, value=90, step=7)
+        try:
+            index = expiry_index()
+        except Exception as e:
+            st.error(f"❌ Failed to load stock lots: {e}")
+            return
+        names = {drug["id"]: drug["name"] for drug in drug_catalog.rows()}
+
+        expired = index.expired()
+        if expired.units and st.button(f"🗑️ Write Off {expired.units:,} Expired Unit(s)"):
+            try:
+                written_off = db.write_off_expired()
+                drug_catalog.invalidate()
+                lot_catalog.invalidate()
+                audit.log("write_off_expired", st.session_state["user"].get("email"),
+                          f"Wrote off {sum(row['quantity'] for row in written_off)} expired unit(s) "
+                          f"of {len(written_off)} drug(s)")
+                st.success(f"✅ Wrote off expired stock of {len(written_off)} drug(s).")
+                index = expiry_index()
+                expired = index.expired()
+            except Exception as e:
+                st.error(f"❌ Failed to write off expired stock: {e}")
+
+        for title, exposure in (("Already expired", expired), (f"Expiring in {days} days", index.expiring(days))):
+            st.markdown(f"**{title}**")
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Units", f"{exposure.units:,}")
+            col2.metric("Value at cost (UGX)", f"{exposure.cost_value:,.0f}")
+            col3.metric("Value at price (UGX)", f"{exposure.retail_value:,.0f}")
+            if exposure.lots:
+                st.dataframe(pd.DataFrame([{
+                    "Drug": names.get(lot["drug_id"], lot["drug_id"]),
+                    "Expiry Date": lot["expiry_date"],
+                    "Units": lot["quantity_remaining"],
+                    "Unit Cost (UGX)": lot["unit_cost"],
+                } for lot in exposure.lots]), hide_index=True)
+
+# 🕰️ Stock levels on a past date and each drug's movement ledger
+def stock_history():
+    with st.expander("🕰️ Stock History"):
+        names = {drug["id"]: drug["name"] for drug in drug_catalog.rows()}
+        on = st.date_input("Stock at the end of", value=date.today() - timedelta(days=1), max_value=date.today())
+        try:
+            levels = db.fetch_stock_on(datetime.combine(on + timedelta(days=1), datetime.min.time()))
+        except Exception as e:
+            st.error(f"❌ Failed to load stock history: {e}")
+            return
+        if levels:
+            st.dataframe(pd.DataFrame([{"Drug": names.get(row["drug_id"], row["drug_id"]), "Stock": row["quantity"]}
+                                       for row in levels]).sort_values("Drug"), hide_index=True)
+        else:
+            st.info("No stock was recorded by that date.")
+
+        drug_id = st.selectbox("Movements for", list(names), format_func=names.get, index=None)
+        if drug_id is not None:
+            movements = db.fetch_movements(drug_id)
+            if movements:
+                st.dataframe(pd.DataFrame(movements).drop(columns=["id", "drug_id"]), hide_index=True)
+            else:
+                st.info("No movements recorded for this drug.")
+
+# 📋 Physical count: fill in a count sheet, review the variances, post them in one call
+def stock_take():
+    sheet = st.session_state.get("stock_take_sheet")
+    if sheet is None:
+        st.caption("The count sheet lists every drug with its recorded stock. Drugs left blank are not adjusted.")
+        if st.button("📋 Start Count Sheet"):
+            try:
+                # 📥 Count against current figures, not the cached catalog
+                drug_catalog.invalidate()
+                sheet = {"rows": count_sheet(drug_catalog.rows()), "seq": 1, "uploads": set()}
+            except Exception as e:
+                st.error(f"❌ Failed to load drugs: {e}")
+                return
+            st.session_state["stock_take_sheet"] = sheet
+            st.rerun()
+        return
+
+    rows = st.data_editor(
+        sheet["rows"],
+        key=f"stock_take_editor_{sheet['seq']}",
+        hide_index=True,
+        disabled=["id", "name", "category", "stock_quantity"],
+        column_config={"counted": st.column_config.NumberColumn("counted", min_value=0, step=1)},
+    )
+
+    # 📑 Counts from a CSV, e.g. this sheet downloaded, filled in offline and uploaded again
+    st.download_button("⬇️ Download Count Sheet", rows.to_csv(index=False), "count_sheet.csv", "text/csv")
+    upload = st.file_uploader("📑 Upload Counts (CSV with counted and id or drug name)", type=["csv"])
+    if upload is not None and upload.file_id not in sheet["uploads"]:
+        try:
+            counts, errors = validate_counts(pd.read_csv(upload))
+            merged, unmatched = merge_counts(rows, counts)
+        except Exception as e:
+            st.error(f"❌ Could not read the counts: {e}")
+        else:
+            sheet["uploads"].add(upload.file_id)
+            st.session_state["stock_take_sheet"] = {**sheet, "rows": merged, "seq": sheet["seq"] + 1}
+            st.session_state["stock_take_upload_issues"] = (errors, unmatched)
+            st.rerun()
+    errors, unmatched = st.session_state.get("stock_take_upload_issues", (pd.DataFrame(), pd.DataFrame()))
+    if len(errors):
+        st.warning(f"⚠️ {len(errors)} uploaded row(s) were rejected.")
+        st.dataframe(errors, hide_index=True)
+    if len(unmatched):
+        st.warning(f"⚠️ {len(unmatched)} uploaded row(s) match no drug.")
+        st.dataframe(unmatched, hide_index=True)
+
+    # 🧮 Variances for every counted drug at once
+    adjustments = variances(rows, {drug["id"]: drug["price"] for drug in drug_catalog.rows()})
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Drugs counted", f"{int(rows['counted'].notna().sum()):,} of {len(rows):,}")
+    col2.metric("Drugs to adjust", f"{len(adjustments):,}", f"{int(adjustments['variance'].sum()):+,} unit(s)")
+    col3.metric("Variance at price (UGX)", f"{adjustments['value'].sum():,.0f}")
+    if not adjustments.empty:
+        st.dataframe(adjustments.drop(columns=["id"]), hide_index=True)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        post = st.button(f"✅ Post {len(adjustments):,} Adjustment(s)", disabled=adjustments.empty)
+        post_key = request_key("stock_take", post)
+    with col2:
+        # 🔄 New recorded figures for the same counts, e.g. after sales during the count
+        refresh = st.button("🔄 Refresh Recorded Stock")
+    with col3:
+        discard = st.button("🗑️ Discard Count Sheet")
+
+    if refresh or discard:
+        if refresh:
+            drug_catalog.invalidate()
+            fresh = count_sheet(drug_catalog.rows())
+            fresh["counted"] = fresh["id"].map(rows.set_index("id")["counted"]).astype("Int64")
+            st.session_state["stock_take_sheet"] = {**sheet, "rows": fresh, "seq": sheet["seq"] + 1}
+        else:
+            st.session_state.pop("stock_take_sheet", None)
+        st.session_state.pop("stock_take_upload_issues", None)
+        st.rerun()
+
+    if post:
+        try:
+            # 💾 Every adjustment and its audit row in one transaction, refused if any counted drug's stock moved meanwhile
+            performed_by = st.session_state["user"].get("email")
+            timestamp = datetime.now(timezone.utc).isoformat()
+            audit_rows = [{"action": "stock_take", "performed_by": performed_by, "timestamp": timestamp,
+                           "details": f"{row['name']} (ID {row['id']}): counted {row['counted']}, "
+                                      f"recorded {row['stock_quantity']} ({row['variance']:+d})"}
+                          for row in adjustments.to_dict("records")]
+            saved = db.set_stock_levels(to_levels(adjustments), STOCK_TAKE_REASON, audit_rows, post_key)
+            drug_catalog.invalidate()
+            lot_catalog.invalidate()
+            st.session_state.pop("stock_take_sheet", None)
+            st.session_state.pop("stock_take_upload_issues", None)
+            st.success(f"✅ Adjusted the stock of {len(saved)} drug(s), net {int(adjustments['variance'].sum()):+,} "
+                       f"unit(s).")
+        except db.StaleRows as e:
+            st.error(f"⚠️ Nothing was posted: stock moved while counting ({e}). "
+                     "Refresh the recorded stock, recount those drugs and post again.")
+        except Exception as e:
+            st.error(f"❌ Failed to post the stock-take: {e}")
+
 def run():
     st.title("📦 Drug Inventory Dashboard")
 
@@ -28,13 +292,78 @@ def run():
     if not require_role(["pharmacist", "admin"]):
         st.stop()
 
-    # Fetch drugs from Supabase
-    response = supabase.table("drugs").select("*").execute()
-    drug_data = response.data
+    # 🔎 Filters
+    suppliers = {s["name"]: s["id"] for s in supplier_catalog.rows()}
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        category = st.selectbox("Category", ["All"] + db.DRUG_CATEGORIES)
+    with col2:
+        supplier = st.selectbox("Supplier", ["All"] + list(suppliers))
+    with col3:
+        stock_level = st.selectbox("Stock Level", STOCK_LEVELS)
+    with col4:
+        expiry_window = st.selectbox("Expiry", list(EXPIRY_WINDOWS))
+
+    low_stock = 10
+    if stock_level == "Low stock":
+        low_stock = st.number_input("Low stock threshold", min_value=1, value=10)
+
+    filter_args = {
+        "category": None if category == "All" else category,
+        "supplier_id": None if supplier == "All" else suppliers[supplier],
+        "min_stock": {"Low stock": 1, "In stock": low_stock + 1}.get(stock_level),
+        "max_stock": {"Out of stock": 0, "Low stock": low_stock}.get(stock_level),
+    }
+    days = EXPIRY_WINDOWS[expiry_window]
+    if days is not None:
+        filter_args["expires_before"] = date.today() + timedelta(days=days)
+        if days:
+            filter_args["expires_from"] = date.today()
+
+    # ↕️ Sorting and paging
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort_label = st.selectbox("Sort by", list(SORT_COLUMNS))
+    with col2:
+        descending = st.toggle("Descending")
+    with col3:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES)
 
-    if drug_data:
-        df = pd.DataFrame(drug_data)
-        df["expiry_date"] = pd.to_datetime(df["expiry_date"]).dt.date  # Format date
-        st.dataframe(df)
-    else:
+    try:
+        total = count_drugs(tuple(sorted(filter_args.items())), drug_catalog.version)
+    except Exception as e:
+        st.error(f"❌ Failed to load inventory: {e}")
+        return
+
+    if not total:
         st.info("No drugs found in inventory.")
+        return
+
+    pages = math.ceil(total / page_size)
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+
+    # 📥 Only the visible page is fetched
+    def load_page():
+        return db.fetch_drug_page(db.drug_filters(**filter_args), SORT_COLUMNS[sort_label], descending,
+                                  offset=(page - 1) * page_size, limit=page_size)
+
+    bulk_price_change(filter_args, total)
+    expiring_stock()
+    stock_history()
+
+    if st.toggle("📋 Stock-Take Mode"):
+        stock_take()
+        return
+
+    if st.toggle("✏️ Edit Mode"):
+        page_key = (tuple(sorted(filter_args.items())), sort_label, descending, page_size, page)
+        edit_page(page_key, load_page)
+        return
+
+    drug_data = load_page()
+    if not drug_data:
+        st.info("No drugs on this page.")
+        return
+    df = to_frame(drug_data)
+    st.caption(f"Showing {len(df)} of {total} drugs")
+    st.dataframe(df.drop(columns=["supplier_id"]), hide_index=True)
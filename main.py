@@ -1,19 +1,51 @@
+import importlib
+import logging
+import sys
+import time
+from typing import Callable, NamedTuple, Optional
+
 import streamlit as st
 
-# ✅ Folder-level imports
-from auth import login, session
-from dashboard_modules import dashboard, drug_inventory_dashboard, finance, inventory, summary
-from components import navbar, sidebar, metrics
-from utils import validators, logger
-
-# ✅ Root-level imports
-import auth_app
-import add_drug_app
-import record_sale_app
-import record_purchase_app
-import summary_dashboard
-import home_app
-import manage_users_app  # ✅ Admin-only module
+log = logging.getLogger(__name__)
+
+# ------------------ Lazy Module Loading ------------------ #
+# ⏱️ Budget for importing the login page on a cold process. The login path
+# must not pull in pandas or the analytics pages.
+LOGIN_IMPORT_BUDGET_MS = 1000
+
+
+def load_page(module_name):
+    """Import a page module on first use and log how long the import took."""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    log.info("Imported %s in %.0f ms", module_name, elapsed_ms)
+    if module_name == ROUTES["Login"].module and elapsed_ms > LOGIN_IMPORT_BUDGET_MS:
+        log.warning("Login import took %.0f ms (budget %d ms)", elapsed_ms, LOGIN_IMPORT_BUDGET_MS)
+    return module
+
+
+class Route(NamedTuple):
+    module: str
+    roles: Optional[list]  # None = any logged-in user
+    loader: Callable = load_page
+
+
+# ------------------ Route Table ------------------ #
+# 🗺️ Pages are only imported when first selected.
+ROUTES = {
+    "Login": Route("auth.auth_app", None),
+    "Home": Route("home_app", None),
+    "Dashboard": Route("dashboard_modules.dashboard", ["admin", "supervisor"]),
+    "Add Drug": Route("modules.add_drug_app", ["pharmacist", "admin"]),
+    "Record Sale": Route("record_sale_app", ["cashier", "pharmacist", "admin"]),
+    "Record Purchase": Route("record_purchase_app", ["procurement", "admin"]),
+    "Inventory": Route("dashboard_modules.drug_inventory_dashboard", ["pharmacist", "admin"]),
+    "Summary": Route("summary_dashboard", ["admin", "supervisor"]),
+    "Manage Users": Route("manage_users_app", ["admin"]),  # ✅ Admin-only module
+}
 
 # ------------------ App Entry Point ------------------ #
 def run():
@@ -28,16 +60,7 @@ def run():
     st.session_state.setdefault("redirect_to_home", False)
 
     # ------------------ Navigation Modules ------------------ #
-    modules = [
-        "Home",
-        "Dashboard",
-        "Add Drug",
-        "Record Sale",
-        "Record Purchase",
-        "Inventory",
-        "Summary",
-        "Manage Users"
-    ]
+    modules = [name for name in ROUTES if name != "Login"]
 
     # ------------------ Authenticated View ------------------ #
     if st.session_state.user:
@@ -69,45 +92,19 @@ def run():
 
     # ------------------ Module Routing ------------------ #
     option = st.session_state.option
+    route = ROUTES.get(option)
 
     if option == "Login":
-        auth_app.run()
+        route.loader(route.module).run()
         if st.session_state.user and not st.session_state.redirect_to_home:
             st.success("✅ Login successful! Redirecting to Home...")
             st.session_state.redirect_to_home = True
             st.experimental_rerun()
 
-    elif option == "Home":
-        if require_login():
-            home_app.run()
-
-    elif option == "Dashboard":
-        if require_role(["admin", "supervisor"]):
-            dashboard.run()
-
-    elif option == "Add Drug":
-        if require_role(["pharmacist", "admin"]):
-            add_drug_app.run()
-
-    elif option == "Record Sale":
-        if require_role(["cashier", "pharmacist", "admin"]):
-            record_sale_app.run()
-
-    elif option == "Record Purchase":
-        if require_role(["procurement", "admin"]):
-            record_purchase_app.run()
-
-    elif option == "Inventory":
-        if require_role(["pharmacist", "admin"]):
-            drug_inventory_dashboard.run()
-
-    elif option == "Summary":
-        if require_role(["admin", "supervisor"]):
-            summary_dashboard.run()
-
-    elif option == "Manage Users":
-        if require_role(["admin"]):
-            manage_users_app.run()
+    elif route:
+        allowed = require_login() if route.roles is None else require_role(route.roles)
+        if allowed:
+            route.loader(route.module).run()
 
     else:
         st.error("⚠️ Unknown module selected. Returning to Home.")
@@ -1,5 +1,6 @@
 import streamlit as st
 from auth.supabase_client import create_user  # Ensure this function accepts name, email, password, role
+from utils.logger import audit
 
 def run():
     st.subheader("👥 Register New User")
@@ -15,6 +16,7 @@ def run():
         else:
             result = create_user(name=name, email=email, password=password, role=role)
             if result.get("success"):
+                audit.log("register_user", st.session_state["user"].get("email"), f"Registered {email} as {role}")
                 st.success("✅ User registered successfully.")
             else:
                 st.error(f"❌ Registration failed: {result.get('error', 'Unknown error')}")
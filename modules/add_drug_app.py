@@ -1,13 +1,9 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
 import streamlit as st
 
-# 🔐 Load Supabase credentials from .env
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from modules import fetch_data as db
+from modules.catalog import drug_catalog, supplier_catalog
+from utils.logger import audit
+from components.request_key import request_key
 
 def run():
     st.title("🩺 Add New Drug to Inventory")
@@ -28,14 +24,14 @@ def run():
 
     # Drug details
     name = st.text_input("Drug Name")
-    category = st.selectbox("Category", ["Pain Relief", "Antibiotic", "Antihistamine", "Diabetes", "Other"])
+    category = st.selectbox("Category", db.DRUG_CATEGORIES)
     description = st.text_area("Description")
     price = st.number_input("Price (UGX)", min_value=0)
     stock_quantity = st.number_input("Stock Quantity", min_value=0)
     expiry_date = st.date_input("Expiry Date (optional)")
 
     # Fetch suppliers from Supabase
-    supplier_data = supabase.table("suppliers").select("id", "name").execute().data
+    supplier_data = supplier_catalog.rows()
 
     # Check if supplier data is available
     if supplier_data:
@@ -47,7 +43,9 @@ def run():
         selected_supplier_id = None
 
     # Submit button
-    if st.button("➕ Add Drug"):
+    submitted = st.button("➕ Add Drug")
+    add_key = request_key("add_drug", submitted)
+    if submitted:
         drug = {
             "name": name,
             "category": category,
@@ -57,5 +55,8 @@ def run():
             "expiry_date": expiry_date.isoformat() if expiry_date else None,
             "supplier_id": selected_supplier_id
         }
-        response = supabase.table("drugs").insert(drug).execute()
+        db.insert_drug(drug, add_key)
+        drug_catalog.invalidate()
+        audit.log("add_drug", st.session_state["user"].get("email"),
+                  f"Added {name} ({category}): {stock_quantity} units at UGX {price:,}")
         st.success(f"✅ Drug added: {name}")
@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from modules import fetch_data as db
+from modules.search_index import SearchIndex
+
+# ⏱️ Seconds a loaded catalog is served before it is fetched again
+CATALOG_TTL_S = 30
+
+
+class Catalog:
+    """Process-wide cached copy of a small reference table.
+
+    Every change bumps `version`: a full `invalidate()` after inserts, or a
+    write-through `update()` of one row after a stock change. Pages use it
+    to key caches built from the rows; stock checks belong to the database.
+    """
+
+    def __init__(self, loader: Callable[[], list[db.Row]], ttl: float = CATALOG_TTL_S):
+        self._loader = loader
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._rows: Optional[list[db.Row]] = None
+        self._loaded_at = 0.0
+        self.version = 0
+        self._search = SearchIndex()
+        self._indexed_version = None
+
+    def snapshot(self) -> tuple[int, list[db.Row]]:
+        """Return `(version, rows)`, reloading first if the TTL has lapsed."""
+        with self._lock:
+            if self._rows is None or time.monotonic() - self._loaded_at > self._ttl:
+                rows = self._loader()
+                if rows != self._rows:
+                    self._rows = rows
+                    self.version += 1
+                self._loaded_at = time.monotonic()
+            return self.version, self._rows
+
+    def rows(self) -> list[db.Row]:
+        return self.snapshot()[1]
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[Any, str, float]]:
+        """Ranked fuzzy name matches; the index re-syncs only changed rows when the version moves."""
+        version, rows = self.snapshot()
+        with self._lock:
+            if self._indexed_version != version:
+                self._search.sync(rows)
+                self._indexed_version = version
+            return self._search.search(query, limit)
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self.version += 1
+
+    def update(self, row_id: Any, changes: db.Row):
+        """Apply a write that already reached the database to the cached row."""
+        with self._lock:
+            if self._rows is not None:
+                self._rows = [{**row, **changes} if row["id"] == row_id else row for row in self._rows]
+            self.version += 1
+
+
+# 🌐 Shared by the sale, purchase and add-drug pages
+drug_catalog = Catalog(lambda: db.fetch_drugs(db.DRUG_COLUMNS))
+supplier_catalog = Catalog(db.fetch_suppliers)
+# 📦 Lots with stock, behind the expiry index
+lot_catalog = Catalog(db.fetch_lots)
@@ -0,0 +1,438 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from modules import fetch_data as db
+from modules.rollup import PERIOD_START, instant
+
+# 📁 FIFO state and daily margins; survives Streamlit restarts
+COGS_PATH = os.getenv(
+    "COGS_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "cogs.sqlite3"),
+)
+
+# ⏱️ How long margins are served before pulling new sales and purchases
+COGS_TTL_S = 60
+# 🔢 A drug's slot goes in the bits above this one in a breakpoint key
+_SLOT_SHIFT = 40
+# 🔢 Bumped when the stored state changes meaning; an older file is dropped and rebuilt from the database
+_SCHEMA_VERSION = 2
+
+_TABLES = ("openings", "layers", "cursor", "seen_sales", "margins", "meta")
+_SCHEMA = """
+pragma journal_mode = wal;
+create table if not exists openings (
+    drug_id  primary key,
+    quantity integer not null
+);
+create table if not exists layers (
+    id        integer primary key autoincrement,
+    drug_id   not null,
+    quantity  integer not null,
+    unit_cost real
+);
+create table if not exists cursor (
+    drug_id primary key,
+    used    integer not null
+);
+create table if not exists seen_sales (id primary key);
+create table if not exists margins (
+    day             text not null,
+    drug_id         not null,
+    units           integer not null,
+    revenue         real not null,
+    cogs            real not null,
+    estimated_units integer not null,
+    primary key (day, drug_id)
+);
+create table if not exists meta (key text primary key, value text not null);
+"""
+
+
+def _other_movements(after: Optional[int], gains: bool) -> list[db.Row]:
+    """Ledger gains (or losses) past id `after` that are not sales, purchases or opening balances.
+
+    These are write-offs, stock-take and reconciliation corrections and
+    direct edits.
+    """
+    def apply(query):
+        query = query.neq("reason", "sale").neq("reason", "purchase").neq("reason", "opening")
+        return query.gt("change", 0) if gains else query.lt("change", 0)
+
+    rows: list[db.Row] = []
+    for chunk in db.iter_chunks("stock_movements", "id, drug_id, change, created_at",
+                                after=after, filters=apply, prefetch=True):
+        rows.extend(chunk)
+    return rows
+
+
+def _take_until(pending: list[db.Row], until: Optional[str]) -> list[db.Row]:
+    """Remove and return the leading movements made at or before `until` (all of them if it is None)."""
+    count = len(pending)
+    if until is not None:
+        cutoff, count = instant(until), 0
+        while count < len(pending) and instant(pending[count]["created_at"]) <= cutoff:
+            count += 1
+    taken = pending[:count]
+    del pending[:count]
+    return taken
+
+
+class _Curve:
+    """Every drug's FIFO cost curve: cost of its first `q` units taken in, for any `q`.
+
+    A drug's layers are its opening stock, then its purchases and stock
+    gains in the order they came in. Layers with no cost of their own
+    (opening stock, gains) take the drug's last unit cost before them, else
+    its first after, and their units count as estimated. Each layer adds a
+    breakpoint `(units before it, their cost, how many were estimated, its
+    unit cost, whether it is estimated)`. One more breakpoint per drug sits
+    at the end and keeps the last unit cost for units beyond every layer,
+    all estimated. Keys pack the drug's slot above the unit count, so one
+    `searchsorted` finds the segment for every sale at once.
+    """
+
+    def __init__(self, slots: np.ndarray, quantities: np.ndarray, unit_costs: np.ndarray):
+        frame = pd.DataFrame({"slot": slots, "quantity": quantities, "unit_cost": unit_costs})
+        frame["estimated"] = frame["unit_cost"].isna().astype(float)
+        costs = frame.groupby("slot")["unit_cost"].ffill()
+        frame["unit_cost"] = costs.groupby(frame["slot"]).bfill().fillna(0.0)
+        frame["cum_qty"] = frame.groupby("slot")["quantity"].cumsum()
+        frame["cum_cost"] = (frame["quantity"] * frame["unit_cost"]).groupby(frame["slot"]).cumsum()
+        frame["cum_est"] = (frame["quantity"] * frame["estimated"]).groupby(frame["slot"]).cumsum()
+
+        starts = pd.DataFrame({
+            "slot": frame["slot"],
+            "qty": frame["cum_qty"] - frame["quantity"],
+            "cost": frame["cum_cost"] - frame["quantity"] * frame["unit_cost"],
+            "est": frame["cum_est"] - frame["quantity"] * frame["estimated"],
+            "rate": frame["unit_cost"],
+            "est_rate": frame["estimated"],
+        })
+        last = frame.groupby("slot").tail(1)
+        ends = pd.DataFrame({"slot": last["slot"], "qty": last["cum_qty"], "cost": last["cum_cost"],
+                             "est": last["cum_est"], "rate": last["unit_cost"], "est_rate": 1.0})
+        points = pd.concat([starts, ends], ignore_index=True)
+
+        keys = (points["slot"].to_numpy(np.int64) << _SLOT_SHIFT) + points["qty"].to_numpy(np.int64)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.slot = points["slot"].to_numpy(np.int64)[order]
+        self.qty = points["qty"].to_numpy(np.int64)[order]
+        self.cost = points["cost"].to_numpy(float)[order]
+        self.est = points["est"].to_numpy(float)[order]
+        self.rate = points["rate"].to_numpy(float)[order]
+        self.est_rate = points["est_rate"].to_numpy(float)[order]
+
+    def _segments(self, slots: np.ndarray, units: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        at = np.searchsorted(self.keys, (slots << _SLOT_SHIFT) + units, side="right") - 1
+        found = (at >= 0) & (self.slot[np.maximum(at, 0)] == slots)
+        return np.maximum(at, 0), found
+
+    def cost_of_first(self, slots: np.ndarray, units: np.ndarray) -> np.ndarray:
+        """FIFO cost of each drug's first `units` units; drugs with no layers cost nothing."""
+        if not len(self.keys):
+            return np.zeros(len(slots))
+        at, found = self._segments(slots, units)
+        return np.where(found, self.cost[at] + (units - self.qty[at]) * self.rate[at], 0.0)
+
+    def estimated_of_first(self, slots: np.ndarray, units: np.ndarray) -> np.ndarray:
+        """How many of each drug's first `units` units have an estimated cost."""
+        if not len(self.keys):
+            return units.astype(float)
+        at, found = self._segments(slots, units)
+        return np.where(found, self.est[at] + (units - self.qty[at]) * self.est_rate[at], units)
+
+
+class FifoCogs:
+    """Cost of goods sold and gross margin, matching stock out to stock in first-in-first-out.
+
+    Each drug's curve starts with its opening stock, then its purchases and
+    stock gains in the order they came in. Sales and the ledger's stock
+    losses (write-offs, stock-take and reconciliation shortfalls, edits
+    down) walk up it in time order: the `n`th unit ever taken out costs
+    what the `n`th unit ever taken in cost. Only sales book that cost;
+    losses just use up their layers. The per-drug count of units taken out
+    so far is the stored cursor, so a refresh prices only what was added
+    since the last one, with NumPy, into daily per-drug margins. Units with
+    no purchase cost of their own are priced at the nearest one and counted
+    as estimated.
+
+    This is a valuation rule only: sales still take physical units from the
+    lot that expires first.
+    """
+
+    def __init__(self, path: str = COGS_PATH, ttl: float = COGS_TTL_S):
+        self.path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._slots: dict[Any, int] = {}
+        self._used = np.zeros(0, dtype=np.int64)
+        self._curve: Optional[_Curve] = None
+        self._openings: dict[int, int] = {}
+        self._layers: list[tuple[int, int, Optional[float]]] = []
+        self._refreshed_at = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        """The state connection; callers hold `_lock`."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            if conn.execute("pragma user_version").fetchone()[0] != _SCHEMA_VERSION:
+                conn.executescript("".join(f"drop table if exists {table};" for table in _TABLES))
+                conn.execute(f"pragma user_version = {_SCHEMA_VERSION}")
+            conn.executescript(_SCHEMA)
+            conn.execute("pragma synchronous = normal")
+            self._conn = conn
+            self._load()
+        return self._conn
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._db().execute("select value from meta where key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _put(conn: sqlite3.Connection, key: str, value: str):
+        conn.execute("insert or replace into meta (key, value) values (?, ?)", (key, value))
+
+    def _slot(self, drug_id: Any) -> int:
+        slot = self._slots.setdefault(drug_id, len(self._slots))
+        if slot >= len(self._used):
+            self._used = np.concatenate([self._used, np.zeros(slot + 1 - len(self._used), dtype=np.int64)])
+        return slot
+
+    def _load(self):
+        for drug_id, used in self._conn.execute("select drug_id, used from cursor").fetchall():
+            slot = self._slot(drug_id)
+            self._used[slot] = used
+        self._openings = {self._slot(drug_id): quantity for drug_id, quantity
+                          in self._conn.execute("select drug_id, quantity from openings").fetchall()}
+        self._layers = [(self._slot(drug_id), quantity, unit_cost) for drug_id, quantity, unit_cost
+                        in self._conn.execute("select drug_id, quantity, unit_cost from layers order by id")]
+        self._curve = None
+
+    def _curve_now(self) -> _Curve:
+        """The curves over every stored layer, opening stock first; rebuilt after layers are added."""
+        if self._curve is None:
+            layers = [(slot, quantity, None) for slot, quantity in self._openings.items()] + self._layers
+            slots, quantities, costs = zip(*layers) if layers else ((), (), ())
+            self._curve = _Curve(np.array(slots, dtype=np.int64), np.array(quantities, dtype=np.int64),
+                                 np.array(costs, dtype=float))
+        return self._curve
+
+    def _store(self, step: Callable[[sqlite3.Connection], None]):
+        """Run `step` in one transaction; if it fails, put the in-memory cursor and curves back to match."""
+        used, openings, layers = self._used.copy(), dict(self._openings), len(self._layers)
+        try:
+            with self._conn as conn:
+                step(conn)
+        except Exception:
+            self._used[:len(used)] = used
+            self._used[len(used):] = 0
+            self._openings = openings
+            del self._layers[layers:]
+            self._curve = None
+            raise
+
+    def _take_openings(self):
+        """Put each new drug's opening stock at the front of its curve."""
+        after = self._meta("openings_watermark")
+        while True:
+            rows = db.fetch_opening_stock(int(after) if after else None)
+            if not rows:
+                return
+
+            def step(conn):
+                fresh = {row["drug_id"]: int(row["quantity"]) for row in rows
+                         if row["quantity"] and self._slot(row["drug_id"]) not in self._openings}
+                conn.executemany("insert or ignore into openings (drug_id, quantity) values (?, ?)", fresh.items())
+                self._openings.update({self._slot(drug_id): quantity for drug_id, quantity in fresh.items()})
+                self._curve = None
+                self._put(conn, "openings_watermark", str(rows[-1]["id"]))
+
+            self._store(step)
+            after = str(rows[-1]["id"])
+            if len(rows) < db.DEFAULT_CHUNK_SIZE:
+                return
+
+    def _add_layers(self, conn: sqlite3.Connection, purchases: list[db.Row], gains: list[db.Row]):
+        """Append purchases and stock gains to the curves in the order they came in."""
+        layers = [(row["drug_id"], int(row["change"]), None) if "change" in row else
+                  (row["drug_id"], int(row["quantity_purchased"] or 0), float(row["unit_cost"] or 0))
+                  for row in sorted(purchases + gains, key=lambda row: instant(row["created_at"]))]
+        conn.executemany("insert into layers (drug_id, quantity, unit_cost) values (?, ?, ?)", layers)
+        self._layers.extend((self._slot(drug_id), quantity, unit_cost) for drug_id, quantity, unit_cost in layers)
+        self._curve = None
+        if purchases:
+            self._put(conn, "purchases_watermark", json.dumps([purchases[-1]["created_at"], purchases[-1]["id"]]))
+        if gains:
+            self._put(conn, "gains_watermark", str(gains[-1]["id"]))
+
+    def _take_purchases(self, gains: list[db.Row]):
+        """Add new purchases, and the gains made among them, one stored chunk at a time."""
+        watermark = self._meta("purchases_watermark")
+        for rows in db.iter_chunks("purchases", "id, drug_id, quantity_purchased, unit_cost, created_at",
+                                   key="created_at", tiebreak="id", prefetch=True,
+                                   after=tuple(json.loads(watermark)) if watermark else None):
+            taken = _take_until(gains, rows[-1]["created_at"])
+            self._store(lambda conn: self._add_layers(conn, rows, taken))
+        if gains:
+            self._store(lambda conn: self._add_layers(conn, [], _take_until(gains, None)))
+
+    def _sales_after(self) -> Optional[str]:
+        """Where the next refresh starts reading sales."""
+        watermark, reread = self._meta("sales_watermark"), self._meta("reread_from")
+        after = watermark
+        if watermark:
+            after = (datetime.fromisoformat(watermark) - db.LATE_SALE_WINDOW).isoformat()
+        if reread and (after is None or reread < after):
+            after = reread
+        return after
+
+    def _unseen(self, sales: list[db.Row]) -> list[db.Row]:
+        """Drop sales an earlier refresh already priced (re-read below the watermark)."""
+        seen = set()
+        for i in range(0, len(sales), db.DEFAULT_CHUNK_SIZE):
+            ids = [row["id"] for row in sales[i:i + db.DEFAULT_CHUNK_SIZE]]
+            seen.update(row[0] for row in self._db().execute(
+                f"select id from seen_sales where id in ({', '.join('?' * len(ids))})", ids))
+        return [row for row in sales if row["id"] not in seen]
+
+    def _price(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Take each row's `units` up its drug's curve in row order, pricing them and advancing the cursor."""
+        curve = self._curve_now()
+        slots = np.fromiter((self._slot(drug_id) for drug_id in frame["drug_id"]), dtype=np.int64, count=len(frame))
+        units = frame["units"].to_numpy(np.int64)
+
+        after = self._used[slots] + pd.Series(units).groupby(slots).cumsum().to_numpy(np.int64)
+        before = after - units
+        frame["cogs"] = curve.cost_of_first(slots, after) - curve.cost_of_first(slots, before)
+        frame["estimated_units"] = np.rint(curve.estimated_of_first(slots, after)
+                                           - curve.estimated_of_first(slots, before)).astype(np.int64)
+
+        last = pd.Series(after).groupby(slots).last()
+        self._used[last.index.to_numpy()] = last.to_numpy()
+        return frame
+
+    def _take_out(self, conn: sqlite3.Connection, sales: list[db.Row], losses: list[db.Row]):
+        """Walk sales and stock losses up the curves in time order and store the sales' margins."""
+        events = [{"drug_id": row["drug_id"], "units": -int(row["change"]), "at": instant(row["created_at"]),
+                   "sale": False} for row in losses]
+        events += [{**row, "units": int(row["quantity_sold"] or 0), "at": instant(row["date_sold"]), "sale": True}
+                   for row in sales]
+        frame = self._price(pd.DataFrame(events).sort_values("at", kind="stable", ignore_index=True))
+        if sales:
+            self._store_sales(conn, frame.loc[frame["sale"]])
+        drug_ids = {slot: drug_id for drug_id, slot in self._slots.items()}
+        conn.executemany("insert or replace into cursor (drug_id, used) values (?, ?)",
+                         [(drug_ids[slot], int(self._used[slot])) for slot in set(frame["drug_id"].map(self._slots))])
+        if losses:
+            self._put(conn, "losses_watermark", str(losses[-1]["id"]))
+
+    def _take_sales(self, losses: list[db.Row]) -> int:
+        """Price new sales, and the losses made among them, one stored chunk at a time."""
+        priced = 0
+        for rows in db.iter_chunks("sales", "id, drug_id, quantity_sold, total_price, date_sold", key="date_sold",
+                                   tiebreak="id", after=self._sales_after(), prefetch=True):
+            sales, taken = self._unseen(rows), _take_until(losses, rows[-1]["date_sold"])
+            if sales or taken:
+                self._store(lambda conn: self._take_out(conn, sales, taken))
+            priced += len(sales)
+        if losses:
+            self._store(lambda conn: self._take_out(conn, [], _take_until(losses, None)))
+        return priced
+
+    def refresh(self, force: bool = False) -> int:
+        """Price sales and stock losses recorded since the last refresh; returns how many sales were priced.
+
+        New rows are read and stored a chunk at a time, so a first refresh
+        over years of history needs no deadline and keeps the chunks it
+        finished if it stops part way. Within `COGS_TTL_S` of the last
+        refresh the margins are served as-is unless `force` is set.
+        """
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed_at < self._ttl:
+                return 0
+            self._db()
+            self._take_openings()
+            gains, losses = (self._meta(key) for key in ("gains_watermark", "losses_watermark"))
+            gains = _other_movements(int(gains) if gains else None, gains=True)
+            losses = _other_movements(int(losses) if losses else None, gains=False)
+            self._take_purchases(gains)
+            priced = self._take_sales(losses)
+            with self._conn as conn:
+                conn.execute("delete from meta where key = 'reread_from'")
+            self._refreshed_at = time.monotonic()
+            return priced
+
+    def _store_sales(self, conn: sqlite3.Connection, frame: pd.DataFrame):
+        frame = frame.assign(day=frame["date_sold"].str[:10])
+        daily = frame.groupby(["day", "drug_id"], as_index=False).agg(
+            units=("units", "sum"), revenue=("total_price", "sum"),
+            cogs=("cogs", "sum"), estimated_units=("estimated_units", "sum"))
+        conn.executemany(
+            "insert into margins (day, drug_id, units, revenue, cogs, estimated_units) values (?, ?, ?, ?, ?, ?) "
+            "on conflict (day, drug_id) do update set units = units + excluded.units, "
+            "revenue = revenue + excluded.revenue, cogs = cogs + excluded.cogs, "
+            "estimated_units = estimated_units + excluded.estimated_units",
+            [(row.day, row.drug_id, int(row.units), float(row.revenue or 0), float(row.cogs), int(row.estimated_units))
+             for row in daily.itertuples()],
+        )
+        conn.executemany("insert or ignore into seen_sales (id) values (?)", [(i,) for i in frame["id"]])
+        watermark = self._meta("sales_watermark")
+        newest = frame["date_sold"].max()
+        if watermark is None or newest > watermark:
+            self._put(conn, "sales_watermark", newest)
+
+    def reread_from(self, since: date):
+        """Look for sales from `since` on at the next refresh, e.g. after a till that was offline for days catches up."""
+        with self._lock, self._db() as conn:
+            mark = datetime.combine(since, datetime.min.time()).isoformat()
+            current = self._meta("reread_from")
+            if current is None or mark < current:
+                conn.execute("insert or replace into meta (key, value) values ('reread_from', ?)", (mark,))
+            self._refreshed_at = 0.0
+
+    def margins(self, start: Optional[date] = None, end: Optional[date] = None) -> pd.DataFrame:
+        """Daily per-drug units, revenue and FIFO cost for days in `[start, end)`."""
+        with self._lock:
+            return pd.read_sql_query(
+                "select day, drug_id, units, revenue, cogs, estimated_units from margins "
+                "where day >= ? and day < ? order by day",
+                self._db(), params=((start or date.min).isoformat(), (end or date.max).isoformat()),
+            )
+
+
+def gross_margin(frame: pd.DataFrame, by: Union[str, list[str]]) -> pd.DataFrame:
+    """Sum daily margins by `by`, with gross profit and margin percentage."""
+    totals = frame.groupby(by, as_index=False)[["units", "revenue", "cogs", "estimated_units"]].sum()
+    totals["gross_profit"] = totals["revenue"] - totals["cogs"]
+    totals["margin_pct"] = (100 * totals["gross_profit"] / totals["revenue"].where(totals["revenue"] != 0)).round(1)
+    return totals
+
+
+def with_drug_details(frame: pd.DataFrame, drugs: list[db.Row]) -> pd.DataFrame:
+    """Add drug name and category columns from catalog rows."""
+    details = {drug["id"]: (drug["name"], drug.get("category") or "Other") for drug in drugs}
+    return frame.assign(
+        name=frame["drug_id"].map(lambda drug_id: details.get(drug_id, (str(drug_id), None))[0]),
+        category=frame["drug_id"].map(lambda drug_id: details.get(drug_id, (None, "Other"))[1]),
+    )
+
+
+def with_period(frame: pd.DataFrame, period: str) -> pd.DataFrame:
+    """Add a `period` column: the first day of each row's day/week/month/year."""
+    to_bucket = PERIOD_START[period]
+    return frame.assign(period=[to_bucket(date.fromisoformat(day)) for day in frame["day"]])
+
+
+# 🌐 One engine per server process, shared across Streamlit sessions
+cogs = FifoCogs()
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from modules import fetch_data as db
+
+# ✏️ Columns the inventory grid lets users change
+EDITABLE_COLUMNS = ["name", "category", "description", "price", "stock_quantity", "expiry_date"]
+
+# 🧾 Columns update_drugs() can compare and write
+DRUG_FIELDS = ["id"] + EDITABLE_COLUMNS + ["supplier_id"]
+
+# 🔢 Integer columns pandas turns into floats once a value is missing
+INTEGER_FIELDS = ["id", "stock_quantity", "supplier_id"]
+
+
+def to_records(df: pd.DataFrame) -> list[db.Row]:
+    """JSON-ready drug rows: numpy scalars unwrapped, dates as ISO strings, NaN as None."""
+    out = df[DRUG_FIELDS].astype({col: "Int64" for col in INTEGER_FIELDS if pd.api.types.is_float_dtype(df[col])})
+    out = out.astype(object).where(out.notna(), None)
+    out["expiry_date"] = out["expiry_date"].map(lambda d: d.isoformat() if d is not None else None)
+    return [{k: v.item() if isinstance(v, np.generic) else v for k, v in row.items()}
+            for row in out.to_dict("records")]
+
+
+def changed_records(changed: pd.DataFrame, before: pd.DataFrame) -> tuple[list[db.Row], list[db.Row]]:
+    """`update_drugs()` arguments: each row's id plus only the columns that differ, after and before."""
+    rows, originals = [], []
+    for after_row, before_row in zip(to_records(changed), to_records(before)):
+        edited = [k for k in DRUG_FIELDS if k != "id" and after_row[k] != before_row[k]]
+        rows.append({"id": after_row["id"], **{k: after_row[k] for k in edited}})
+        originals.append({"id": before_row["id"], **{k: before_row[k] for k in edited}})
+    return rows, originals
+
+
+def changed_rows(original: pd.DataFrame, edited: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Rows of `edited` that differ from `original`, with their original versions.
+
+    Both frames are indexed the same way (as `st.data_editor` returns them);
+    values are compared column-wise in one pass, treating two missing values
+    as equal.
+    """
+    before = original[EDITABLE_COLUMNS]
+    after = edited.loc[original.index, EDITABLE_COLUMNS]
+    differs = (before.ne(after) & ~(before.isna() & after.isna())).any(axis=1)
+    return edited.loc[differs[differs].index], original.loc[differs]
+
+
+def apply_markup(df: pd.DataFrame, percent: float, mask=None, round_to: int = 0) -> pd.DataFrame:
+    """Raise (or, for negative `percent`, cut) the price of every row in `mask` at once."""
+    mask = pd.Series(True, index=df.index) if mask is None else mask
+    out = df.astype({"price": float})
+    out.loc[mask, "price"] = (out.loc[mask, "price"] * (1 + percent / 100)).round(round_to)
+    return out
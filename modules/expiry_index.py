@@ -0,0 +1,87 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+
+from modules import fetch_data as db
+from modules.catalog import drug_catalog, lot_catalog
+
+
+class Exposure(NamedTuple):
+    """Lots in a date window and what they are worth."""
+    lots: list[db.Row]
+    units: int
+    cost_value: float
+    retail_value: float
+
+
+def _expiry(lot: db.Row) -> Optional[date]:
+    return date.fromisoformat(lot["expiry_date"][:10]) if lot.get("expiry_date") else None
+
+
+class ExpiryIndex:
+    """Lots with stock, ordered by expiry date.
+
+    Lots are held sorted by expiry with running totals of units, cost value
+    and retail value, so the stock expiring in any window is two bisections
+    and two array lookups, and listing it costs only the lots returned.
+    Lots without an expiry date never expire; `lots_for()` still lists them,
+    last, in the first-expiry-first-out order sales draw from.
+    """
+
+    def __init__(self, lots: list[db.Row], prices: dict[Any, float]):
+        dated = sorted((lot for lot in lots if lot.get("expiry_date")), key=lambda lot: (_expiry(lot), lot["id"]))
+        self._lots = dated
+        self._expiries = [_expiry(lot) for lot in dated]
+
+        units = np.array([lot["quantity_remaining"] for lot in dated], dtype=float)
+        costs = np.array([lot.get("unit_cost") or 0 for lot in dated], dtype=float)
+        retail = np.array([prices.get(lot["drug_id"]) or 0 for lot in dated], dtype=float)
+        self._cum_units = np.concatenate(([0.0], np.cumsum(units)))
+        self._cum_cost = np.concatenate(([0.0], np.cumsum(units * costs)))
+        self._cum_retail = np.concatenate(([0.0], np.cumsum(units * retail)))
+
+        self._by_drug: dict[Any, list[db.Row]] = defaultdict(list)
+        for lot in sorted(lots, key=lambda lot: (_expiry(lot) is None, _expiry(lot) or date.max, lot["id"])):
+            self._by_drug[lot["drug_id"]].append(lot)
+
+    def _window(self, lo: int, hi: int) -> Exposure:
+        return Exposure(
+            self._lots[lo:hi],
+            int(self._cum_units[hi] - self._cum_units[lo]),
+            float(self._cum_cost[hi] - self._cum_cost[lo]),
+            float(self._cum_retail[hi] - self._cum_retail[lo]),
+        )
+
+    def expiring(self, days: int, today: Optional[date] = None) -> Exposure:
+        """Stock expiring from `today` through `today + days`, soonest first."""
+        today = today or date.today()
+        return self._window(bisect_left(self._expiries, today),
+                            bisect_right(self._expiries, today + timedelta(days=days)))
+
+    def expired(self, today: Optional[date] = None) -> Exposure:
+        """Stock still on the shelf past its expiry date."""
+        return self._window(0, bisect_left(self._expiries, today or date.today()))
+
+    def lots_for(self, drug_id: Any) -> list[db.Row]:
+        """A drug's lots in the order sales take from them."""
+        return self._by_drug.get(drug_id, [])
+
+
+_lock = threading.Lock()
+_built: tuple[Optional[tuple[int, int]], Optional[ExpiryIndex]] = (None, None)
+
+
+def expiry_index() -> ExpiryIndex:
+    """The shared index, rebuilt only when the lots or drug prices change."""
+    global _built
+    (lot_version, lots), (drug_version, drugs) = db.gather(lot_catalog.snapshot, drug_catalog.snapshot)
+    with _lock:
+        key, index = _built
+        if key != (lot_version, drug_version):
+            index = ExpiryIndex(lots, {drug["id"]: drug["price"] for drug in drugs})
+            _built = ((lot_version, drug_version), index)
+        return index
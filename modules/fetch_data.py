@@ -1 +1,537 @@
- 
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import httpx
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from supabase import create_client, Client
+
+# A single row as returned by PostgREST
+Row = Dict[str, Any]
+
+# ------------------ Column Projections ------------------ #
+# 📋 Explicit columns per table so no page ever pulls `select("*")`
+USER_COLUMNS = "id, name, email, role, verified"
+DRUG_COLUMNS = "id, name, category, description, price, stock_quantity, expiry_date, supplier_id"
+DRUG_SALE_COLUMNS = "id, name, price, stock_quantity"
+DRUG_STOCK_COLUMNS = "id, name, stock_quantity"
+DRUG_GRID_COLUMNS = f"{DRUG_COLUMNS}, suppliers(name)"
+SUPPLIER_COLUMNS = "id, name"
+SALE_COLUMNS = "id, drug_id, quantity_sold, total_price, sold_by, date_sold"
+PURCHASE_COLUMNS = (
+    "id, drug_id, supplier_id, quantity_purchased, unit_cost, entered_by, "
+    "created_at, date_purchased, expiry_date"
+)
+LOT_COLUMNS = "id, drug_id, purchase_id, expiry_date, quantity_remaining, unit_cost"
+MOVEMENT_COLUMNS = "id, drug_id, change, balance_after, reason, reference, created_at"
+
+# 🏷️ Drug categories offered by the forms and inventory filters
+DRUG_CATEGORIES = ["Pain Relief", "Antibiotic", "Antihistamine", "Diabetes", "Other"]
+
+# 📄 Rows per page for chunked reads; must not exceed the server's max-rows (1000)
+DEFAULT_CHUNK_SIZE = 1000
+
+# 🔁 Sales are stamped on the till, so a journaled sale can reach the database
+# after later ones; readers that page by date_sold re-read this far below their watermark
+LATE_SALE_WINDOW = timedelta(days=1)
+
+# ⏱️ Seconds each call passed to gather() may take before it is abandoned
+DEFAULT_QUERY_TIMEOUT_S = 20
+
+# 🚫 SQLSTATE raised by update_drugs() and set_stock_levels() when rows changed underneath them
+STALE_ROWS = "RC002"
+
+# 🔁 Retries of a failed write: full-jitter exponential backoff within a time budget
+WRITE_RETRY_BUDGET_S = 15
+RETRY_BASE_DELAY_S = 0.25
+RETRY_MAX_DELAY_S = 4.0
+
+# 📶 Error codes worth retrying: serialization failure, deadlock, statement
+# timeout, PostgREST losing its database connection, and gateway errors
+TRANSIENT_ERROR_CODES = {"40001", "40P01", "57014", "PGRST000", "PGRST001", "PGRST002", "PGRST003",
+                         "502", "503", "504"}
+
+
+class StaleRows(Exception):
+    """Rows were changed by someone else after the editor loaded them."""
+
+
+# ------------------ Shared Client ------------------ #
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+
+
+def _new_client() -> Client:
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY")
+    return create_client(url, key)
+
+
+def get_client() -> Client:
+    """Return the process-wide Supabase client.
+
+    Built once per server process and shared by every page and every
+    Streamlit session, so all reads and writes go through one keep-alive
+    HTTP/2 connection pool instead of a new pool per imported module.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _new_client()
+    return _client
+
+
+def _table(name: str):
+    return get_client().table(name)
+
+
+# ------------------ Safe Retries ------------------ #
+def new_request_key() -> str:
+    """A client-generated idempotency key for one logical write."""
+    return uuid.uuid4().hex
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, APIError) and str(error.code) in TRANSIENT_ERROR_CODES
+
+
+def backoff_delays(base: float = RETRY_BASE_DELAY_S, cap: float = RETRY_MAX_DELAY_S) -> Iterator[float]:
+    """Endless full-jitter delays: uniform between 0 and `base * 2**attempt`, capped at `cap`."""
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
+        attempt += 1
+
+
+def with_retries(call: Callable[[], Any], budget: float = WRITE_RETRY_BUDGET_S) -> Any:
+    """Run `call`, retrying transient failures until `budget` seconds are spent.
+
+    Only for writes that are safe to repeat: keyed inserts, keyed functions
+    and updates that set absolute values.
+    """
+    deadline = time.monotonic() + budget
+    for delay in backoff_delays():
+        try:
+            return call()
+        except Exception as e:
+            if not is_transient(e) or time.monotonic() + delay > deadline:
+                raise
+            time.sleep(delay)
+
+
+def _keyed(rows: list[Row], request_key: Optional[str]) -> list[Row]:
+    """Give each row of one submission its own stable key derived from `request_key`."""
+    request_key = request_key or new_request_key()
+    return [{**row, "request_key": f"{request_key}:{i}"} for i, row in enumerate(rows)]
+
+
+def _upsert_keyed(table: str, rows: list[Row], request_key: Optional[str]) -> list[Row]:
+    """Insert rows so that repeating the call does not duplicate them.
+
+    Returns one row per input row, in input order. A row inserted by this
+    call comes back in full. A row an earlier attempt already wrote is left
+    untouched and comes back as only `{"id", "name", "request_key"}`.
+    """
+    if not rows:
+        return []
+    keyed = _keyed(rows, request_key)
+    inserted = with_retries(lambda: _table(table)
+                            .upsert(keyed, on_conflict="request_key", ignore_duplicates=True)
+                            .execute().data)
+    if len(inserted) == len(keyed):
+        return inserted
+    keys = [row["request_key"] for row in keyed]
+    existing = with_retries(lambda: _table(table).select("id, name, request_key").in_("request_key", keys)
+                            .execute().data)
+    by_key = {row["request_key"]: row for row in existing + inserted}
+    return [by_key[key] for key in keys]
+
+
+# ------------------ Concurrent Reads ------------------ #
+# 🧵 Shared by every session; the HTTP/2 pool multiplexes the requests
+_query_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase-query")
+
+
+def gather(*calls: Callable[[], Any], timeout: Optional[float] = DEFAULT_QUERY_TIMEOUT_S) -> list:
+    """Run independent queries in parallel and return their results in order.
+
+    Page time becomes the slowest round trip instead of the sum of them.
+    Each call gets `timeout` seconds from submission (None waits forever);
+    a call that overruns raises `TimeoutError`, and the first call that
+    fails re-raises its exception. Calls must not touch `st.*`.
+    """
+    started = time.monotonic()
+    futures = [_query_pool.submit(call) for call in calls]
+    try:
+        results = []
+        for future in futures:
+            remaining = None if timeout is None else max(0.0, started + timeout - time.monotonic())
+            results.append(future.result(timeout=remaining))
+        return results
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+# ------------------ Chunked Reads ------------------ #
+def iter_chunks(table: str,
+                columns: str,
+                key: str = "id",
+                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                after: Any = None,
+                filters: Optional[Callable] = None,
+                prefetch: bool = False,
+                tiebreak: Optional[str] = None) -> Iterator[list[Row]]:
+    """Yield every matching row of `table` in chunks, paging by keyset on `key`.
+
+    Each page asks for rows after the last one seen, ordered by `key`, so
+    paging never skips or repeats rows and is not cut off by PostgREST's
+    row cap. A `key` that can tie, such as `date_sold` (every line of a
+    basket shares it), needs a unique `tiebreak` column, usually `id`:
+    pages then continue from `(key, tiebreak)`, so rows sharing a timestamp
+    are not lost at a page boundary. Without it `key` must be unique.
+    `after` is a `key` value to start strictly above, or with `tiebreak`
+    a `(key, tiebreak)` pair. `filters` receives the query builder and
+    returns it with extra filters applied. With `prefetch`, the next page
+    is requested on a worker thread while the caller processes the current one.
+    """
+    names = [c.strip() for c in columns.split(",")]
+    order = [key] if tiebreak is None else [key, tiebreak]
+    select_columns = ", ".join([column for column in order if column not in names] + [columns])
+
+    def fetch_page(last):
+        query = _table(table).select(select_columns)
+        if filters is not None:
+            query = filters(query)
+        if isinstance(last, tuple):
+            last_key, last_tiebreak = last
+            query = query.or_(f"{key}.gt.{_quoted(last_key)},"
+                              f"and({key}.eq.{_quoted(last_key)},{tiebreak}.gt.{_quoted(last_tiebreak)})")
+        elif last is not None:
+            query = query.gt(key, last)
+        for column in order:
+            query = query.order(column)
+        return query.limit(chunk_size).execute().data
+
+    def position(row):
+        return row[key] if tiebreak is None else (row[key], row[tiebreak])
+
+    if not prefetch:
+        last = after
+        while True:
+            rows = fetch_page(last)
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            last = position(rows[-1])
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(fetch_page, after)
+        while True:
+            rows = pending.result()
+            if len(rows) < chunk_size:
+                if rows:
+                    yield rows
+                return
+            pending = pool.submit(fetch_page, position(rows[-1]))
+            yield rows
+
+
+def fetch_all(table: str, columns: str, key: str = "id",
+              filters: Optional[Callable] = None) -> list[Row]:
+    """All matching rows of `table`, read in keyset chunks."""
+    rows: list[Row] = []
+    for chunk in iter_chunks(table, columns, key=key, filters=filters):
+        rows.extend(chunk)
+    return rows
+
+
+def _by_name(rows: list[Row]) -> list[Row]:
+    return sorted(rows, key=lambda row: (row.get("name") or "").lower())
+
+
+def _between(time_column: str, start: Optional[datetime], end: Optional[datetime]):
+    def apply(query):
+        if start is not None:
+            query = query.gte(time_column, start.isoformat())
+        if end is not None:
+            query = query.lt(time_column, end.isoformat())
+        return query
+    return apply
+
+
+# ------------------ Paged Reads ------------------ #
+def fetch_page(table: str, columns: str, filters: Callable, order: str,
+               descending: bool = False, offset: int = 0, limit: int = 50) -> list[Row]:
+    """One sorted page of `table`; `id` breaks ties so pages never overlap."""
+    return filters(_table(table).select(columns)) \
+        .order(order, desc=descending, nullsfirst=False) \
+        .order("id") \
+        .range(offset, offset + limit - 1) \
+        .execute().data
+
+
+def count_rows(table: str, filters: Optional[Callable] = None) -> int:
+    """Exact row count without transferring any rows."""
+    query = _table(table).select("id", count="exact", head=True)
+    if filters is not None:
+        query = filters(query)
+    return query.execute().count or 0
+
+
+# ------------------ Users ------------------ #
+def authenticate_user(email: str, password_hash: str) -> Optional[Row]:
+    """Return the user matching the credentials, without the password hash."""
+    data = _table("users").select(USER_COLUMNS) \
+        .eq("email", email) \
+        .eq("password_hash", password_hash) \
+        .limit(1) \
+        .execute().data
+    return data[0] if data else None
+
+
+def find_user_by_email(email: str) -> Optional[Row]:
+    data = _table("users").select("id").eq("email", email).limit(1).execute().data
+    return data[0] if data else None
+
+
+def fetch_users(columns: str = USER_COLUMNS) -> list[Row]:
+    return _by_name(fetch_all("users", columns))
+
+
+def _quoted(value: Any) -> str:
+    """Quote a value for use inside a PostgREST `or=(...)` filter."""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def user_filters(search: Optional[str] = None, role: Optional[str] = None) -> Callable:
+    """Build a `filters` callable for user queries; `search` matches name or email."""
+    def apply(query):
+        if search:
+            pattern = _quoted(f"*{search}*")
+            query = query.or_(f"name.ilike.{pattern},email.ilike.{pattern}")
+        if role is not None:
+            query = query.eq("role", role)
+        return query
+    return apply
+
+
+def fetch_user_page(filters: Callable, offset: int = 0, limit: int = 25,
+                    columns: str = USER_COLUMNS) -> list[Row]:
+    return fetch_page("users", columns, filters, "name", offset=offset, limit=limit)
+
+
+def insert_user(user: Row, request_key: Optional[str] = None) -> list[Row]:
+    return _upsert_keyed("users", [user], request_key)
+
+
+def update_user(user_id: Any, changes: Row) -> list[Row]:
+    return with_retries(lambda: _table("users").update(changes).eq("id", user_id).execute().data)
+
+
+def update_user_by_email(email: str, changes: Row) -> list[Row]:
+    return with_retries(lambda: _table("users").update(changes).eq("email", email).execute().data)
+
+
+def delete_user(user_id: Any) -> list[Row]:
+    return with_retries(lambda: _table("users").delete().eq("id", user_id).execute().data)
+
+
+def sign_up_auth_user(email: str, password: str):
+    """Create a Supabase Auth account.
+
+    Uses a throwaway client: signing up fires an auth event that would swap
+    the shared client's Authorization header to the new user's session.
+    """
+    return _new_client().auth.sign_up({"email": email, "password": password})
+
+
+def insert_audit_logs(entries: list[Row]) -> list[Row]:
+    """Insert audit entries that already carry a `request_key`; ones sent before are skipped."""
+    if not entries:
+        return []
+    return with_retries(lambda: _table("audit_logs")
+                        .upsert(entries, on_conflict="request_key", ignore_duplicates=True)
+                        .execute().data)
+
+
+def update_users(updates: list[Row], deleted: list[Any], audit: list[Row],
+                 request_key: Optional[str] = None) -> int:
+    """Apply `{"id", "role", "verified"}` updates and deletions with their audit rows in one transaction."""
+    params = {
+        "p_updates": updates,
+        "p_deleted": [{"id": user_id} for user_id in deleted],
+        "p_audit": audit,
+        "p_request_key": request_key or new_request_key(),
+    }
+    return with_retries(lambda: get_client().rpc("update_users", params).execute().data)
+
+
+# ------------------ Drugs & Suppliers ------------------ #
+def fetch_drugs(columns: str = DRUG_COLUMNS) -> list[Row]:
+    return _by_name(fetch_all("drugs", columns))
+
+
+def drug_filters(category: Optional[str] = None,
+                 supplier_id: Any = None,
+                 min_stock: Optional[int] = None,
+                 max_stock: Optional[int] = None,
+                 expires_before: Optional[date] = None,
+                 expires_from: Optional[date] = None) -> Callable:
+    """Build a `filters` callable for drug queries; None means "any"."""
+    def apply(query):
+        if category is not None:
+            query = query.eq("category", category)
+        if supplier_id is not None:
+            query = query.eq("supplier_id", supplier_id)
+        if min_stock is not None:
+            query = query.gte("stock_quantity", min_stock)
+        if max_stock is not None:
+            query = query.lte("stock_quantity", max_stock)
+        if expires_from is not None:
+            query = query.gte("expiry_date", expires_from.isoformat())
+        if expires_before is not None:
+            query = query.lt("expiry_date", expires_before.isoformat())
+        return query
+    return apply
+
+
+def fetch_drug_page(filters: Callable, order: str = "name", descending: bool = False,
+                    offset: int = 0, limit: int = 50,
+                    columns: str = DRUG_GRID_COLUMNS) -> list[Row]:
+    return fetch_page("drugs", columns, filters, order, descending, offset, limit)
+
+
+def insert_drug(drug: Row, request_key: Optional[str] = None) -> Row:
+    return _upsert_keyed("drugs", [drug], request_key)[0]
+
+
+def insert_drugs(drugs: list[Row], request_key: Optional[str] = None) -> list[Row]:
+    return _upsert_keyed("drugs", drugs, request_key)
+
+
+def update_drugs(rows: list[Row], originals: list[Row], request_key: Optional[str] = None) -> list[Row]:
+    """Write edited drug rows in one transaction.
+
+    Each row holds the drug's `id` and only the columns to change;
+    `originals` hold the same columns as they were loaded. If any of those
+    values no longer matches the database nothing is written and
+    `StaleRows` is raised. Columns left out are neither checked nor written.
+    """
+    if not rows:
+        return []
+    params = {"p_rows": rows, "p_originals": originals, "p_request_key": request_key or new_request_key()}
+    try:
+        return with_retries(lambda: get_client().rpc("update_drugs", params).execute().data)
+    except APIError as e:
+        if e.code == STALE_ROWS:
+            raise StaleRows(e.message) from e
+        raise
+
+
+def fetch_suppliers(columns: str = SUPPLIER_COLUMNS) -> list[Row]:
+    return _by_name(fetch_all("suppliers", columns))
+
+
+def insert_supplier(supplier: Row, request_key: Optional[str] = None) -> Row:
+    return _upsert_keyed("suppliers", [supplier], request_key)[0]
+
+
+def insert_suppliers(suppliers: list[Row], request_key: Optional[str] = None) -> list[Row]:
+    return _upsert_keyed("suppliers", suppliers, request_key)
+
+
+# ------------------ Drug Lots ------------------ #
+def fetch_lots(columns: str = LOT_COLUMNS) -> list[Row]:
+    """Lots that still hold stock; see sql/drug_lots.sql."""
+    return fetch_all("drug_lots", columns, filters=lambda query: query.gt("quantity_remaining", 0))
+
+
+def write_off_expired() -> list[Row]:
+    """Write off every unit in an expired lot; returns `{"drug_id", "quantity"}` per drug."""
+    return with_retries(lambda: get_client().rpc("write_off_expired", {}).execute().data)
+
+
+# ------------------ Stock Ledger ------------------ #
+def fetch_stock_on(at: datetime) -> list[Row]:
+    """Every drug's `{"drug_id", "quantity"}` at `at`; see sql/stock_movements.sql."""
+    return get_client().rpc("stock_on", {"p_at": at.isoformat()}).execute().data
+
+
+def fetch_opening_stock(after: Optional[int] = None, limit: int = DEFAULT_CHUNK_SIZE) -> list[Row]:
+    """Opening movements past ledger id `after` as `{"id", "drug_id", "quantity"}`: units each drug had that no purchase brought in."""
+    params = {"p_after": after, "p_limit": limit}
+    return get_client().rpc("opening_stock", params).execute().data
+
+
+def set_stock_levels(rows: list[Row], reason: str, audit: list[Row],
+                     request_key: Optional[str] = None) -> list[Row]:
+    """Set several drugs' stock and write their audit rows in one transaction, logged in the ledger under `reason`.
+
+    Each row is `{"id", "stock_quantity", "was"}`; if any drug's stock is no
+    longer `was` nothing is written and `StaleRows` is raised.
+    """
+    if not rows:
+        return []
+    params = {"p_rows": rows, "p_reason": reason, "p_audit": audit, "p_request_key": request_key or new_request_key()}
+    try:
+        return with_retries(lambda: get_client().rpc("set_stock_levels", params).execute().data)
+    except APIError as e:
+        if e.code == STALE_ROWS:
+            raise StaleRows(e.message) from e
+        raise
+
+
+def fetch_movements(drug_id: Any, limit: int = 50, columns: str = MOVEMENT_COLUMNS) -> list[Row]:
+    """A drug's latest stock movements, newest first."""
+    return (_table("stock_movements").select(columns).eq("drug_id", drug_id)
+            .order("created_at", desc=True).order("id", desc=True).limit(limit).execute().data)
+
+
+# ------------------ Sales & Purchases ------------------ #
+def fetch_sales(columns: str = SALE_COLUMNS,
+                start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> list[Row]:
+    """Return sales with `start <= date_sold < end` (either bound optional)."""
+    return fetch_all("sales", columns, filters=_between("date_sold", start, end))
+
+
+def fetch_purchases(columns: str = PURCHASE_COLUMNS,
+                    start: Optional[datetime] = None,
+                    end: Optional[datetime] = None) -> list[Row]:
+    """Return purchases with `start <= created_at < end` (either bound optional)."""
+    return fetch_all("purchases", columns, filters=_between("created_at", start, end))
+
+
+def fetch_summary_totals(bucket: str,
+                         since: Optional[datetime] = None,
+                         until: Optional[datetime] = None) -> list[Row]:
+    """Per-bucket sales/purchase totals from the `summary_totals` SQL function.
+
+    `bucket` is a Postgres `date_trunc` unit: "day", "month" or "year".
+    """
+    params = {
+        "bucket": bucket,
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+    }
+    return get_client().rpc("summary_totals", params).execute().data
+
+
+def apply_journal(entries: list[Row]) -> list[Row]:
+    """Replay journaled `{"key", "kind", "payload"}` writes; see sql/write_journal.sql.
+
+    Returns one `{"request_key", "status", "result", "error"}` row per entry.
+    """
+    return with_retries(lambda: get_client().rpc("apply_journal", {"p_entries": entries}).execute().data)
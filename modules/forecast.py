@@ -0,0 +1,150 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from modules import fetch_data as db
+from modules.rollup import LateRows
+
+# 📅 Days of sales history behind each forecast
+LOOKBACK_DAYS = 90
+# 🚚 Days between placing an order and the stock arriving
+LEAD_TIME_DAYS = 7
+# 🔁 Days each order should last beyond the lead time
+REVIEW_DAYS = 14
+# 🛡️ Safety stock in standard deviations of daily demand (1.65 ≈ 95% of lead times without a stock-out)
+SERVICE_Z = 1.65
+# ⏱️ How long forecasts are served before pulling new sales
+FORECAST_TTL_S = 60
+
+
+class DemandHistory:
+    """Units sold per drug per day, as one NumPy matrix.
+
+    The first refresh reads the last `LOOKBACK_DAYS` of sales; every refresh
+    after that only reads sales past the high-water mark, less
+    `LATE_SALE_WINDOW` for tills that sync late, and adds the ones it has
+    not seen to their cells, so the history never has to be read twice.
+    Rows are drugs (in first-seen order), columns are days from `origin`.
+    """
+
+    def __init__(self, lookback_days: int = LOOKBACK_DAYS):
+        self._lookback = lookback_days
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.origin = date.today() - timedelta(days=self._lookback)
+        self.units = np.zeros((0, self._lookback + 1))
+        self._rows: dict[Any, int] = {}
+        self.sales = LateRows("sales", "date_sold", "drug_id, quantity_sold, date_sold")
+        self.sales.start_after(datetime.combine(self.origin, datetime.min.time()).isoformat())
+        self._refreshed_at = 0.0
+
+    def _merge(self, rows: list[db.Row]):
+        for row in rows:
+            self._rows.setdefault(row["drug_id"], len(self._rows))
+        days = np.array([row["date_sold"][:10] for row in rows], dtype="datetime64[D]")
+        cols = (days - np.datetime64(self.origin, "D")).astype(np.int64)
+        height, width = len(self._rows), max(int(cols.max()) + 1, self.units.shape[1])
+        if (height, width) != self.units.shape:
+            grown = np.zeros((height, width))
+            grown[:self.units.shape[0], :self.units.shape[1]] = self.units
+            self.units = grown
+        drugs = np.fromiter((self._rows[row["drug_id"]] for row in rows), dtype=np.int64, count=len(rows))
+        sold = np.fromiter((row["quantity_sold"] or 0 for row in rows), dtype=float, count=len(rows))
+        inside = cols >= 0
+        np.add.at(self.units, (drugs[inside], cols[inside]), sold[inside])
+
+    def _drop_old_days(self):
+        """Keep the matrix at most two windows wide while the process runs for months."""
+        age = (date.today() - self.origin).days
+        if age > 2 * self._lookback:
+            shift = age - self._lookback
+            self.units = self.units[:, shift:]
+            self.origin += timedelta(days=shift)
+
+    def refresh(self, force: bool = False) -> int:
+        """Add sales recorded since the last refresh; returns how many were added."""
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed_at < FORECAST_TTL_S:
+                return 0
+            merged = 0
+            for rows in self.sales.chunks():
+                self._merge(rows)
+                merged += len(rows)
+            self._drop_old_days()
+            self._refreshed_at = time.monotonic()
+            return merged
+
+    def invalidate(self):
+        """Read the window again at the next refresh, e.g. after backdated sales."""
+        with self._lock:
+            self._reset()
+
+    def window(self, drug_ids: list[Any], today: Optional[date] = None) -> np.ndarray:
+        """Units sold per day over the last `LOOKBACK_DAYS` full days, one row per drug in `drug_ids`."""
+        today = today or date.today()
+        daily = np.zeros((len(drug_ids), self._lookback))
+        with self._lock:
+            end = (today - self.origin).days
+            known = [(i, self._rows[drug_id]) for i, drug_id in enumerate(drug_ids) if drug_id in self._rows]
+            if known:
+                into, source = (list(column) for column in zip(*known))
+                # Days with no sales yet past the matrix's last column stay zero
+                span = self.units[source, end - self._lookback:end]
+                daily[into, :span.shape[1]] = span
+        return daily
+
+
+def reorder_plan(drugs: list[db.Row], daily_units: np.ndarray, today: Optional[date] = None,
+                 lead_time: int = LEAD_TIME_DAYS, review: int = REVIEW_DAYS, z: float = SERVICE_Z) -> pd.DataFrame:
+    """Demand, cover and reorder figures for every drug at once.
+
+    `daily_units` has one row of daily units sold per drug, in `drugs` order.
+    A drug is due for reorder once its stock is at or below the reorder
+    point (lead-time demand plus safety stock); the suggested quantity tops
+    it up to cover the lead time and the review period.
+    """
+    today = today or date.today()
+    stock = np.array([drug["stock_quantity"] or 0 for drug in drugs], dtype=float)
+    velocity = daily_units.mean(axis=1) if daily_units.shape[1] else np.zeros(len(drugs))
+    spread = daily_units.std(axis=1, ddof=1) if daily_units.shape[1] > 1 else np.zeros(len(drugs))
+
+    safety = z * spread * np.sqrt(lead_time)
+    reorder_point = velocity * lead_time + safety
+    order_up_to = velocity * (lead_time + review) + safety
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(velocity > 0, stock / velocity, np.inf)
+    due = (velocity > 0) & (stock <= reorder_point)
+    suggested = np.where(due, np.ceil(np.maximum(order_up_to - stock, 0)), 0).astype(int)
+
+    stock_out = [today + timedelta(days=int(days)) if np.isfinite(days) else None for days in cover]
+    return pd.DataFrame({
+        "drug_id": [drug["id"] for drug in drugs],
+        "name": [drug["name"] for drug in drugs],
+        "supplier_id": [drug.get("supplier_id") for drug in drugs],
+        "stock_quantity": stock.astype(int),
+        "daily_velocity": velocity,
+        "daily_std": spread,
+        "days_of_cover": cover,
+        "stock_out_date": stock_out,
+        "reorder_point": np.ceil(reorder_point).astype(int),
+        "suggested_quantity": suggested,
+    }).sort_values(["days_of_cover", "name"], kind="stable", ignore_index=True)
+
+
+def by_supplier(plan: pd.DataFrame, suppliers: dict[Any, str]) -> pd.DataFrame:
+    """Drugs due for reorder and suggested units per supplier."""
+    due = plan.loc[plan["suggested_quantity"] > 0]
+    return (due.assign(supplier=due["supplier_id"].map(suppliers).fillna("No supplier"))
+               .groupby("supplier", as_index=False)
+               .agg(drugs=("drug_id", "count"), units=("suggested_quantity", "sum"))
+               .sort_values("units", ascending=False, ignore_index=True))
+
+
+# 🌐 One history per server process, shared across Streamlit sessions
+demand = DemandHistory()
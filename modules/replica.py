@@ -0,0 +1,236 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional, Union
+
+import pandas as pd
+
+from modules import fetch_data as db
+from modules.rollup import DailyIndex, DailyRollup, bucket_days, rollup
+
+# 📁 Local copy of the reporting tables
+REPLICA_PATH = os.getenv(
+    "REPLICA_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "replica.sqlite3"),
+)
+
+# 🔀 Opt in with USE_REPLICA=1; the report pages then read the local copy
+USE_REPLICA = os.getenv("USE_REPLICA", "").lower() in ("1", "true", "yes")
+
+# ⏱️ How long the replica is served before pulling new rows
+SYNC_TTL_S = 30
+
+_SCHEMA = """
+pragma journal_mode = wal;
+create table if not exists sales (
+    id            primary key,
+    drug_id,
+    quantity_sold integer,
+    total_price   real,
+    sold_by,
+    date_sold     text not null
+);
+create index if not exists sales_date_sold on sales (date_sold);
+create table if not exists purchases (
+    id                 primary key,
+    drug_id,
+    supplier_id,
+    quantity_purchased integer,
+    unit_cost          real,
+    entered_by,
+    created_at         text not null,
+    date_purchased     text,
+    expiry_date        text
+);
+create index if not exists purchases_created_at on purchases (created_at);
+create table if not exists drugs (
+    id             primary key,
+    name           text,
+    category       text,
+    price          real,
+    stock_quantity integer,
+    expiry_date    text,
+    supplier_id
+);
+create table if not exists suppliers (id primary key, name text);
+create table if not exists users (id primary key, name text);
+create table if not exists meta (key text primary key, value text not null);
+"""
+
+# 📈 Append-only tables: (table, columns, time column the sync pages by)
+_FACT_TABLES = [
+    ("sales", db.SALE_COLUMNS, "date_sold"),
+    ("purchases", db.PURCHASE_COLUMNS, "created_at"),
+]
+# 📋 Small tables copied whole on every sync; users are copied by name only
+_REFERENCE_TABLES = [
+    ("drugs", "id, name, category, price, stock_quantity, expiry_date, supplier_id"),
+    ("suppliers", db.SUPPLIER_COLUMNS),
+    ("users", "id, name"),
+]
+
+SALES_SQL = """
+select d.name as "Drug Name", s.quantity_sold, s.total_price, u.name as "Sold By", s.date_sold
+from sales s
+left join drugs d on d.id = s.drug_id
+left join users u on u.id = s.sold_by
+where s.date_sold >= ? and s.date_sold < ?
+order by s.date_sold
+"""
+
+PURCHASES_SQL = """
+select d.name as "Drug Name", p.quantity_purchased, p.unit_cost,
+       p.quantity_purchased * p.unit_cost as "Total Cost", p.created_at
+from purchases p
+left join drugs d on d.id = p.drug_id
+where p.created_at >= ? and p.created_at < ?
+order by p.created_at
+"""
+
+SALES_BY_DAY_SQL = "select substr(date_sold, 1, 10) as day, sum(total_price) from sales group by day"
+PURCHASES_BY_DAY_SQL = (
+    "select substr(created_at, 1, 10) as day, sum(quantity_purchased * unit_cost) from purchases group by day"
+)
+
+
+class Replica:
+    """Local SQLite copy of sales, purchases, drugs, suppliers and user names.
+
+    `sync()` pulls only sales and purchases above each table's high-water
+    mark (`date_sold` / `created_at`) and recopies the small reference
+    tables, so the report pages can join and aggregate with plain SQL here
+    instead of on the primary. Rows are upserted by id, which makes
+    re-reading a window harmless. Timestamps are kept as the ISO text the
+    database returns (UTC) and compared as text.
+
+    It answers the same `refresh()`, `index()` and `bucketed()` calls as the
+    shared rollup, so report pages can read either.
+    """
+
+    def __init__(self, path: str = REPLICA_PATH, ttl: float = SYNC_TTL_S):
+        self.path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._synced_at = 0.0
+        self._index: Optional[DailyIndex] = None
+
+    def _db(self) -> sqlite3.Connection:
+        """The replica connection; callers hold `_lock`."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute("pragma synchronous = normal")
+        return self._conn
+
+    def _watermark(self, table: str) -> Optional[str]:
+        row = self._db().execute("select value from meta where key = ?", (f"{table}_watermark",)).fetchone()
+        return row[0] if row else None
+
+    def _pull(self, table: str, columns: str, key: str) -> int:
+        conn = self._db()
+        names = [c.strip() for c in columns.split(",")]
+        insert = f"insert or replace into {table} ({', '.join(names)}) values ({', '.join('?' * len(names))})"
+
+        watermark = self._watermark(table)
+        after = watermark
+        if watermark and table == "sales":
+            after = (datetime.fromisoformat(watermark) - db.LATE_SALE_WINDOW).isoformat()
+
+        pulled = 0
+        # 🔗 Basket and invoice lines share a timestamp; the id keeps them apart across pages
+        for rows in db.iter_chunks(table, columns, key=key, tiebreak="id", after=after, prefetch=True):
+            with conn:
+                conn.executemany(insert, [tuple(row[name] for name in names) for row in rows])
+                if watermark is None or rows[-1][key] > watermark:
+                    watermark = rows[-1][key]
+                    conn.execute("insert or replace into meta (key, value) values (?, ?)",
+                                 (f"{table}_watermark", watermark))
+            pulled += len(rows)
+        return pulled
+
+    def _copy(self, table: str, columns: str):
+        names = [c.strip() for c in columns.split(",")]
+        rows = db.fetch_all(table, columns)
+        with self._db() as conn:
+            conn.execute(f"delete from {table}")
+            conn.executemany(
+                f"insert into {table} ({', '.join(names)}) values ({', '.join('?' * len(names))})",
+                [tuple(row[name] for name in names) for row in rows],
+            )
+
+    def sync(self, force: bool = False) -> int:
+        """Pull changes from Supabase; returns how many sales and purchases came in.
+
+        Within `SYNC_TTL_S` of the last sync the copy is served as-is unless
+        `force` is set.
+        """
+        with self._lock:
+            if not force and time.monotonic() - self._synced_at < self._ttl:
+                return 0
+            for table, columns in _REFERENCE_TABLES:
+                self._copy(table, columns)
+            pulled = sum(self._pull(table, columns, key) for table, columns, key in _FACT_TABLES)
+            self._index = None
+            self._synced_at = time.monotonic()
+            return pulled
+
+    def invalidate(self, since: date):
+        """Re-read sales from `since` on at the next sync, e.g. after a till that was offline for days catches up."""
+        with self._lock, self._db() as conn:
+            mark = datetime.combine(since, datetime.min.time()).isoformat()
+            conn.execute("update meta set value = ? where key = 'sales_watermark' and value > ?", (mark, mark))
+            self._synced_at = 0.0
+
+    def rebuild(self) -> int:
+        """Drop the local copy and pull everything again."""
+        with self._lock, self._db() as conn:
+            for table in ["meta", *(table for table, _, _ in _FACT_TABLES)]:
+                conn.execute(f"delete from {table}")
+            self._synced_at = 0.0
+        return self.sync(force=True)
+
+    def query(self, sql: str, params: Union[tuple, dict] = ()) -> pd.DataFrame:
+        """Run a read-only query against the replica."""
+        with self._lock:
+            return pd.read_sql_query(sql, self._db(), params=params)
+
+    def sales_between(self, start: datetime, end: datetime) -> pd.DataFrame:
+        return self.query(SALES_SQL, (start.isoformat(), end.isoformat()))
+
+    def purchases_between(self, start: datetime, end: datetime) -> pd.DataFrame:
+        return self.query(PURCHASES_SQL, (start.isoformat(), end.isoformat()))
+
+    def daily_totals(self) -> tuple[dict[date, float], dict[date, float]]:
+        """Per-day sales and purchase totals, summed by SQLite."""
+        with self._lock:
+            conn = self._db()
+            return tuple(
+                {date.fromisoformat(day): float(total or 0) for day, total in conn.execute(sql)}
+                for sql in (SALES_BY_DAY_SQL, PURCHASES_BY_DAY_SQL)
+            )
+
+    # 📊 Same interface as the shared rollup
+    def refresh(self, force: bool = False) -> int:
+        return self.sync(force)
+
+    def index(self) -> DailyIndex:
+        """Prefix-sum index over the replica's daily totals, rebuilt after each sync."""
+        if self._index is None:
+            self._index = DailyIndex(*self.daily_totals())
+        return self._index
+
+    def bucketed(self, period: str) -> list[tuple[date, float, float]]:
+        return bucket_days(*self.daily_totals(), period)
+
+
+# 🌐 One replica per server process, shared across Streamlit sessions
+replica = Replica()
+
+
+def report_source() -> Union[Replica, DailyRollup]:
+    """Where the report pages read totals from: the replica if enabled, else the rollup."""
+    return replica if USE_REPLICA else rollup
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Optional
+
+# 📁 Local cache file; survives Streamlit restarts
+CACHE_PATH = os.getenv(
+    "REPORT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "reports.sqlite3"),
+)
+
+_SCHEMA = """
+create table if not exists periods (
+    kind   text not null,
+    period text not null,
+    value  real not null,
+    primary key (kind, period)
+);
+create table if not exists meta (
+    key   text primary key,
+    value text not null
+);
+"""
+
+
+class ReportCache:
+    """Totals for closed reporting periods, keyed by (report kind, period).
+
+    Closed periods never change, so they are kept until explicitly
+    invalidated. Every invalidation bumps a generation counter that other
+    processes sharing the file compare against to know they must reload.
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    with closing(sqlite3.connect(self.path)) as conn:
+                        conn.executescript(_SCHEMA)
+                    self._ready = True
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, kind: str) -> dict[str, float]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("select period, value from periods where kind = ?", (kind,))
+            return dict(rows.fetchall())
+
+    def store(self, kind: str, values: dict[str, float]):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "insert or replace into periods (kind, period, value) values (?, ?, ?)",
+                [(kind, period, value) for period, value in values.items()],
+            )
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("select value from meta where key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("insert or replace into meta (key, value) values (?, ?)", (key, value))
+
+    def generation(self) -> int:
+        return int(self.get_meta("generation") or 0)
+
+    def invalidate(self, since: str, kinds: Optional[list[str]] = None):
+        """Drop cached periods from `since` (ISO date) onwards and bump the generation."""
+        with closing(self._connect()) as conn, conn:
+            if kinds:
+                conn.executemany("delete from periods where kind = ? and period >= ?",
+                                 [(kind, since) for kind in kinds])
+            else:
+                conn.execute("delete from periods where period >= ?", (since,))
+            conn.execute("update meta set value = ? where key = 'closed_until' and value > ?",
+                         (since, since))
+            conn.execute(
+                "insert into meta (key, value) values ('generation', '1') "
+                "on conflict(key) do update set value = cast(value as integer) + 1"
+            )
+
+
+# 🌐 Shared handle; each call opens its own short-lived connection
+report_cache = ReportCache()
@@ -0,0 +1,284 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from modules import fetch_data as db
+from modules.report_cache import ReportCache, report_cache
+
+# ⏱️ How long the open (current) day may be served before checking for new rows
+OPEN_PERIOD_TTL_S = 15
+
+# 📅 Report period -> function mapping a day to the first day of its bucket
+PERIOD_START: dict[str, Callable[[date], date]] = {
+    "day": lambda d: d,
+    "week": lambda d: d - timedelta(days=d.weekday()),
+    "month": lambda d: d.replace(day=1),
+    "year": lambda d: d.replace(month=1, day=1),
+}
+
+
+def _day_of(timestamp: str) -> date:
+    return datetime.fromisoformat(timestamp).date()
+
+
+def instant(timestamp: str) -> datetime:
+    """A timestamp as an aware datetime; naive ones (till clocks) are stored as UTC."""
+    moment = datetime.fromisoformat(timestamp)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def _settled_until(today: date) -> date:
+    """The first day a late till could still add rows to; days before it are closed."""
+    return (datetime.combine(today, datetime.min.time()) - db.LATE_SALE_WINDOW).date()
+
+
+class LateRows:
+    """New rows of one table, read in `(time, id)` order and each exactly once.
+
+    A till that was offline stamps its sales before ones other tills have
+    already synced, so every read starts `window` below the newest time
+    seen and skips the ids it read in that window. Rows at or before the
+    starting point are never read.
+    """
+
+    def __init__(self, table: str, time_column: str, columns: str, window: timedelta = db.LATE_SALE_WINDOW):
+        self.table = table
+        self.time_column = time_column
+        self.columns = columns
+        self.window = window
+        self.watermark: Optional[datetime] = None  # newest time read
+        self._floor: Optional[datetime] = None
+        self._after: Optional[str] = None
+        self._seen: dict[Any, datetime] = {}
+
+    def start_after(self, timestamp: str):
+        """Read rows stamped after `timestamp` from here on."""
+        self.watermark = self._floor = instant(timestamp)
+        self._after = timestamp
+        self._seen = {}
+
+    def chunks(self) -> Iterator[list[db.Row]]:
+        """Yield the rows not read before, a chunk at a time."""
+        # 🔗 Basket and invoice lines share a timestamp; the id keeps them apart across pages
+        for rows in db.iter_chunks(self.table, self.columns, key=self.time_column, tiebreak="id",
+                                   after=self._after, prefetch=True):
+            fresh = []
+            for row in rows:
+                moment = instant(row[self.time_column])
+                if moment <= self._floor or row["id"] in self._seen:
+                    continue
+                self._seen[row["id"]] = moment
+                self.watermark = max(self.watermark, moment)
+                fresh.append(row)
+            if fresh:
+                yield fresh
+        bound = self.watermark - self.window
+        self._after = max(bound, self._floor).isoformat()
+        self._seen = {row_id: moment for row_id, moment in self._seen.items() if moment > bound}
+
+
+class _Stream:
+    """One source table folded into per-day totals as its rows come in."""
+
+    def __init__(self, table: str, time_column: str, columns: str,
+                 amount: Callable[[dict], float]):
+        self.table = table
+        self.time_column = time_column
+        self.amount = amount
+        self.days: dict[date, float] = defaultdict(float)
+        self.rows = LateRows(table, time_column, columns)
+
+    def merge_new_rows(self) -> int:
+        merged = 0
+        for rows in self.rows.chunks():
+            for row in rows:
+                self.days[_day_of(row[self.time_column])] += self.amount(row)
+            merged += len(rows)
+        return merged
+
+
+def bucket_days(sales: dict[date, float], purchases: dict[date, float],
+                period: str) -> list[tuple[date, float, float]]:
+    """Fold per-day totals into `(bucket start, sales, purchases)` rows, oldest first."""
+    to_bucket = PERIOD_START[period]
+    buckets: dict[date, list[float]] = defaultdict(lambda: [0.0, 0.0])
+    for d, v in sales.items():
+        buckets[to_bucket(d)][0] += v
+    for d, v in purchases.items():
+        buckets[to_bucket(d)][1] += v
+    return [(start, s, p) for start, (s, p) in sorted(buckets.items())]
+
+
+class DailyIndex:
+    """Dense per-day prefix sums answering any date range in O(1).
+
+    `cum_sales[i]` is the total of all days before `origin + i`, so the total
+    for `[start, end)` is `cum[end] - cum[start]`: two array lookups.
+    """
+
+    def __init__(self, sales: dict[date, float], purchases: dict[date, float]):
+        days = list(sales) + list(purchases)
+        self.origin = min(days) if days else date.today()
+        size = (max(days) - self.origin).days + 1 if days else 0
+        self._origin64 = np.datetime64(self.origin, "D")
+        self.cum_sales = self._prefix(sales, size)
+        self.cum_purchases = self._prefix(purchases, size)
+        self.cum_net = self.cum_sales - self.cum_purchases
+
+    def _prefix(self, totals: dict[date, float], size: int) -> np.ndarray:
+        daily = np.zeros(size)
+        if totals:
+            offsets = (np.array(list(totals), dtype="datetime64[D]") - self._origin64).astype(np.int64)
+            np.add.at(daily, offsets, np.fromiter(totals.values(), dtype=float))
+        return np.concatenate(([0.0], np.cumsum(daily)))
+
+    def _positions(self, days: Sequence[date]) -> np.ndarray:
+        offsets = (np.array(days, dtype="datetime64[D]") - self._origin64).astype(np.int64)
+        return np.clip(offsets, 0, len(self.cum_sales) - 1)
+
+    def range_totals_many(self, starts: Sequence[date], ends: Sequence[date]):
+        """Sales, purchases and net arrays for each `[starts[i], ends[i])`."""
+        lo, hi = self._positions(starts), self._positions(ends)
+        hi = np.maximum(hi, lo)
+        return (self.cum_sales[hi] - self.cum_sales[lo],
+                self.cum_purchases[hi] - self.cum_purchases[lo],
+                self.cum_net[hi] - self.cum_net[lo])
+
+    def range_totals(self, start: date, end: date) -> tuple[float, float, float]:
+        sales, purchases, net = self.range_totals_many([start], [end])
+        return float(sales[0]), float(purchases[0]), float(net[0])
+
+
+def shift_year(d: date, years: int) -> date:
+    """Same calendar day `years` away; Feb 29 falls back to Feb 28."""
+    try:
+        return d.replace(year=d.year + years)
+    except ValueError:
+        return d.replace(year=d.year + years, day=28)
+
+
+class DailyRollup:
+    """Per-day sales and purchase totals shared by every report page.
+
+    The first refresh loads closed days from the on-disk report cache and
+    asks the `summary_totals` SQL function only for closed days the cache
+    does not have yet. Every refresh after that only pulls rows newer than
+    each table's high-water mark (`date_sold` / `created_at`), less
+    `LATE_SALE_WINDOW` for tills that sync late, and adds them to their
+    day, so opening a report costs as much as the new activity. A day is
+    closed, and written to the cache, once that window has passed after it.
+    """
+
+    def __init__(self, cache: ReportCache = report_cache):
+        self._lock = threading.Lock()
+        self._cache = cache
+        self._reset()
+
+    def _reset(self):
+        self._index: Optional[DailyIndex] = None
+        self._generation: Optional[int] = None
+        self._closed_until: Optional[date] = None  # days before this are on disk
+        self._refreshed_at = 0.0
+        self.sales = _Stream("sales", "date_sold", "total_price",
+                             lambda row: row["total_price"] or 0)
+        self.purchases = _Stream("purchases", "created_at", "quantity_purchased, unit_cost",
+                                 lambda row: (row["quantity_purchased"] or 0) * (row["unit_cost"] or 0))
+
+    def _seed(self):
+        settled = _settled_until(date.today())
+        self._generation = self._cache.generation()
+        for stream in (self.sales, self.purchases):
+            for day, value in self._cache.load(f"{stream.table}_day").items():
+                if date.fromisoformat(day) < settled:
+                    stream.days[date.fromisoformat(day)] = value
+
+        # 🗄️ Closed days missing from the cache come from the database once
+        closed_until = self._cache.get_meta("closed_until")
+        since = datetime.combine(date.fromisoformat(closed_until), datetime.min.time()) if closed_until else None
+        midnight = datetime.combine(settled, datetime.min.time())
+        if since is None or since < midnight:
+            fetched_sales, fetched_purchases = {}, {}
+            for row in db.fetch_summary_totals("day", since=since, until=midnight):
+                fetched_sales[row["period"]] = float(row["total_sales"])
+                fetched_purchases[row["period"]] = float(row["total_purchases"])
+            for stream, fetched in ((self.sales, fetched_sales), (self.purchases, fetched_purchases)):
+                for day, value in fetched.items():
+                    stream.days[date.fromisoformat(day)] = value
+                self._cache.store(f"{stream.table}_day", fetched)
+            self._cache.set_meta("closed_until", settled.isoformat())
+        self._closed_until = settled
+
+        # Everything strictly before the settled day is in; raw rows take over from here
+        mark = (midnight - timedelta(microseconds=1)).isoformat()
+        self.sales.rows.start_after(mark)
+        self.purchases.rows.start_after(mark)
+
+    def _close_finished_days(self):
+        """Persist days that closed while this process kept running."""
+        settled = _settled_until(date.today())
+        if self._closed_until >= settled:
+            return
+        for stream in (self.sales, self.purchases):
+            finished = {d.isoformat(): v for d, v in stream.days.items() if self._closed_until <= d < settled}
+            self._cache.store(f"{stream.table}_day", finished)
+        self._cache.set_meta("closed_until", settled.isoformat())
+        self._closed_until = settled
+
+    def refresh(self, force: bool = False) -> int:
+        """Merge rows added since the last refresh; returns how many were merged.
+
+        Within `OPEN_PERIOD_TTL_S` of the last refresh the buckets are served
+        as-is unless `force` is set.
+        """
+        with self._lock:
+            seeded = self.sales.rows.watermark is not None
+            if seeded and not force and time.monotonic() - self._refreshed_at < OPEN_PERIOD_TTL_S:
+                return 0
+            if seeded and self._cache.generation() != self._generation:
+                # Another process (or a backdated write) invalidated the cache
+                self._reset()
+                seeded = False
+            try:
+                if not seeded:
+                    self._seed()
+                merged = sum(db.gather(self.sales.merge_new_rows, self.purchases.merge_new_rows))
+            except Exception:
+                # A timed-out merge may still be running; start over from disk next time
+                self._reset()
+                raise
+            self._close_finished_days()
+            if not seeded or merged:
+                self._index = None
+            self._refreshed_at = time.monotonic()
+            return merged
+
+    def invalidate(self, since: date):
+        """Forget cached totals from `since` on, e.g. after a backdated purchase."""
+        with self._lock:
+            self._cache.invalidate(since.isoformat())
+            self._reset()
+
+    def index(self) -> DailyIndex:
+        """Prefix-sum index over the current buckets, rebuilt only after new rows."""
+        with self._lock:
+            if self._index is None:
+                self._index = DailyIndex(self.sales.days, self.purchases.days)
+            return self._index
+
+    def totals(self, start: date, end: date) -> tuple[float, float]:
+        """Sales and purchase totals for days in `[start, end)`."""
+        sales, purchases, _ = self.index().range_totals(start, end)
+        return sales, purchases
+
+    def bucketed(self, period: str) -> list[tuple[date, float, float]]:
+        """`(bucket start, sales, purchases)` per day/week/month/year, oldest first."""
+        with self._lock:
+            return bucket_days(self.sales.days, self.purchases.days, period)
+
+
+# 🌐 One rollup per server process, shared across Streamlit sessions
+rollup = DailyRollup()
@@ -0,0 +1,106 @@
+from collections import defaultdict
+from typing import Any
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Typo-tolerant name search over prefix and trigram postings.
+
+    Names are split into words; every word prefix and every trigram of the
+    whole name points at the ids that contain it. A query only scores the
+    ids its own prefixes and trigrams hit, ranking by trigram overlap (which
+    survives typos) with a bonus for prefix and exact matches. `sync()`
+    re-indexes only the ids whose name changed.
+    """
+
+    MIN_SCORE = 0.3
+
+    def __init__(self):
+        self._names: dict[Any, str] = {}
+        self._keys: dict[Any, str] = {}
+        self._gram_counts: dict[Any, int] = {}
+        self._prefixes: dict[str, set] = defaultdict(set)
+        self._trigrams: dict[str, set] = defaultdict(set)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _postings(self, key: str):
+        prefixes = {word[:i] for word in key.split() for i in range(1, len(word) + 1)}
+        return prefixes, _trigrams(key)
+
+    def add(self, item_id: Any, name: str):
+        if item_id in self._names:
+            self.remove(item_id)
+        key = _normalize(name)
+        self._names[item_id] = name
+        self._keys[item_id] = key
+        prefixes, grams = self._postings(key)
+        self._gram_counts[item_id] = len(grams)
+        for prefix in prefixes:
+            self._prefixes[prefix].add(item_id)
+        for gram in grams:
+            self._trigrams[gram].add(item_id)
+
+    def remove(self, item_id: Any):
+        key = self._keys.pop(item_id, None)
+        if key is None:
+            return
+        del self._names[item_id]
+        del self._gram_counts[item_id]
+        prefixes, grams = self._postings(key)
+        for prefix in prefixes:
+            self._prefixes[prefix].discard(item_id)
+            if not self._prefixes[prefix]:
+                del self._prefixes[prefix]
+        for gram in grams:
+            self._trigrams[gram].discard(item_id)
+            if not self._trigrams[gram]:
+                del self._trigrams[gram]
+
+    def sync(self, rows: list[dict]):
+        """Bring the index in line with `rows` (each with `id` and `name`)."""
+        current = {row["id"]: row["name"] or "" for row in rows}
+        for item_id in [i for i in self._names if i not in current]:
+            self.remove(item_id)
+        for item_id, name in current.items():
+            if self._names.get(item_id) != name:
+                self.add(item_id, name)
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[Any, str, float]]:
+        """Best `(id, name, score)` matches for `query`, highest score first."""
+        key = _normalize(query)
+        if not key:
+            return []
+        query_grams = _trigrams(key)
+        words = key.split()
+
+        overlap: dict[Any, int] = defaultdict(int)
+        for gram in query_grams:
+            for item_id in self._trigrams.get(gram, ()):
+                overlap[item_id] += 1
+        prefix_hits = set.intersection(*(self._prefixes.get(word, set()) for word in words))
+
+        results = []
+        for item_id in set(overlap) | prefix_hits:
+            item_key = self._keys[item_id]
+            # Dice coefficient of the trigram sets
+            score = 2 * overlap.get(item_id, 0) / (len(query_grams) + self._gram_counts[item_id])
+            if item_id in prefix_hits:
+                score += 0.5
+            if item_key == key:
+                score += 1.0
+            elif item_key.startswith(key):
+                score += 0.25
+            if score >= self.MIN_SCORE:
+                results.append((item_id, self._names[item_id], score))
+        results.sort(key=lambda r: (-r[2], r[1].lower()))
+        return results[:limit]
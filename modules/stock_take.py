@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from modules import fetch_data as db
+
+# 📋 Columns of a count sheet; only `counted` is filled in by staff
+SHEET_COLUMNS = ["id", "name", "category", "stock_quantity", "counted"]
+
+# 📒 Ledger reason stock-take adjustments are recorded under
+STOCK_TAKE_REASON = "stock_take"
+
+
+def count_sheet(drugs: list[db.Row]) -> pd.DataFrame:
+    """A blank count sheet for `drugs`, ordered by category and name as staff walk the shelves."""
+    sheet = pd.DataFrame(drugs, columns=SHEET_COLUMNS[:-1])
+    sheet["stock_quantity"] = sheet["stock_quantity"].fillna(0).astype("int64")
+    sheet["counted"] = pd.Series(pd.NA, index=sheet.index, dtype="Int64")
+    return sheet.sort_values(["category", "name"], key=lambda col: col.str.lower(),
+                             na_position="last", ignore_index=True)
+
+
+def merge_counts(sheet: pd.DataFrame, counts: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Fill `counted` on the sheet from validated upload rows.
+
+    Rows are matched on `id` if the upload has it, else on the drug name
+    (ignoring case). A drug counted on several rows, e.g. stock kept in two
+    places, gets their sum. Returns the new sheet and the rows that matched
+    no drug.
+    """
+    if "id" in counts.columns:
+        ids = counts["id"].where(counts["id"].isin(sheet["id"]))
+    else:
+        by_name = pd.Series(sheet["id"].to_numpy(), index=sheet["name"].str.lower())
+        ids = counts["drug_name"].str.lower().map(by_name[~by_name.index.duplicated()])
+    matched = ids.notna()
+    totals = counts.loc[matched, "counted"].groupby(ids[matched]).sum()
+
+    out = sheet.copy()
+    uploaded = out["id"].map(totals)
+    out["counted"] = uploaded.astype("Int64").where(uploaded.notna(), out["counted"])
+    return out, counts.loc[~matched]
+
+
+def variances(sheet: pd.DataFrame, prices: dict) -> pd.DataFrame:
+    """Counted drugs whose count differs from their stock, largest value first.
+
+    `variance` is counted minus recorded units; `value` is that at the
+    drug's selling price. Drugs left blank on the sheet are not adjusted.
+    """
+    counted = sheet.loc[sheet["counted"].notna()]
+    counted = counted.assign(counted=counted["counted"].astype("int64"))
+    out = counted.loc[counted["counted"] != counted["stock_quantity"]].copy()
+    out["variance"] = out["counted"] - out["stock_quantity"]
+    out["value"] = out["variance"] * out["id"].map(prices).fillna(0).astype(float)
+    return out.sort_values("value", key=np.abs, ascending=False, ignore_index=True)
+
+
+def to_levels(adjustments: pd.DataFrame) -> list[db.Row]:
+    """`set_stock_levels()` rows: each drug's counted stock and the stock it was counted against."""
+    return [{"id": row["id"].item() if isinstance(row["id"], np.generic) else row["id"],
+             "stock_quantity": int(row["counted"]), "was": int(row["stock_quantity"])}
+            for row in adjustments.to_dict("records")]
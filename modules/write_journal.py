@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional
+
+from modules import fetch_data as db
+from modules.catalog import drug_catalog, lot_catalog
+from modules.cogs import cogs
+from modules.forecast import demand
+from modules.replica import USE_REPLICA, replica
+from modules.rollup import rollup
+
+# 📁 Local journal file; sales and purchases land here before Supabase
+JOURNAL_PATH = os.getenv(
+    "WRITE_JOURNAL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "write_journal.sqlite3"),
+)
+
+# 🚚 Most entries replayed in one call
+SYNC_BATCH_SIZE = 50
+# 🔁 First and longest wait between attempts while Supabase is unreachable
+RETRY_DELAY_S = 2.0
+MAX_RETRY_DELAY_S = 60.0
+# ⏱️ How long a page waits for the sync before acknowledging locally
+ACK_WAIT_S = 1.5
+
+PENDING, APPLIED, CONFLICT, REJECTED = "pending", "applied", "conflict", "rejected"
+
+_SCHEMA = """
+pragma journal_mode = wal;
+create table if not exists journal (
+    id           integer primary key autoincrement,
+    request_key  text not null unique,
+    kind         text not null,
+    payload      text not null,
+    performed_by text,
+    status       text not null default 'pending',
+    result       text,
+    error        text,
+    attempts     integer not null default 0,
+    created_at   text not null,
+    synced_at    text,
+    dismissed    integer not null default 0
+);
+create index if not exists journal_pending on journal (status, id);
+"""
+
+
+def _entry(row: sqlite3.Row) -> db.Row:
+    entry = dict(row)
+    entry["payload"] = json.loads(entry["payload"])
+    entry["result"] = json.loads(entry["result"]) if entry["result"] else None
+    return entry
+
+
+def _entry_date(kind: str, payload: db.Row) -> date:
+    if kind == "sales":
+        return date.fromisoformat(payload["date_sold"][:10])
+    return min(date.fromisoformat(item["date_purchased"][:10]) for item in payload["items"])
+
+
+def _after_apply(kind: str, payload: db.Row, result: list[db.Row]):
+    """Bring the shared caches in line with a write that just reached the database."""
+    for row in result:
+        drug_catalog.update(row["drug_id"], {"stock_quantity": row["stock_quantity"]})
+    lot_catalog.invalidate()
+    # 🗄️ A write landing after its day closed reopens the cached report periods
+    written_on = _entry_date(kind, payload)
+    if written_on < date.today():
+        rollup.invalidate(written_on)
+        if kind == "sales":
+            demand.invalidate()
+            cogs.reread_from(written_on)
+            if USE_REPLICA:
+                replica.invalidate(written_on)
+
+
+class WriteJournal:
+    """Local write-ahead journal for sales and purchases.
+
+    `submit()` commits the write under the caller's request key to a
+    WAL-mode SQLite file and returns straight away. A background worker replays pending entries
+    to Supabase in order, in batches, through `apply_journal()`; the request
+    key makes a replay that is sent twice apply once. Entries the database
+    refuses (not enough stock, a deleted drug) are kept as conflicts for the
+    pages to report instead of being retried.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH, batch_size: int = SYNC_BATCH_SIZE):
+        self.path = path
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+
+    def _db(self) -> sqlite3.Connection:
+        """The journal connection; callers hold `_lock`."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute("pragma synchronous = full")
+        return self._conn
+
+    def start(self):
+        """Start the sync worker (idempotent); it also replays entries left by an earlier run."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="write-journal-sync", daemon=True)
+                    self._thread.start()
+
+    def submit(self, request_key: str, kind: str, payload: db.Row, performed_by: Optional[str] = None) -> bool:
+        """Journal a `"sales"` or `"purchases"` write under `request_key`.
+
+        Returns once the entry is on disk: True if it is new, False if that
+        key was already journaled (a double click or a retried submit), in
+        which case nothing is added.
+        """
+        with self._lock, self._db() as conn:
+            created = conn.execute(
+                "insert into journal (request_key, kind, payload, performed_by, created_at) values (?, ?, ?, ?, ?) "
+                "on conflict (request_key) do nothing",
+                (request_key, kind, json.dumps(payload), performed_by, datetime.now().isoformat()),
+            ).rowcount == 1
+        self.start()
+        self._wake.set()
+        return created
+
+    def get(self, request_key: str) -> Optional[db.Row]:
+        with self._lock:
+            row = self._db().execute("select * from journal where request_key = ?", (request_key,)).fetchone()
+        return _entry(row) if row else None
+
+    def wait(self, request_key: str, timeout: float = ACK_WAIT_S) -> db.Row:
+        """The entry once it has synced, or as it stands after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        with self._synced:
+            while True:
+                row = self._db().execute("select * from journal where request_key = ?", (request_key,)).fetchone()
+                remaining = deadline - time.monotonic()
+                if row["status"] != PENDING or remaining <= 0:
+                    return _entry(row)
+                self._synced.wait(remaining)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._db().execute("select count(*) from journal where status = ?", (PENDING,)).fetchone()[0]
+
+    def problems(self) -> list[db.Row]:
+        """Conflicted or rejected entries nobody has dismissed yet, oldest first."""
+        with self._lock:
+            rows = self._db().execute(
+                "select * from journal where status in (?, ?) and not dismissed order by id", (CONFLICT, REJECTED)
+            ).fetchall()
+        return [_entry(row) for row in rows]
+
+    def dismiss(self, request_key: str):
+        with self._lock, self._db() as conn:
+            conn.execute("update journal set dismissed = 1 where request_key = ?", (request_key,))
+
+    def _pending_batch(self) -> list[db.Row]:
+        with self._lock:
+            rows = self._db().execute(
+                "select * from journal where status = ? order by id limit ?", (PENDING, self._batch_size)
+            ).fetchall()
+        return [_entry(row) for row in rows]
+
+    def _sync_batch(self, batch: list[db.Row]):
+        outcomes = db.apply_journal([
+            {"key": entry["request_key"], "kind": entry["kind"], "payload": entry["payload"]} for entry in batch
+        ])
+        by_key = {outcome["request_key"]: outcome for outcome in outcomes}
+        synced_at = datetime.now().isoformat()
+        with self._synced:
+            with self._db() as conn:
+                conn.executemany(
+                    "update journal set status = ?, result = ?, error = ?, attempts = attempts + 1, synced_at = ? "
+                    "where request_key = ?",
+                    [(outcome["status"], json.dumps(outcome["result"]), outcome["error"], synced_at, key)
+                     for key, outcome in by_key.items()],
+                )
+            self._synced.notify_all()
+        for entry in batch:
+            outcome = by_key.get(entry["request_key"])
+            if outcome and outcome["status"] == APPLIED:
+                _after_apply(entry["kind"], entry["payload"], outcome["result"] or [])
+            elif outcome:
+                drug_catalog.invalidate()
+
+    def _run(self):
+        delays = db.backoff_delays(RETRY_DELAY_S, MAX_RETRY_DELAY_S)
+        while True:
+            self._wake.clear()
+            batch = self._pending_batch()
+            if not batch:
+                self._wake.wait()
+                continue
+            try:
+                self._sync_batch(batch)
+                self.last_error = None
+                delays = db.backoff_delays(RETRY_DELAY_S, MAX_RETRY_DELAY_S)
+            except Exception as e:
+                # 📴 Offline or timed out: keep the entries and try again later
+                self.last_error = str(e)
+                with self._lock, self._db() as conn:
+                    conn.executemany("update journal set attempts = attempts + 1 where request_key = ?",
+                                     [(entry["request_key"],) for entry in batch])
+                self._wake.wait(next(delays))
+
+
+# 🌐 One journal per server process, shared across Streamlit sessions
+journal = WriteJournal()
@@ -1,16 +1,8 @@
-import os
 import streamlit as st
-from dotenv import load_dotenv
-from supabase import create_client, Client
 import hashlib
 
-# Load environment variables
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-
-# Initialize Supabase client
-supabase: Client = create_client(url, key)
+from modules import fetch_data as db
+from utils.logger import audit
 
 # Hashing function
 def hash_password(password: str) -> str:
@@ -42,8 +34,9 @@ if st.button("Reset Password"):
         else:
             hashed_pw = hash_password(new_password)
             try:
-                response = supabase.table("users").update({"password_hash": hashed_pw}).eq("email", email).execute()
-                if response.data:
+                updated = db.update_user_by_email(email, {"password_hash": hashed_pw})
+                if updated:
+                    audit.log("reset_password", email, f"Password reset for {email}")
                     st.success("✅ Password updated successfully!")
                 else:
                     st.error("❌ Email not found or update failed.")
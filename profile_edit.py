@@ -1,15 +1,7 @@
-import os
 import streamlit as st
-from dotenv import load_dotenv
-from supabase import create_client, Client
 
-# Load environment variables
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-
-# Initialize Supabase client
-supabase: Client = create_client(url, key)
+from modules import fetch_data as db
+from utils.logger import audit
 
 # 🔐 Login check helper
 def require_login():
@@ -36,12 +28,14 @@ if st.button("Update Profile"):
         st.error("❌ Both fields are required.")
     else:
         try:
-            response = supabase.table("users").update({
+            updated = db.update_user(user["id"], {
                 "name": new_name,
                 "email": new_email
-            }).eq("id", user["id"]).execute()
+            })
 
-            if response.data:
+            if updated:
+                audit.log("update_profile", user.get("email"),
+                          f"Profile of {user.get('email')} changed to name {new_name!r}, email {new_email!r}")
                 st.success("✅ Profile updated successfully!")
                 # Update session state
                 st.session_state["user"]["name"] = new_name
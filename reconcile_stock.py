@@ -0,0 +1,127 @@
+"""🧮 Stock reconciliation, run from the command line without Streamlit.
+
+Recomputes every drug's stock from its history and reports the drugs whose
+`stock_quantity` differs from it:
+
+    python reconcile_stock.py                  # report only
+    python reconcile_stock.py --apply          # also correct the drifted drugs
+    python reconcile_stock.py --csv drift.csv  # keep the report
+
+Expected stock is the sum of the drug's ledger movements: its opening
+balance, sales, purchases, adjustments, write-offs and stock-takes, read
+in ledger id order. Earlier reconciliations are left out, as they only
+brought stock back to this figure. Drift is then stock that changed
+without a ledger row, e.g. a restore or an import with the triggers off;
+a sale or purchase counts however late its till synced.
+`--history-only` ignores the ledger and expects all purchases minus all
+sales, for databases without sql/stock_movements.sql.
+
+Exit status: 0 when nothing drifted or every drift was corrected, 1 when
+drift was found and left, 2 when the correction could not be written.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from modules import fetch_data as db
+
+# 📒 Ledger reason the corrections are recorded under
+REASON = "reconciliation"
+
+
+def _units_by_drug(chunks: Iterator[list[db.Row]], column: str) -> pd.Series:
+    """Sum `column` per drug, one groupby per streamed chunk."""
+    partials = [pd.DataFrame(rows, columns=["drug_id", column]).groupby("drug_id")[column].sum()
+                for rows in chunks]
+    if not partials:
+        return pd.Series(dtype="int64")
+    return pd.concat(partials).groupby(level=0).sum()
+
+
+def reconcile(history_only: bool = False) -> pd.DataFrame:
+    """Every drug's recorded and expected stock, with `drift` = recorded - expected."""
+    def read_drugs():
+        return db.fetch_all("drugs", "id, name, stock_quantity")
+
+    # 📒 Every source is paged by its unique id, so no row is skipped or filtered out by a clock
+    if history_only:
+        drugs, purchased, sold = db.gather(
+            read_drugs,
+            lambda: _units_by_drug(db.iter_chunks("purchases", "drug_id, quantity_purchased", prefetch=True),
+                                   "quantity_purchased"),
+            lambda: _units_by_drug(db.iter_chunks("sales", "drug_id, quantity_sold", prefetch=True), "quantity_sold"),
+            timeout=None,
+        )
+        expected = pd.concat([purchased, -sold], axis=1).sum(axis=1)
+    else:
+        drugs, expected = db.gather(
+            read_drugs,
+            lambda: _units_by_drug(db.iter_chunks("stock_movements", "drug_id, change", prefetch=True,
+                                                  filters=lambda query: query.neq("reason", REASON)), "change"),
+            timeout=None,
+        )
+
+    report = pd.DataFrame(drugs, columns=["id", "name", "stock_quantity"]).set_index("id")
+    report["stock_quantity"] = report["stock_quantity"].fillna(0).astype("int64")
+    report["expected"] = expected.reindex(report.index, fill_value=0).round().astype("int64")
+    report["drift"] = report["stock_quantity"] - report["expected"]
+    return report.reset_index()
+
+
+def apply_corrections(drifted: pd.DataFrame, performed_by: str) -> list[db.Row]:
+    """Set the drifted drugs to their expected stock and write one audit row per drug, in one call."""
+    rows = [{"id": row["id"], "stock_quantity": row["expected"], "was": row["stock_quantity"]}
+            for row in drifted.to_dict("records")]
+    request_key = db.new_request_key()
+    timestamp = datetime.now(timezone.utc).isoformat()
+    audit_rows = [{"action": "reconcile_stock", "performed_by": performed_by, "timestamp": timestamp,
+                   "details": f"{row['name']} (ID {row['id']}): stock {row['stock_quantity']} -> {row['expected']} "
+                              f"({-row['drift']:+d}), run {request_key}"}
+                  for row in drifted.to_dict("records")]
+    return db.set_stock_levels(rows, REASON, audit_rows, request_key)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare drug stock with what its ledger implies.")
+    parser.add_argument("--apply", action="store_true", help="set drifted drugs to their expected stock")
+    parser.add_argument("--history-only", action="store_true",
+                        help="ignore the stock ledger and expect purchases minus sales")
+    parser.add_argument("--csv", metavar="PATH", help="also write the drifted drugs to PATH")
+    parser.add_argument("--by", default="reconcile_stock", help="name recorded on audit entries")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    report = reconcile(args.history_only)
+    drifted = report.loc[report["drift"] != 0].sort_values("drift", key=abs, ascending=False, ignore_index=True)
+    print(f"🧮 Checked {len(report):,} drug(s) in {time.monotonic() - started:.1f}s; "
+          f"{len(drifted):,} drifted by {int(drifted['drift'].abs().sum()):,} unit(s) in total.")
+    if drifted.empty:
+        return 0
+    print(drifted.to_string(index=False))
+    if args.csv:
+        drifted.to_csv(args.csv, index=False)
+
+    if not args.apply:
+        return 1
+    negative = drifted["expected"] < 0
+    if negative.any():
+        print(f"⚠️ Skipping {int(negative.sum())} drug(s) whose history implies negative stock; check them by hand.")
+    try:
+        written = apply_corrections(drifted.loc[~negative], args.by)
+    except db.StaleRows as e:
+        print(f"❌ {e}. Stock moved while reconciling; run again.")
+        return 2
+    except Exception as e:
+        print(f"❌ Failed to correct stock: {e}")
+        return 2
+    print(f"✅ Corrected {len(written):,} drug(s).")
+    return 1 if negative.any() else 0
+
+
+# 🏁 Execute if run directly
+if __name__ == "__main__":
+    sys.exit(main())
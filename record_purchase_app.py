@@ -1,14 +1,16 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
 import streamlit as st
-from datetime import datetime, date
+import pandas as pd
+from datetime import date
 
-# 🌍 Load environment variables
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from modules import fetch_data as db
+from modules.catalog import drug_catalog, supplier_catalog
+from modules.forecast import LEAD_TIME_DAYS, LOOKBACK_DAYS, REVIEW_DAYS, by_supplier, demand, reorder_plan
+from modules.write_journal import journal
+from components.request_key import request_key
+from components.search_select import search_select
+from components.sync_status import acknowledge, sync_status
+from utils.logger import audit
+from utils.validators import INVOICE_OPTIONAL, INVOICE_REQUIRED, validate_invoice
 
 # 🔐 Role check helper
 def require_role(allowed_roles):
@@ -21,31 +23,49 @@ def require_role(allowed_roles):
         return None
     return user
 
-def run():
-    st.title("📥 Record Drug Purchase")
-
-    # 🔒 Enforce access control
-    user = require_role(["procurement", "admin"])
-    if not user:
-        st.stop()
+# 🔮 What to buy: drugs at their reorder point, from daily sales velocity and variability
+def reorder_suggestions(drug_data, supplier_data):
+    st.caption(f"Based on daily sales over the last {LOOKBACK_DAYS} days, a {LEAD_TIME_DAYS}-day delivery time "
+               f"and orders that last {REVIEW_DAYS} days beyond it.")
+    try:
+        # 📥 Only sales recorded since the last refresh are fetched
+        demand.refresh()
+        plan = reorder_plan(drug_data, demand.window([drug["id"] for drug in drug_data]))
+    except Exception as e:
+        st.error(f"❌ Failed to load sales history: {e}")
+        return
 
-    user_id = user["id"]
+    shown = plan.assign(
+        supplier=plan["supplier_id"].map({s["id"]: s["name"] for s in supplier_data}),
+        days_of_cover=plan["days_of_cover"].round(1).replace(float("inf"), float("nan")),
+        daily_velocity=plan["daily_velocity"].round(2),
+    ).rename(columns={
+        "name": "Drug", "supplier": "Supplier", "stock_quantity": "Stock", "daily_velocity": "Sold / Day",
+        "days_of_cover": "Days of Cover", "stock_out_date": "Runs Out", "reorder_point": "Reorder Point",
+        "suggested_quantity": "Suggested Order",
+    })[["Drug", "Supplier", "Stock", "Sold / Day", "Days of Cover", "Runs Out", "Reorder Point", "Suggested Order"]]
 
-    # 📦 Fetch drugs
-    drug_data = supabase.table("drugs").select("id", "name", "stock_quantity").execute().data
-    drug_names = [drug["name"] for drug in drug_data]
+    due = shown.loc[shown["Suggested Order"] > 0]
+    if due.empty:
+        st.success("✅ No drug has reached its reorder point.")
+    else:
+        st.subheader(f"🛒 {len(due)} Drug(s) to Reorder")
+        st.dataframe(by_supplier(plan, {s["id"]: s["name"] for s in supplier_data}).rename(columns={
+            "supplier": "Supplier", "drugs": "Drugs", "units": "Units"
+        }), hide_index=True)
+        st.dataframe(due, hide_index=True)
 
-    typed_drug_name = st.text_input("🧪 Drug Name (type or select)", placeholder="Start typing...")
-    matching_drugs = [name for name in drug_names if typed_drug_name.lower() in name.lower()]
-    selected_drug_name = st.selectbox("Matching Drugs", matching_drugs) if matching_drugs else typed_drug_name
+    with st.expander("📈 Days of Cover for All Drugs"):
+        st.dataframe(shown, hide_index=True)
 
-    # 🧑‍💼 Fetch suppliers
-    supplier_data = supabase.table("suppliers").select("id", "name").execute().data
-    supplier_names = [s["name"] for s in supplier_data]
+# 📝 One purchase per form submit
+def single_purchase(user):
+    existing_drug, selected_drug_name = search_select("🧪 Drug Name (type or select)", drug_catalog,
+                                                      key="purchase_drug", allow_new=True)
 
-    typed_supplier_name = st.text_input("🏢 Supplier Name", placeholder="Start typing...")
-    matching_suppliers = [name for name in supplier_names if typed_supplier_name.lower() in name.lower()]
-    selected_supplier_name = st.selectbox("Matching Suppliers", matching_suppliers) if matching_suppliers else typed_supplier_name
+    # 🧑‍💼 Suppliers
+    existing_supplier, selected_supplier_name = search_select("🏢 Supplier Name", supplier_catalog,
+                                                              key="purchase_supplier", allow_new=True)
 
     quantity_purchased = st.number_input("📦 Quantity Purchased", min_value=1)
     unit_cost = st.number_input("💵 Unit Cost (UGX)", min_value=0)
@@ -53,22 +73,21 @@ def run():
     expiry_date = st.date_input("📅 Expiry Date (optional)", value=None)
 
     # ✅ Submission logic
-    if st.button("📦 Record Purchase") and selected_drug_name and selected_supplier_name and unit_cost > 0:
+    submitted = st.button("📦 Record Purchase")
+    purchase_key = request_key("single_purchase", submitted)
+    if submitted and selected_drug_name and selected_supplier_name and unit_cost > 0:
         try:
             # 🔎 Check or add supplier
-            existing_supplier = next((s for s in supplier_data if s["name"].lower() == selected_supplier_name.lower()), None)
             if existing_supplier:
                 supplier_id = existing_supplier["id"]
             else:
                 new_supplier = {"name": selected_supplier_name}
-                result = supabase.table("suppliers").insert(new_supplier).execute()
-                supplier_id = result.data[0]["id"]
+                supplier_id = db.insert_supplier(new_supplier, f"{purchase_key}:supplier")["id"]
+                supplier_catalog.invalidate()
 
             # 🔎 Check or add drug
-            existing_drug = next((d for d in drug_data if d["name"].lower() == selected_drug_name.lower()), None)
             if existing_drug:
                 drug_id = existing_drug["id"]
-                current_stock = existing_drug["stock_quantity"]
             else:
                 new_drug = {
                     "name": selected_drug_name,
@@ -79,29 +98,141 @@ def run():
                     "expiry_date": expiry_date.isoformat() if expiry_date else None,
                     "supplier_id": supplier_id
                 }
-                result = supabase.table("drugs").insert(new_drug).execute()
-                drug_id = result.data[0]["id"]
-                current_stock = 0
+                drug_id = db.insert_drug(new_drug, f"{purchase_key}:drug")["id"]
+                drug_catalog.invalidate()
                 st.info(f"🆕 New drug added: {selected_drug_name}")
 
-            # 💾 Record purchase
-            purchase = {
-                "drug_id": drug_id,
-                "supplier_id": supplier_id,
-                "quantity_purchased": quantity_purchased,
-                "unit_cost": unit_cost,
-                "entered_by": user_id,
-                "created_at": datetime.now().isoformat(),
-                "date_purchased": selected_date.isoformat(),
-                "expiry_date": expiry_date.isoformat() if expiry_date else None
-            }
-            supabase.table("purchases").insert(purchase).execute()
-
-            # 📈 Update stock
-            new_stock = current_stock + quantity_purchased
-            supabase.table("drugs").update({"stock_quantity": new_stock}).eq("id", drug_id).execute()
+            # 📮 Journal the purchase; the sync worker inserts it and increments stock in one transaction
+            created = journal.submit(purchase_key, "purchases", {
+                "items": [{
+                    "drug_id": drug_id,
+                    "supplier_id": supplier_id,
+                    "quantity_purchased": quantity_purchased,
+                    "unit_cost": unit_cost,
+                    "date_purchased": selected_date.isoformat(),
+                    "expiry_date": expiry_date.isoformat() if expiry_date else None,
+                }],
+                "entered_by": user["id"],
+            }, user.get("email"))
 
             total_cost = quantity_purchased * unit_cost
-            st.success(f"✅ Purchase recorded. Stock updated to {new_stock} units. Total cost: UGX {total_cost:,.0f}")
+            if acknowledge(journal.wait(purchase_key), "Purchase",
+                           lambda result: f"✅ Purchase recorded. Stock updated to {result[0]['stock_quantity']} units. "
+                                          f"Total cost: UGX {total_cost:,.0f}",
+                           duplicate=not created) and created:
+                audit.log("record_purchase", user.get("email"),
+                          f"Bought {quantity_purchased} x {selected_drug_name} from {selected_supplier_name} "
+                          f"at UGX {unit_cost:,} on {selected_date}")
         except Exception as e:
             st.error(f"❌ Failed to record purchase: {e}")
+
+# 🔗 Resolve invoice names to ids, creating missing suppliers and drugs in two batches
+def resolve_invoice(valid, drug_data, supplier_data, import_key):
+    rows = valid.assign(drug_key=valid["drug_name"].str.lower(), supplier_key=valid["supplier_name"].str.lower())
+
+    supplier_index = {s["name"].lower(): s["id"] for s in supplier_data}
+    new_suppliers = rows.loc[~rows["supplier_key"].isin(supplier_index)].drop_duplicates("supplier_key")
+    for supplier in db.insert_suppliers([{"name": name} for name in new_suppliers["supplier_name"]],
+                                        f"{import_key}:suppliers"):
+        supplier_index[supplier["name"].lower()] = supplier["id"]
+    if len(new_suppliers):
+        supplier_catalog.invalidate()
+    rows["supplier_id"] = rows["supplier_key"].map(supplier_index)
+
+    drug_index = {d["name"].lower(): d["id"] for d in drug_data}
+    new_drugs = rows.loc[~rows["drug_key"].isin(drug_index)].drop_duplicates("drug_key")
+    created = db.insert_drugs([{
+        "name": row.drug_name,
+        "category": "Other",
+        "description": "Auto-added during invoice import",
+        "price": row.unit_cost,
+        "stock_quantity": 0,
+        "expiry_date": row.expiry_date.isoformat() if pd.notna(row.expiry_date) else None,
+        "supplier_id": row.supplier_id,
+    } for row in new_drugs.itertuples()], f"{import_key}:drugs")
+    for drug in created:
+        drug_index[drug["name"].lower()] = drug["id"]
+    if created:
+        drug_catalog.invalidate()
+    rows["drug_id"] = rows["drug_key"].map(drug_index)
+
+    return rows, len(new_suppliers), len(created)
+
+# 📑 A whole supplier invoice from a CSV or Excel file
+def invoice_import(user, drug_data, supplier_data):
+    st.markdown(f"Upload a CSV or Excel invoice with columns **{', '.join(INVOICE_REQUIRED)}** "
+                f"and optionally *{', '.join(INVOICE_OPTIONAL)}*.")
+    default_date = st.date_input("🗓️ Purchase Date (for rows without one)", value=date.today())
+    upload = st.file_uploader("📑 Invoice File", type=["csv", "xlsx", "xls"])
+    if upload is None:
+        return
+
+    try:
+        raw = pd.read_csv(upload) if upload.name.lower().endswith(".csv") else pd.read_excel(upload)
+    except ImportError:
+        st.error("❌ Reading Excel files needs the `openpyxl` package. Install it or upload a CSV.")
+        return
+    except Exception as e:
+        st.error(f"❌ Could not read the invoice: {e}")
+        return
+
+    try:
+        valid, errors = validate_invoice(raw, default_date)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return
+
+    st.write(f"✅ {len(valid)} valid line(s), ❌ {len(errors)} rejected line(s). "
+             f"Invoice total: UGX {(valid['quantity'] * valid['unit_cost']).sum():,.0f}")
+    if len(errors):
+        st.dataframe(errors, hide_index=True)
+    st.dataframe(valid, hide_index=True)
+
+    submitted = len(valid) > 0 and st.button(f"📦 Import {len(valid)} Line(s)")
+    import_key = request_key("invoice_import", submitted)
+    if submitted:
+        try:
+            rows, new_suppliers, new_drugs = resolve_invoice(valid, drug_data, supplier_data, import_key)
+            items = [{
+                "drug_id": row.drug_id,
+                "supplier_id": row.supplier_id,
+                "quantity_purchased": row.quantity,
+                "unit_cost": row.unit_cost,
+                "date_purchased": row.date_purchased.isoformat(),
+                "expiry_date": row.expiry_date.isoformat() if pd.notna(row.expiry_date) else None,
+            } for row in rows.itertuples()]
+
+            # 📮 Journal the invoice; the sync worker records every line and stock increment in one transaction
+            created = journal.submit(import_key, "purchases", {"items": items, "entered_by": user["id"]},
+                                     user.get("email"))
+            if acknowledge(journal.wait(import_key), "Invoice",
+                           lambda result: f"✅ Imported {len(items)} purchase line(s). "
+                                          f"New suppliers: {new_suppliers}. New drugs: {new_drugs}.",
+                           duplicate=not created) and created:
+                audit.log("import_invoice", user.get("email"),
+                          f"Imported {len(items)} purchase line(s) from {upload.name}, "
+                          f"UGX {(rows['quantity'] * rows['unit_cost']).sum():,.0f}; "
+                          f"{new_suppliers} new supplier(s), {new_drugs} new drug(s)")
+        except Exception as e:
+            st.error(f"❌ Failed to import invoice: {e}")
+
+def run():
+    st.title("📥 Record Drug Purchase")
+
+    # 🔒 Enforce access control
+    user = require_role(["procurement", "admin"])
+    if not user:
+        st.stop()
+
+    # 📦 Drugs and suppliers come from the shared catalog caches (loaded together when stale)
+    drug_data, supplier_data = db.gather(drug_catalog.rows, supplier_catalog.rows)
+
+    sync_status("purchases")
+
+    mode = st.radio("Mode", ["Single Purchase", "Invoice Import", "Reorder Suggestions"], horizontal=True)
+    if mode == "Reorder Suggestions":
+        reorder_suggestions(drug_data, supplier_data)
+    elif mode == "Invoice Import":
+        invoice_import(user, drug_data, supplier_data)
+    else:
+        single_purchase(user)
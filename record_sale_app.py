@@ -1,14 +1,14 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
 import streamlit as st
-from datetime import datetime
+import pandas as pd
+from datetime import date, datetime
 
-# 🔐 Load environment variables and initialize Supabase
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from modules.catalog import drug_catalog
+from modules.expiry_index import expiry_index
+from modules.write_journal import journal
+from components.request_key import request_key
+from components.search_select import search_select
+from components.sync_status import acknowledge, sync_status
+from utils.logger import audit
 
 # 🔐 Role check helper
 def require_role(allowed_roles):
@@ -21,26 +21,28 @@ def require_role(allowed_roles):
         return None
     return user
 
-def run():
-    st.title("💰 Record Drug Sale")
-
-    # 🔒 Enforce access control
-    user = require_role(["cashier", "pharmacist", "admin"])
-    if not user:
-        st.stop()
+# 📦 Which lot the next units come from (sales take the earliest expiry first)
+def next_lot_hint(drug_id):
+    try:
+        lots = expiry_index().lots_for(drug_id)
+    except Exception:
+        return
+    today = date.today().isoformat()
+    expired = sum(lot["quantity_remaining"] for lot in lots if lot["expiry_date"] and lot["expiry_date"] < today)
+    sellable = [lot for lot in lots if not lot["expiry_date"] or lot["expiry_date"] >= today]
+    if sellable and sellable[0]["expiry_date"]:
+        st.caption(f"📦 Dispense from the lot expiring {sellable[0]['expiry_date']} "
+                   f"({sellable[0]['quantity_remaining']} unit(s) left in it).")
+    if expired:
+        st.warning(f"⚠️ {expired} unit(s) on the shelf are past expiry and cannot be sold.")
 
-    user_id = user.get("id")
+# 🧾 One drug per sale
+def single_sale(user):
+    selected_drug, selected_drug_name = search_select("🧪 Search Drug", drug_catalog, key="sale_drug")
+    if not selected_drug:
+        return
 
-    # 📦 Fetch available drugs
-    drug_data = supabase.table("drugs").select("id", "name", "price", "stock_quantity").execute().data
-    if not drug_data:
-        st.warning("⚠️ No drugs available. Please add drugs first.")
-        st.stop()
-
-    # 🧪 Drug selection
-    drug_options = {drug["name"]: drug for drug in drug_data}
-    selected_drug_name = st.selectbox("🧪 Select Drug", list(drug_options.keys()))
-    selected_drug = drug_options[selected_drug_name]
+    next_lot_hint(selected_drug["id"])
 
     # 📊 Quantity input
     quantity_sold = st.number_input("📦 Quantity Sold", min_value=1, max_value=selected_drug["stock_quantity"])
@@ -48,23 +50,112 @@ def run():
     st.write(f"💵 Total Price: UGX {total_price:,}")
 
     # ✅ Confirm sale
-    if st.button("🧾 Record Sale"):
+    submitted = st.button("🧾 Record Sale")
+    sale_key = request_key("single_sale", submitted)
+    if submitted:
+        try:
+            # 📮 Journal the sale on this till; the sync worker inserts it and decrements stock in one transaction,
+            # refusing it if the drug no longer has the units (so stale figures on screen cannot oversell)
+            created = journal.submit(sale_key, "sales", {
+                "items": [{"drug_id": selected_drug["id"], "quantity_sold": quantity_sold}],
+                "sold_by": user["id"],
+                "date_sold": datetime.now().isoformat(),
+            }, user.get("email"))
+            # 📦 The catalog's stock is updated by the sync worker from the balance the database returns
+
+            if acknowledge(journal.wait(sale_key), "Sale",
+                           lambda result: f"✅ Sale recorded successfully. Stock updated to {result[0]['stock_quantity']} units.",
+                           duplicate=not created) and created:
+                audit.log("record_sale", user.get("email"),
+                          f"Sold {quantity_sold} x {selected_drug_name} for UGX {total_price:,.0f}")
+        except Exception as e:
+            st.error("❌ Failed to record sale.")
+            st.exception(e)
+
+# 🛒 Several drugs per customer, committed together
+def basket_sale(user):
+    basket = st.session_state.setdefault("sale_basket", {})
+
+    selected_drug, selected_drug_name = search_select("🧪 Search Drug", drug_catalog, key="basket_drug")
+    if selected_drug:
+        in_basket = basket.get(selected_drug["id"], {}).get("quantity", 0)
+        available = selected_drug["stock_quantity"] - in_basket
+
+        if available < 1:
+            st.info(f"All {selected_drug['stock_quantity']} units of {selected_drug_name} are already in the basket.")
+        else:
+            quantity = st.number_input("📦 Quantity", min_value=1, max_value=available)
+            if st.button("➕ Add to Basket"):
+                basket[selected_drug["id"]] = {
+                    "drug_id": selected_drug["id"],
+                    "name": selected_drug_name,
+                    "quantity": in_basket + quantity,
+                    "price": selected_drug["price"],
+                }
+                st.rerun()
+
+    if not basket:
+        st.info("🛒 Basket is empty.")
+        return
+
+    # 📋 Running totals
+    lines = pd.DataFrame(basket.values())
+    lines["Line Total (UGX)"] = lines["quantity"] * lines["price"]
+    st.dataframe(lines[["name", "quantity", "price", "Line Total (UGX)"]].rename(columns={
+        "name": "Drug", "quantity": "Quantity", "price": "Unit Price (UGX)"
+    }), hide_index=True)
+    st.write(f"💵 Basket Total: UGX {lines['Line Total (UGX)'].sum():,}")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        checkout = st.button("🧾 Checkout")
+        basket_key = request_key("basket_sale", checkout)
+    with col2:
+        if st.button("🗑️ Clear Basket"):
+            basket.clear()
+            st.rerun()
+
+    if checkout:
         try:
-            # 🧾 Insert into sales table
-            sale = {
-                "drug_id": selected_drug["id"],
-                "quantity_sold": quantity_sold,
-                "total_price": total_price,
-                "sold_by": user_id,
-                "date_sold": datetime.now().isoformat()
-            }
-            supabase.table("sales").insert(sale).execute()
-
-            # 📉 Update stock
-            new_stock = selected_drug["stock_quantity"] - quantity_sold
-            supabase.table("drugs").update({"stock_quantity": new_stock}).eq("id", selected_drug["id"]).execute()
-
-            st.success(f"✅ Sale recorded successfully. Stock updated to {new_stock} units.")
+            # 📮 Journal the basket; the sync worker records all lines and stock decrements in one transaction
+            created = journal.submit(basket_key, "sales", {
+                "items": [{"drug_id": line["drug_id"], "quantity_sold": line["quantity"]} for line in basket.values()],
+                "sold_by": user["id"],
+                "date_sold": datetime.now().isoformat(),
+            }, user.get("email"))
+
+            total = float(lines["Line Total (UGX)"].sum())
+            if acknowledge(journal.wait(basket_key), "Basket",
+                           lambda result: f"✅ Basket recorded: {len(result)} drug(s). "
+                                          f"Total: UGX {sum(row['total_price'] for row in result):,.0f}",
+                           duplicate=not created):
+                if created:
+                    audit.log("record_sales", user.get("email"),
+                              "Sold " + ", ".join(f"{line['quantity']} x {line['name']}" for line in basket.values())
+                              + f" for UGX {total:,.0f}")
+                basket.clear()
         except Exception as e:
             st.error("❌ Failed to record sale.")
             st.exception(e)
+
+def run():
+    st.title("💰 Record Drug Sale")
+
+    # 🔒 Enforce access control
+    user = require_role(["cashier", "pharmacist", "admin"])
+    if not user:
+        st.stop()
+
+    # 📦 Available drugs come from the shared catalog cache
+    drug_data = drug_catalog.rows()
+    if not drug_data:
+        st.warning("⚠️ No drugs available. Please add drugs first.")
+        st.stop()
+
+    sync_status("sales")
+
+    mode = st.radio("Mode", ["Single Sale", "Basket"], horizontal=True)
+    if mode == "Basket":
+        basket_sale(user)
+    else:
+        single_sale(user)
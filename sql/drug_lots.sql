@@ -0,0 +1,130 @@
+-- 📦 Lot-level stock. Every delivery (purchase row) becomes a lot with its
+-- own expiry date; sales take units from lots first-expiry-first-out and
+-- record which lots they used in sale_allocations. drugs.stock_quantity
+-- stays the sum of its lots' quantity_remaining: when stock is set directly
+-- (a new drug, a grid edit, a stock count) a trigger adds an adjustment lot
+-- or writes units off, oldest expiry first. Load this before
+-- stock_transactions.sql, whose functions fill and drain the lots.
+
+-- Column types follow the existing id columns, whatever they are
+do $$
+declare
+    v_drug_id text := (select format_type(a.atttypid, a.atttypmod) from pg_attribute a
+                       where a.attrelid = 'drugs'::regclass and a.attname = 'id');
+    v_purchase_id text := (select format_type(a.atttypid, a.atttypmod) from pg_attribute a
+                           where a.attrelid = 'purchases'::regclass and a.attname = 'id');
+    v_sale_id text := (select format_type(a.atttypid, a.atttypmod) from pg_attribute a
+                       where a.attrelid = 'sales'::regclass and a.attname = 'id');
+begin
+    execute format($ddl$
+        create table if not exists drug_lots (
+            id                 bigint generated always as identity primary key,
+            drug_id            %1$s not null references drugs (id) on delete cascade,
+            purchase_id        %2$s references purchases (id) on delete set null,
+            expiry_date        date,
+            quantity_received  integer not null,
+            quantity_remaining integer not null check (quantity_remaining >= 0),
+            unit_cost          numeric,
+            received_at        timestamptz not null default now()
+        )
+    $ddl$, v_drug_id, v_purchase_id);
+
+    execute format($ddl$
+        create table if not exists sale_allocations (
+            sale_id  %1$s not null references sales (id) on delete cascade,
+            lot_id   bigint not null references drug_lots (id),
+            quantity integer not null,
+            primary key (sale_id, lot_id)
+        )
+    $ddl$, v_sale_id);
+end;
+$$;
+
+-- Lots with stock, in the order they are sold from
+create index if not exists drug_lots_fefo on drug_lots (drug_id, expiry_date, id) where quantity_remaining > 0;
+-- Lots with stock by expiry, for "what expires soon"
+create index if not exists drug_lots_expiry on drug_lots (expiry_date) where quantity_remaining > 0;
+
+-- 🔻 Take p_quantity units of a drug from its lots, earliest expiry first and
+-- lots without an expiry date last. Sales (p_sale_id set) skip expired lots
+-- and record what they took; write-offs take expired units first. Raises
+-- RC001 if the lots run short. Callers lock the drug row first.
+create or replace function consume_lots(
+    p_drug_id drugs.id%type,
+    p_quantity integer,
+    p_sale_id sales.id%type default null
+)
+returns void
+language plpgsql
+as $$
+declare
+    v_lot record;
+    v_left integer := p_quantity;
+    v_take integer;
+begin
+    for v_lot in
+        select l.id, l.quantity_remaining
+        from drug_lots l
+        where l.drug_id = p_drug_id
+          and l.quantity_remaining > 0
+          and (p_sale_id is null or l.expiry_date is null or l.expiry_date >= current_date)
+        order by l.expiry_date nulls last, l.id
+        for update
+    loop
+        exit when v_left = 0;
+        v_take := least(v_left, v_lot.quantity_remaining);
+
+        update drug_lots set quantity_remaining = quantity_remaining - v_take where id = v_lot.id;
+        if p_sale_id is not null then
+            insert into sale_allocations (sale_id, lot_id, quantity) values (p_sale_id, v_lot.id, v_take);
+        end if;
+        v_left := v_left - v_take;
+    end loop;
+
+    if v_left > 0 then
+        raise exception 'Insufficient unexpired stock for drug %', p_drug_id using errcode = 'RC001';
+    end if;
+end;
+$$;
+
+-- 🔁 Keep a drug's lots summing to its stock_quantity
+create or replace function sync_drug_lots()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_diff integer;
+begin
+    select new.stock_quantity - coalesce(sum(l.quantity_remaining), 0) into v_diff
+    from drug_lots l
+    where l.drug_id = new.id;
+
+    if v_diff > 0 then
+        insert into drug_lots (drug_id, expiry_date, quantity_received, quantity_remaining, unit_cost)
+        values (new.id, new.expiry_date, v_diff, v_diff, null);
+    elsif v_diff < 0 then
+        perform consume_lots(new.id, -v_diff);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists drugs_sync_lots on drugs;
+create trigger drugs_sync_lots
+after insert or update of stock_quantity on drugs
+for each row execute function sync_drug_lots();
+
+-- 🗃️ First run only: one lot per past delivery. Today's stock is credited
+-- to the latest-expiring deliveries (FEFO would have sold the others); the
+-- trigger then turns any stock no delivery explains into an opening lot.
+insert into drug_lots (drug_id, purchase_id, expiry_date, quantity_received, quantity_remaining, unit_cost, received_at)
+select p.drug_id, p.id, p.expiry_date, p.quantity_purchased,
+       greatest(0, least(p.quantity_purchased,
+                         d.stock_quantity - (sum(p.quantity_purchased) over newest_first - p.quantity_purchased))),
+       p.unit_cost, p.created_at
+from purchases p
+join drugs d on d.id = p.drug_id
+where not exists (select 1 from drug_lots)
+window newest_first as (partition by p.drug_id order by p.expiry_date desc nulls first, p.id desc);
+
+update drugs set stock_quantity = stock_quantity;
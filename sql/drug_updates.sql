@@ -0,0 +1,68 @@
+-- ✏️ Bulk edits from the inventory grid as one transactional call.
+-- p_rows holds each edited drug's id and the columns that were changed,
+-- and p_originals the same columns as the editor loaded them (both JSON
+-- arrays). If any of those values changed, or the drug disappeared, in the
+-- meantime nothing is written and the call fails with SQLSTATE RC002, so
+-- two editors never overwrite each other. Columns that were not edited are
+-- neither checked nor written: a sale does not block a price change.
+-- p_request_key identifies the save: a retry of a save that already went
+-- through returns the rows it wrote instead of failing the check against
+-- its own changes. Needs sql/idempotency.sql.
+drop function if exists update_drugs(jsonb, jsonb);
+
+create or replace function update_drugs(p_rows jsonb, p_originals jsonb, p_request_key text)
+returns setof drugs
+language plpgsql
+as $$
+declare
+    v_conflicts text;
+    v_result jsonb;
+begin
+    select a.result into v_result from applied_requests a where a.request_key = p_request_key;
+    if found then
+        return query select * from jsonb_populate_recordset(null::drugs, v_result);
+        return;
+    end if;
+
+    -- Lock in id order so two overlapping saves cannot deadlock
+    perform 1
+    from drugs d
+    where d.id in (select o.id from jsonb_populate_recordset(null::drugs, p_originals) o)
+    order by d.id
+    for update;
+
+    -- Only the columns each original carries are compared
+    select string_agg(o.id::text, ', ' order by o.id) into v_conflicts
+    from jsonb_array_elements(p_originals) e
+    cross join lateral jsonb_populate_record(null::drugs, e) o
+    left join drugs d on d.id = o.id
+    where d.id is null or d is distinct from jsonb_populate_record(d, e);
+
+    if v_conflicts is not null then
+        raise exception 'Drugs changed since they were loaded: %', v_conflicts using errcode = 'RC002';
+    end if;
+
+    -- Columns a row leaves out keep their current value; stock is set in its
+    -- own statement so the ledger and lot triggers only see rows whose stock was edited
+    update drugs d
+    set (name, category, description, price, expiry_date, supplier_id) =
+        (select r.name, r.category, r.description, r.price, r.expiry_date, r.supplier_id
+         from jsonb_populate_record(d, e) r)
+    from jsonb_array_elements(p_rows) e
+    where d.id = (jsonb_populate_record(null::drugs, e)).id
+      and e - 'id' - 'stock_quantity' <> '{}'::jsonb;
+
+    update drugs d
+    set stock_quantity = (jsonb_populate_record(d, e)).stock_quantity
+    from jsonb_array_elements(p_rows) e
+    where d.id = (jsonb_populate_record(null::drugs, e)).id
+      and e ? 'stock_quantity';
+
+    select coalesce(jsonb_agg(to_jsonb(d) order by d.id), '[]') into v_result
+    from drugs d
+    where d.id in (select r.id from jsonb_populate_recordset(null::drugs, p_rows) r);
+
+    insert into applied_requests (request_key, result) values (p_request_key, v_result);
+    return query select * from jsonb_populate_recordset(null::drugs, v_result);
+end;
+$$;
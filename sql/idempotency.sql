@@ -0,0 +1,16 @@
+-- 🔑 Idempotency keys for every write the app makes. Run this file first.
+-- Inserted rows carry the client-generated request_key of the submission
+-- that created them; the unique constraint turns a retried insert into an
+-- upsert of the same row instead of a duplicate. Writes made through
+-- functions remember their key and result in applied_requests.
+
+alter table drugs add column if not exists request_key text unique;
+alter table suppliers add column if not exists request_key text unique;
+alter table users add column if not exists request_key text unique;
+alter table audit_logs add column if not exists request_key text unique;
+
+create table if not exists applied_requests (
+    request_key text primary key,
+    result      jsonb,
+    applied_at  timestamptz not null default now()
+);
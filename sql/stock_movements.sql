@@ -0,0 +1,266 @@
+-- 📒 Append-only stock ledger. Every change to drugs.stock_quantity
+-- appends one stock_movements row with the change, the balance it left and
+-- why: 'opening', 'sale', 'purchase', 'adjustment' (direct edits),
+-- 'write_off' or the reason passed to set_stock_levels(). The functions
+-- that move stock name the reason (and a reference such as the sale id) in
+-- the transaction-local settings app.stock_reason / app.stock_reference;
+-- anything else is an adjustment.
+-- drugs.stock_quantity stays the materialized balance that sales check
+-- and lock. Nightly snapshots bound the rows a point-in-time query reads:
+--   select cron.schedule('stock-snapshot', '5 0 * * *', 'select take_stock_snapshot()');
+-- Load after drug_lots.sql and before stock_transactions.sql.
+
+do $$
+declare
+    v_drug_id text := (select format_type(a.atttypid, a.atttypmod) from pg_attribute a
+                       where a.attrelid = 'drugs'::regclass and a.attname = 'id');
+begin
+    execute format($ddl$
+        create table if not exists stock_movements (
+            id            bigint generated always as identity primary key,
+            drug_id       %1$s not null references drugs (id) on delete cascade,
+            change        integer not null,
+            balance_after integer not null,
+            reason        text not null,
+            reference     text,
+            created_at    timestamptz not null default now()
+        )
+    $ddl$, v_drug_id);
+
+    execute format($ddl$
+        create table if not exists stock_snapshots (
+            taken_at timestamptz not null,
+            drug_id  %1$s not null references drugs (id) on delete cascade,
+            quantity integer not null,
+            primary key (taken_at, drug_id)
+        )
+    $ddl$, v_drug_id);
+end;
+$$;
+
+create index if not exists stock_movements_drug_time on stock_movements (drug_id, created_at, id);
+create index if not exists stock_movements_time on stock_movements (created_at);
+
+-- 🚫 Rows are never changed once written; they only go with their drug
+-- (a cascaded delete runs inside the foreign key's own trigger)
+create or replace function stock_movements_append_only()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'UPDATE' or pg_trigger_depth() <= 1 then
+        raise exception 'stock_movements is append-only';
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists stock_movements_append_only on stock_movements;
+create trigger stock_movements_append_only
+before update or delete on stock_movements
+for each statement execute function stock_movements_append_only();
+
+create or replace function log_stock_movement()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_change integer := new.stock_quantity - coalesce(old.stock_quantity, 0);
+begin
+    if v_change <> 0 then
+        insert into stock_movements (drug_id, change, balance_after, reason, reference)
+        values (new.id, v_change, new.stock_quantity,
+                case when tg_op = 'INSERT' then 'opening'
+                     else coalesce(nullif(current_setting('app.stock_reason', true), ''), 'adjustment') end,
+                nullif(current_setting('app.stock_reference', true), ''));
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists drugs_log_movement on drugs;
+create trigger drugs_log_movement
+after insert or update of stock_quantity on drugs
+for each row execute function log_stock_movement();
+
+-- 🕰️ Every drug's stock at p_at: the latest snapshot at or before it, then
+-- the last balance each drug's movements since that snapshot left
+create or replace function stock_on(p_at timestamptz)
+returns table (drug_id drugs.id%type, quantity integer)
+language sql
+stable
+as $$
+    with base as (
+        select max(s.taken_at) as taken_at from stock_snapshots s where s.taken_at <= p_at
+    ),
+    snapshot as (
+        select s.drug_id, s.quantity
+        from stock_snapshots s
+        join base on s.taken_at = base.taken_at
+    ),
+    moved as (
+        select distinct on (m.drug_id) m.drug_id, m.balance_after
+        from stock_movements m, base
+        where m.created_at <= p_at
+          and (base.taken_at is null or m.created_at > base.taken_at)
+        order by m.drug_id, m.created_at desc, m.id desc
+    )
+    select coalesce(moved.drug_id, snapshot.drug_id), coalesce(moved.balance_after, snapshot.quantity)
+    from snapshot
+    full join moved on moved.drug_id = snapshot.drug_id;
+$$;
+
+-- 📦 The units each drug started with, one opening movement per row in id
+-- order after p_after: the opening balance less what purchases before it
+-- brought in and plus what sales before it took out, so stock bought
+-- before the ledger began is not counted twice by FIFO costing
+create or replace function opening_stock(p_after bigint default null, p_limit integer default 1000)
+returns table (id bigint, drug_id drugs.id%type, quantity integer)
+language sql
+stable
+as $$
+    select m.id, m.drug_id,
+           greatest(m.change
+                    - coalesce((select sum(p.quantity_purchased) from purchases p
+                                where p.drug_id = m.drug_id and p.created_at < m.created_at), 0)
+                    + coalesce((select sum(s.quantity_sold) from sales s
+                                where s.drug_id = m.drug_id and s.date_sold < m.created_at), 0),
+                    0)::integer
+    from stock_movements m
+    where m.reason = 'opening' and (p_after is null or m.id > p_after)
+    order by m.id
+    limit p_limit;
+$$;
+
+-- 📸 Checkpoint every drug's balance at p_at (default: the last midnight)
+create or replace function take_stock_snapshot(p_at timestamptz default date_trunc('day', now()))
+returns integer
+language sql
+as $$
+    with taken as (
+        insert into stock_snapshots (taken_at, drug_id, quantity)
+        select p_at, s.drug_id, s.quantity from stock_on(p_at) s
+        on conflict do nothing
+        returning 1
+    )
+    select count(*)::integer from taken;
+$$;
+
+-- 🗑️ Write off every unit in an expired lot, recorded as 'write_off'
+create or replace function write_off_expired()
+returns table (drug_id drugs.id%type, quantity integer)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_drug_id drugs.id%type;
+    v_quantity integer;
+begin
+    perform set_config('app.stock_reason', 'write_off', true);
+    for v_drug_id in
+        select distinct l.drug_id
+        from drug_lots l
+        where l.quantity_remaining > 0 and l.expiry_date < current_date
+        order by l.drug_id
+    loop
+        perform 1 from drugs d where d.id = v_drug_id for update;
+
+        with expired as (
+            select l.id, l.quantity_remaining
+            from drug_lots l
+            where l.drug_id = v_drug_id and l.quantity_remaining > 0 and l.expiry_date < current_date
+            for update
+        ),
+        cleared as (
+            update drug_lots l set quantity_remaining = 0
+            from expired
+            where l.id = expired.id
+        )
+        select coalesce(sum(expired.quantity_remaining), 0)::integer into v_quantity from expired;
+
+        if v_quantity > 0 then
+            update drugs d set stock_quantity = d.stock_quantity - v_quantity where d.id = v_drug_id;
+            drug_id := v_drug_id;
+            quantity := v_quantity;
+            return next;
+        end if;
+    end loop;
+    perform set_config('app.stock_reason', '', true);
+end;
+$$;
+
+-- 🧮 Set several drugs' stock in one transaction, recorded under p_reason
+-- (e.g. 'reconciliation') with p_request_key as each movement's reference.
+-- p_rows is a JSON array of {"id", "stock_quantity", "was"}: if any drug's
+-- stock is no longer "was" nothing is written and the call fails with
+-- SQLSTATE RC002. p_audit holds the audit_logs rows describing the change,
+-- written in the same transaction. A retried call returns the rows it wrote
+-- the first time without writing the audit rows again.
+-- Needs sql/idempotency.sql.
+drop function if exists set_stock_levels(jsonb, text, text);
+
+create or replace function set_stock_levels(p_rows jsonb, p_reason text, p_audit jsonb, p_request_key text)
+returns setof drugs
+language plpgsql
+as $$
+declare
+    v_conflicts text;
+    v_result jsonb;
+begin
+    select a.result into v_result from applied_requests a where a.request_key = p_request_key;
+    if found then
+        return query select * from jsonb_populate_recordset(null::drugs, v_result);
+        return;
+    end if;
+
+    if exists (select 1 from jsonb_array_elements(p_rows) e
+               where (e ->> 'stock_quantity') is null or (e ->> 'stock_quantity')::integer < 0) then
+        raise exception 'Stock levels must be zero or more';
+    end if;
+
+    -- Lock in id order so two overlapping calls cannot deadlock
+    perform 1
+    from drugs d
+    where d.id in (select r.id from jsonb_populate_recordset(null::drugs, p_rows) r)
+    order by d.id
+    for update;
+
+    select string_agg(w.id::text, ', ' order by w.id) into v_conflicts
+    from (
+        select (jsonb_populate_record(null::drugs, e)).id, (e ->> 'was')::integer as was
+        from jsonb_array_elements(p_rows) e
+    ) w
+    left join drugs d on d.id = w.id
+    where d.id is null or d.stock_quantity is distinct from w.was;
+
+    if v_conflicts is not null then
+        raise exception 'Stock changed since it was read: %', v_conflicts using errcode = 'RC002';
+    end if;
+
+    perform set_config('app.stock_reason', p_reason, true);
+    perform set_config('app.stock_reference', p_request_key, true);
+    with updated as (
+        update drugs d
+        set stock_quantity = r.stock_quantity
+        from jsonb_populate_recordset(null::drugs, p_rows) r
+        where d.id = r.id
+        returning d.*
+    )
+    select coalesce(jsonb_agg(to_jsonb(updated)), '[]') into v_result from updated;
+    perform set_config('app.stock_reason', '', true);
+    perform set_config('app.stock_reference', '', true);
+
+    insert into audit_logs (action, performed_by, details, "timestamp")
+    select a.action, a.performed_by, a.details, a."timestamp"
+    from jsonb_populate_recordset(null::audit_logs, p_audit) a;
+
+    insert into applied_requests (request_key, result) values (p_request_key, v_result);
+    return query select * from jsonb_populate_recordset(null::drugs, v_result);
+end;
+$$;
+
+-- 🗃️ First run only: today's stock becomes each drug's opening movement
+insert into stock_movements (drug_id, change, balance_after, reason)
+select d.id, d.stock_quantity, d.stock_quantity, 'opening'
+from drugs d
+where not exists (select 1 from stock_movements);
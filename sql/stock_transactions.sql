@@ -0,0 +1,115 @@
+-- 🧾 Sales and purchases as single transactional calls.
+-- The stock change happens in the same statement that checks it, so two
+-- cashiers selling the same drug can never both spend the last units.
+-- Errors with SQLSTATE RC001 mean "not enough stock".
+-- Sales take units from drug_lots earliest expiry first and purchases add a
+-- lot; each stock change names its reason for the stock_movements ledger.
+-- Load drug_lots.sql and stock_movements.sql before this file.
+
+-- 🗑️ The single-line versions; every caller sends a request-keyed batch now
+drop function if exists record_sale;
+drop function if exists record_purchase;
+
+-- 🛒 A whole basket in one call: p_items is a JSON array of
+-- {"drug_id": ..., "quantity_sold": ...}. Either every line is recorded or,
+-- if any drug is short, none is. Lines are locked in drug id order so two
+-- baskets touching the same drugs cannot deadlock.
+create or replace function record_sales(
+    p_items jsonb,
+    p_sold_by users.id%type,
+    p_date_sold sales.date_sold%type default now()
+)
+returns table (drug_id drugs.id%type, stock_quantity integer, total_price numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_item record;
+    v_stock integer;
+    v_price numeric;
+    v_sale_id sales.id%type;
+begin
+    for v_item in
+        select s.drug_id, sum(s.quantity_sold)::integer as quantity
+        from jsonb_populate_recordset(null::sales, p_items) s
+        group by s.drug_id
+        order by s.drug_id
+    loop
+        select d.stock_quantity, d.price into v_stock, v_price
+        from drugs d
+        where d.id = v_item.drug_id
+        for update;
+
+        if not found or v_stock < v_item.quantity then
+            raise exception 'Insufficient stock for drug %', v_item.drug_id using errcode = 'RC001';
+        end if;
+
+        insert into sales (drug_id, quantity_sold, total_price, sold_by, date_sold)
+        values (v_item.drug_id, v_item.quantity, v_item.quantity * v_price, p_sold_by, p_date_sold)
+        returning id into v_sale_id;
+
+        perform consume_lots(v_item.drug_id, v_item.quantity, v_sale_id);
+
+        perform set_config('app.stock_reason', 'sale', true);
+        perform set_config('app.stock_reference', v_sale_id::text, true);
+        update drugs d
+        set stock_quantity = d.stock_quantity - v_item.quantity
+        where d.id = v_item.drug_id
+        returning d.stock_quantity into v_stock;
+
+        drug_id := v_item.drug_id;
+        stock_quantity := v_stock;
+        total_price := v_item.quantity * v_price;
+        return next;
+    end loop;
+    perform set_config('app.stock_reason', '', true);
+    perform set_config('app.stock_reference', '', true);
+end;
+$$;
+
+-- 📦 A whole supplier invoice in one call: p_items is a JSON array of
+-- {"drug_id", "supplier_id", "quantity_purchased", "unit_cost",
+--  "date_purchased", "expiry_date"}. All purchase rows are inserted and each
+-- drug's stock is raised once by its summed quantity. Each line becomes a lot.
+create or replace function record_purchases(
+    p_items jsonb,
+    p_entered_by users.id%type
+)
+returns table (drug_id drugs.id%type, stock_quantity integer)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+    perform set_config('app.stock_reason', 'purchase', true);
+    with inserted as (
+        insert into purchases (drug_id, supplier_id, quantity_purchased, unit_cost,
+                               entered_by, created_at, date_purchased, expiry_date)
+        select i.drug_id, i.supplier_id, i.quantity_purchased, i.unit_cost,
+               p_entered_by, now(), i.date_purchased, i.expiry_date
+        from jsonb_populate_recordset(null::purchases, p_items) i
+        returning purchases.id, purchases.drug_id, purchases.quantity_purchased,
+                  purchases.unit_cost, purchases.expiry_date
+    ),
+    lots as (
+        insert into drug_lots (drug_id, purchase_id, expiry_date, quantity_received, quantity_remaining, unit_cost)
+        select inserted.drug_id, inserted.id, inserted.expiry_date, inserted.quantity_purchased,
+               inserted.quantity_purchased, inserted.unit_cost
+        from inserted
+    ),
+    totals as (
+        select inserted.drug_id, sum(inserted.quantity_purchased) as quantity
+        from inserted
+        group by inserted.drug_id
+    )
+    update drugs d
+    set stock_quantity = d.stock_quantity + totals.quantity
+    from totals
+    where d.id = totals.drug_id;
+    perform set_config('app.stock_reason', '', true);
+
+    return query
+    select d.id, d.stock_quantity
+    from drugs d
+    where d.id in (select i.drug_id from jsonb_populate_recordset(null::purchases, p_items) i);
+end;
+$$;
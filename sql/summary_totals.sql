@@ -0,0 +1,39 @@
+-- 📊 Sales and purchase totals per day / month / year, computed in the database.
+-- Called through `rpc("summary_totals", {"bucket": ...})` so only one row per
+-- bucket crosses the wire. `since` / `until` optionally bound the window
+-- (since <= ts < until).
+drop function if exists summary_totals(text, timestamptz);
+drop function if exists summary_totals(text, timestamptz, timestamptz);
+
+create or replace function summary_totals(
+    bucket text,
+    since timestamptz default null,
+    until timestamptz default null
+)
+returns table (period date, total_sales numeric, total_purchases numeric)
+language sql
+stable
+as $$
+    with s as (
+        select date_trunc(bucket, date_sold)::date as period,
+               sum(total_price) as total
+        from sales
+        where (since is null or date_sold >= since)
+          and (until is null or date_sold < until)
+        group by 1
+    ),
+    p as (
+        select date_trunc(bucket, created_at)::date as period,
+               sum(quantity_purchased * unit_cost) as total
+        from purchases
+        where (since is null or created_at >= since)
+          and (until is null or created_at < until)
+        group by 1
+    )
+    select coalesce(s.period, p.period),
+           coalesce(s.total, 0),
+           coalesce(p.total, 0)
+    from s
+    full outer join p on s.period = p.period
+    order by 1;
+$$;
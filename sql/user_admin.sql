@@ -0,0 +1,41 @@
+-- 👥 Staged user administration changes as one transactional call.
+-- p_updates is a JSON array of {"id", "role", "verified"}, p_deleted a JSON
+-- array of {"id"} and p_audit the audit_logs rows describing both. Either
+-- every change and its audit row is written or none is. A retry with the
+-- same p_request_key is answered from applied_requests without writing the
+-- audit rows again. Needs sql/idempotency.sql.
+drop function if exists update_users(jsonb, jsonb, jsonb);
+
+create or replace function update_users(p_updates jsonb, p_deleted jsonb, p_audit jsonb, p_request_key text)
+returns integer
+language plpgsql
+as $$
+declare
+    v_updated integer;
+    v_deleted integer;
+    v_result jsonb;
+begin
+    select a.result into v_result from applied_requests a where a.request_key = p_request_key;
+    if found then
+        return v_result::integer;
+    end if;
+
+    update users u
+    set role = c.role,
+        verified = c.verified
+    from jsonb_populate_recordset(null::users, p_updates) c
+    where u.id = c.id;
+    get diagnostics v_updated = row_count;
+
+    delete from users u
+    where u.id in (select d.id from jsonb_populate_recordset(null::users, p_deleted) d);
+    get diagnostics v_deleted = row_count;
+
+    insert into audit_logs (action, performed_by, details, "timestamp")
+    select a.action, a.performed_by, a.details, a."timestamp"
+    from jsonb_populate_recordset(null::audit_logs, p_audit) a;
+
+    insert into applied_requests (request_key, result) values (p_request_key, to_jsonb(v_updated + v_deleted));
+    return v_updated + v_deleted;
+end;
+$$;
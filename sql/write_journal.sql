@@ -0,0 +1,64 @@
+-- 📮 Replay of sales and purchases journaled on the tills.
+-- Each entry carries a client-generated request key. Keys of applied
+-- entries are remembered with their result, so an entry that is sent again
+-- (say, after the response was lost) is answered from applied_requests
+-- instead of being recorded twice. Needs sql/idempotency.sql.
+
+-- p_entries is a JSON array of {"key", "kind", "payload"} where kind is
+-- "sales" (payload {"items", "sold_by", "date_sold"}, see record_sales) or
+-- "purchases" (payload {"items", "entered_by"}, see record_purchases).
+-- Entries are applied in order, each in its own subtransaction: one that
+-- fails is reported and rolled back without affecting the others.
+-- status is 'applied', 'conflict' (not enough stock, SQLSTATE RC001) or
+-- 'rejected' (any other error).
+create or replace function apply_journal(p_entries jsonb)
+returns table (request_key text, status text, result jsonb, error text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_entry jsonb;
+    v_result jsonb;
+begin
+    for v_entry in select e.value from jsonb_array_elements(p_entries) e loop
+        request_key := v_entry->>'key';
+        status := 'applied';
+        error := null;
+
+        select a.result into v_result
+        from applied_requests a
+        where a.request_key = v_entry->>'key';
+
+        if not found then
+            begin
+                if v_entry->>'kind' = 'sales' then
+                    select coalesce(jsonb_agg(to_jsonb(r)), '[]') into v_result
+                    from jsonb_populate_record(null::sales, v_entry->'payload') p,
+                         record_sales(v_entry->'payload'->'items', p.sold_by, p.date_sold) r;
+                elsif v_entry->>'kind' = 'purchases' then
+                    select coalesce(jsonb_agg(to_jsonb(r)), '[]') into v_result
+                    from jsonb_populate_record(null::purchases, v_entry->'payload') p,
+                         record_purchases(v_entry->'payload'->'items', p.entered_by) r;
+                else
+                    raise exception 'Unknown journal entry kind %', v_entry->>'kind';
+                end if;
+
+                insert into applied_requests (request_key, result)
+                values (v_entry->>'key', v_result);
+            exception
+                when sqlstate 'RC001' then
+                    status := 'conflict';
+                    error := sqlerrm;
+                    v_result := null;
+                when others then
+                    status := 'rejected';
+                    error := sqlstate || ': ' || sqlerrm;
+                    v_result := null;
+            end;
+        end if;
+
+        result := v_result;
+        return next;
+    end loop;
+end;
+$$;
@@ -1,14 +1,17 @@
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
 import streamlit as st
 import pandas as pd
 
-# 🔐 Load environment variables and initialize Supabase
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from modules.catalog import drug_catalog
+from modules.cogs import cogs, gross_margin, with_drug_details, with_period
+from modules.replica import report_source
+
+# 📅 Period label -> (rollup bucket, chart label format)
+PERIODS = {
+    "Daily": ("day", "%Y-%m-%d"),
+    "Weekly": ("week", "Week of %Y-%m-%d"),
+    "Monthly": ("month", "%Y-%m"),
+    "Yearly": ("year", "%Y"),
+}
 
 # 🔐 Role check helper
 def require_role(allowed_roles):
@@ -29,69 +32,69 @@ def run():
     if not user:
         st.stop()
 
-    # 📥 Fetch data
-    sales_data = supabase.table("sales").select("*").execute().data
-    purchase_data = supabase.table("purchases").select("*").execute().data
-
-    # 🧾 Convert to DataFrames
-    sales_df = pd.DataFrame(sales_data)
-    purchase_df = pd.DataFrame(purchase_data)
-
-    # 🗓️ Format date columns safely
-    def format_date_column(df, possible_columns):
-        for col in possible_columns:
-            if col in df.columns:
-                try:
-                    df[col] = pd.to_datetime(df[col])
-                    return col
-                except:
-                    continue
-        return None
-
-    sales_date_col = format_date_column(sales_df, ["date_sold", "created_at", "timestamp"])
-    purchase_date_col = format_date_column(purchase_df, ["created_at", "date_purchased", "timestamp"])
-
     # 📅 Time period selector
-    period = st.selectbox("Select Time Period", ["Daily", "Monthly", "Yearly"])
-
-    # 📊 Generate summaries only if date columns are found
-    if sales_date_col and purchase_date_col:
-        # 💸 Calculate total cost for purchases
-        if "unit_cost" in purchase_df.columns:
-            purchase_df["total_cost"] = purchase_df["unit_cost"] * purchase_df["quantity_purchased"]
-        else:
-            purchase_df["total_cost"] = 0
-
-        # ⏱️ Group by selected period
-        if period == "Daily":
-            sales_summary = sales_df.groupby(sales_df[sales_date_col].dt.date)["total_price"].sum().reset_index()
-            purchase_summary = purchase_df.groupby(purchase_df[purchase_date_col].dt.date)["total_cost"].sum().reset_index()
-        elif period == "Monthly":
-            sales_summary = sales_df.groupby(sales_df[sales_date_col].dt.to_period("M"))["total_price"].sum().reset_index()
-            purchase_summary = purchase_df.groupby(purchase_df[purchase_date_col].dt.to_period("M"))["total_cost"].sum().reset_index()
-        else:  # Yearly
-            sales_summary = sales_df.groupby(sales_df[sales_date_col].dt.year)["total_price"].sum().reset_index()
-            purchase_summary = purchase_df.groupby(purchase_df[purchase_date_col].dt.year)["total_cost"].sum().reset_index()
-
-        # 🧾 Rename columns for clarity
-        sales_summary.columns = ["Period", "Total Sales (UGX)"]
-        purchase_summary.columns = ["Period", "Total Purchases (UGX)"]
-
-        # 📈 Display charts
-        st.subheader("💰 Sales Summary")
-        st.bar_chart(sales_summary.set_index("Period"))
-
-        st.subheader("💸 Purchase Summary")
-        st.bar_chart(purchase_summary.set_index("Period"))
-
-        # 📊 Financial Overview
-        total_income = sales_df["total_price"].sum()
-        total_expenditure = purchase_df["total_cost"].sum()
-        net_profit = total_income - total_expenditure
-
-        st.subheader("📋 Financial Overview")
-        st.metric("Total Income (UGX)", f"{total_income:,.0f}")
-        st.metric("Total Expenditure (UGX)", f"{total_expenditure:,.0f}")
-        st.metric("Net Profit (UGX)", f"{net_profit:,.0f}")
-    else:
-        st.warning("⚠️ Could not detect valid date columns in your data.")
+    period = st.selectbox("Select Time Period", list(PERIODS))
+    bucket, label_format = PERIODS[period]
+
+    # 📥 Only rows added since the last refresh are fetched (into the local replica when enabled)
+    try:
+        source = report_source()
+        source.refresh()
+        totals = source.bucketed(bucket)
+    except Exception as e:
+        st.error(f"❌ Failed to load summary: {e}")
+        return
+
+    # 🧮 Profit is loaded on its own so a COGS failure still leaves the totals on screen
+    try:
+        cogs.refresh()
+        margins = cogs.margins()
+    except Exception as e:
+        st.warning(f"⚠️ Failed to load cost of goods sold: {e}")
+        margins = None
+
+    if not totals:
+        st.info("No sales or purchases recorded yet.")
+        return
+
+    summary_df = pd.DataFrame(totals, columns=["period", "Total Sales (UGX)", "Total Purchases (UGX)"])
+    summary_df["Period"] = [p.strftime(label_format) for p in summary_df["period"]]
+
+    # 📈 Display charts
+    st.subheader("💰 Sales Summary")
+    st.bar_chart(summary_df.set_index("Period")[["Total Sales (UGX)"]])
+
+    st.subheader("💸 Purchase Summary")
+    st.bar_chart(summary_df.set_index("Period")[["Total Purchases (UGX)"]])
+
+    # 📊 Financial Overview: profit is sales less the FIFO cost of the units sold, not less all purchases
+    total_income = summary_df["Total Sales (UGX)"].sum()
+    total_expenditure = summary_df["Total Purchases (UGX)"].sum()
+
+    st.subheader("📋 Financial Overview")
+    st.metric("Total Income (UGX)", f"{total_income:,.0f}")
+    st.metric("Total Expenditure (UGX)", f"{total_expenditure:,.0f}")
+    if margins is None:
+        return
+
+    cost_of_sales = margins["cogs"].sum()
+    gross_profit = margins["revenue"].sum() - cost_of_sales
+    margin_pct = 100 * gross_profit / margins["revenue"].sum() if margins["revenue"].sum() else 0
+    st.metric("Cost of Goods Sold (UGX)", f"{cost_of_sales:,.0f}")
+    st.metric("Gross Profit (UGX)", f"{gross_profit:,.0f}", delta=f"{margin_pct:.1f}% margin", delta_color="off")
+    if margins["estimated_units"].sum():
+        st.caption(f"ℹ️ {margins['estimated_units'].sum():,} unit(s) sold came from opening stock, stock gains "
+                   "or beyond every recorded purchase; they are costed at the drug's nearest purchase cost.")
+
+    if len(margins):
+        by_period = gross_margin(with_period(margins, bucket), "period")
+        by_period["Period"] = [p.strftime(label_format) for p in by_period["period"]]
+        st.subheader("🧮 Gross Profit")
+        st.bar_chart(by_period.set_index("Period")[["gross_profit"]].rename(columns={"gross_profit": "Gross Profit (UGX)"}))
+
+        st.subheader("🏷️ Gross Margin by Category")
+        by_category = gross_margin(with_drug_details(margins, drug_catalog.rows()), "category")
+        st.dataframe(by_category.rename(columns={
+            "category": "Category", "units": "Units Sold", "revenue": "Sales (UGX)", "cogs": "Cost of Sales (UGX)",
+            "gross_profit": "Gross Profit (UGX)", "margin_pct": "Margin (%)",
+        }).drop(columns=["estimated_units"]), hide_index=True)
@@ -0,0 +1,82 @@
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import fetch_data as db  # noqa: E402
+
+
+def _unquote(value: str) -> str:
+    return value[1:-1].replace('\\"', '"').replace("\\\\", "\\") if value.startswith('"') else value
+
+
+class FakeQuery:
+    """Just enough of the PostgREST query builder to page over in-memory rows."""
+
+    _OPS = {"gt": lambda a, b: a > b, "gte": lambda a, b: a >= b, "lt": lambda a, b: a < b,
+            "lte": lambda a, b: a <= b, "eq": lambda a, b: a == b, "neq": lambda a, b: a != b}
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._tests = []
+        self._order = []
+        self._limit = None
+
+    def _compare(self, column, op, value):
+        def test(row):
+            cell = row[column]
+            return cell is not None and self._OPS[op](cell, type(cell)(value))
+        return test
+
+    def select(self, columns):
+        return self
+
+    def __getattr__(self, op):
+        if op not in self._OPS:
+            raise AttributeError(op)
+
+        def add(column, value):
+            self._tests.append(self._compare(column, op, value))
+            return self
+        return add
+
+    def in_(self, column, values):
+        self._tests.append(lambda row: row[column] in values)
+        return self
+
+    def or_(self, spec):
+        # Parses the `a.gt."x",and(a.eq."x",id.gt."y")` form iter_chunks sends
+        first, second = re.fullmatch(r"(.+?),and\((.+)\)", spec).groups()
+        conditions = [first, *re.split(r",(?=\w+\.\w+\.)", second)]
+        parsed = [(column, op, _unquote(value)) for column, op, value in
+                  (condition.split(".", 2) for condition in conditions)]
+        head = self._compare(*parsed[0])
+        rest = [self._compare(*p) for p in parsed[1:]]
+        self._tests.append(lambda row: head(row) or all(test(row) for test in rest))
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def execute(self):
+        rows = [row for row in self._rows if all(test(row) for test in self._tests)]
+        for column, desc in reversed(self._order):
+            rows.sort(key=lambda row: row[column], reverse=desc)
+        return SimpleNamespace(data=[dict(row) for row in rows[:self._limit]])
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    """In-memory tables behind `db._table`; tests fill in `tables[name]`."""
+    data: dict[str, list[db.Row]] = {}
+    monkeypatch.setattr(db, "_table", lambda name: FakeQuery(data.setdefault(name, [])))
+    return data
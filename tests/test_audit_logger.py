@@ -0,0 +1,50 @@
+import time
+
+import httpx
+
+from utils.logger import AuditLogger
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_a_refused_entry_is_set_aside_and_the_rest_delivered(tmp_path):
+    sent, refuse = [], {"bad"}
+
+    def sink(entries):
+        if any(entry["details"] in refuse for entry in entries):
+            raise ValueError("column does not exist")
+        sent.extend(entries)
+
+    logger = AuditLogger(sink=sink, path=str(tmp_path / "spool.sqlite3"), flush_interval=0.05)
+    for details in ("one", "bad", "two"):
+        logger.log("test", "a@x", details)
+    assert logger.flush(5)
+    assert [entry["details"] for entry in sent] == ["one", "two"]
+    assert [(entry["details"], entry["error"]) for entry in logger.failed()] == [("bad", "column does not exist")]
+
+    logger.log("test", "a@x", "three")
+    assert _wait_until(lambda: len(sent) == 3)
+
+    refuse.clear()
+    assert logger.retry_failed() == 1
+    assert _wait_until(lambda: len(sent) == 4) and logger.failed_count() == 0
+
+
+def test_transient_errors_are_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.logger.RETRY_DELAY_S", 0.01)
+    attempts = []
+
+    def sink(entries):
+        attempts.append(entries)
+        if len(attempts) < 3:
+            raise httpx.ConnectError("offline")
+
+    logger = AuditLogger(sink=sink, path=str(tmp_path / "spool.sqlite3"), flush_interval=0.05)
+    logger.log("test", "a@x", "one")
+    assert logger.flush(5)
+    assert len(attempts) == 3 and logger.failed_count() == 0
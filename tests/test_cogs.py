@@ -0,0 +1,143 @@
+import random
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from modules import fetch_data as db
+from modules.cogs import FifoCogs
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _at(minutes: int) -> str:
+    return (START + timedelta(minutes=minutes)).isoformat()
+
+
+def _history(seed: int = 7):
+    """Openings, purchases, ledger gains and losses, and sales over 20 days, one event per minute."""
+    rng = random.Random(seed)
+    openings = [{"id": 1, "drug_id": 1, "quantity": 40}, {"id": 2, "drug_id": 2, "quantity": 25},
+                {"id": 3, "drug_id": 3, "quantity": 10}]
+    purchases, movements, sales = [], [], []
+    for minute in range(20 * 24 * 60 // 4):
+        minute *= 4
+        drug_id = rng.choice([1, 2])
+        roll = rng.random()
+        if roll < 0.04:
+            purchases.append({"id": len(purchases) + 1, "drug_id": drug_id, "quantity_purchased": rng.randint(50, 150),
+                              "unit_cost": float(rng.randint(100, 900)), "created_at": _at(minute)})
+        elif roll < 0.05:
+            change = rng.choice([-3, -2, 2, 4])
+            movements.append({"id": len(movements) + 10, "drug_id": drug_id, "change": change,
+                              "reason": rng.choice(["write_off", "stock_take", "reconciliation", "adjustment"])
+                              if change < 0 else rng.choice(["stock_take", "adjustment"]),
+                              "created_at": _at(minute)})
+        else:
+            # 🧾 Drug 3 is never bought: every unit past its opening stock is estimated
+            drug_id = 3 if roll > 0.99 else drug_id
+            quantity = rng.randint(1, 3)
+            sales.append({"id": len(sales) + 1, "drug_id": drug_id, "quantity_sold": quantity,
+                          "total_price": quantity * 1000.0, "date_sold": _at(minute)})
+    return openings, purchases, movements, sales
+
+
+def _brute_force(openings, purchases, movements, sales):
+    """Daily per-drug margins from one unit queue per drug, popped unit by unit."""
+    incoming = sorted([(p["created_at"], p["drug_id"], p["quantity_purchased"], p["unit_cost"]) for p in purchases]
+                      + [(m["created_at"], m["drug_id"], m["change"], None) for m in movements if m["change"] > 0],
+                      key=lambda layer: layer[0])
+    layers = defaultdict(list)
+    for opening in openings:
+        layers[opening["drug_id"]].append([opening["quantity"], None])
+    for _, drug_id, quantity, cost in incoming:
+        layers[drug_id].append([quantity, cost])
+
+    queues, last_cost = {}, {}
+    for drug_id, drug_layers in layers.items():
+        known = [cost for _, cost in drug_layers if cost is not None]
+        previous = known[0] if known else 0.0
+        queue = deque()
+        for quantity, cost in drug_layers:
+            previous = cost if cost is not None else previous
+            queue.extend([(previous, cost is None)] * quantity)
+        queues[drug_id], last_cost[drug_id] = queue, previous
+
+    outgoing = sorted([(m["created_at"], 0, m["drug_id"], -m["change"], None) for m in movements if m["change"] < 0]
+                      + [(s["date_sold"], 1, s["drug_id"], s["quantity_sold"], s) for s in sales],
+                      key=lambda event: (event[0], event[1]))
+    margins = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    for _, _, drug_id, quantity, sale in outgoing:
+        queue = queues.setdefault(drug_id, deque())
+        units = [queue.popleft() if queue else (last_cost.get(drug_id, 0.0), True) for _ in range(quantity)]
+        if sale is not None:
+            day = margins[(sale["date_sold"][:10], drug_id)]
+            day[0] += quantity
+            day[1] += sale["total_price"]
+            day[2] += sum(cost for cost, _ in units)
+            day[3] += sum(estimated for _, estimated in units)
+    return margins
+
+
+def _engine_margins(engine: FifoCogs):
+    return {(row.day, row.drug_id): [row.units, row.revenue, row.cogs, row.estimated_units]
+            for row in engine.margins().itertuples()}
+
+
+@pytest.fixture
+def ledger(tables, monkeypatch):
+    """The history split in two at day 12, with `opening_stock()` served from memory."""
+    openings, purchases, movements, sales = _history()
+    monkeypatch.setattr(db, "fetch_opening_stock",
+                        lambda after=None, limit=db.DEFAULT_CHUNK_SIZE:
+                        [row for row in openings if after is None or row["id"] > after][:limit])
+    cutoff = _at(12 * 24 * 60)
+    for name, rows, column in (("purchases", purchases, "created_at"), ("stock_movements", movements, "created_at"),
+                               ("sales", sales, "date_sold")):
+        tables[name] = [row for row in rows if row[column] <= cutoff]
+        tables[f"later {name}"] = [row for row in rows if row[column] > cutoff]
+    return openings, purchases, movements, sales
+
+
+def test_margins_match_a_unit_by_unit_fifo(tables, ledger, tmp_path):
+    path = str(tmp_path / "cogs.sqlite3")
+    first = FifoCogs(path)
+    first.refresh(force=True)
+    for name in ("purchases", "stock_movements", "sales"):
+        tables[name].extend(tables.pop(f"later {name}"))
+
+    # 🔁 A new engine picks up from what the first one stored, re-reading the late-sale window
+    engine = FifoCogs(path)
+    assert engine.refresh(force=True) == len([s for s in ledger[3] if s["date_sold"] > _at(12 * 24 * 60)])
+
+    expected, got = _brute_force(*ledger), _engine_margins(engine)
+    assert got.keys() == expected.keys()
+    for key, (units, revenue, cost, estimated) in expected.items():
+        assert got[key][0] == units and got[key][3] == estimated, key
+        assert got[key][1] == pytest.approx(revenue) and got[key][2] == pytest.approx(cost), key
+    assert any(estimated for *_, estimated in expected.values())
+
+
+def test_a_failed_chunk_keeps_the_chunks_before_it(tables, ledger, tmp_path, monkeypatch):
+    for name in ("purchases", "stock_movements", "sales"):
+        tables[name].extend(tables.pop(f"later {name}"))
+    engine = FifoCogs(str(tmp_path / "cogs.sqlite3"))
+    calls = 0
+    store_sales = engine._store_sales
+
+    def fail_third(conn, frame):
+        nonlocal calls
+        calls += 1
+        if calls == 3:
+            raise RuntimeError("disk full")
+        store_sales(conn, frame)
+
+    monkeypatch.setattr(engine, "_store_sales", fail_third)
+    with pytest.raises(RuntimeError):
+        engine.refresh(force=True)
+    assert engine.margins()["units"].sum() > 0
+
+    engine.refresh(force=True)
+    expected = _brute_force(*ledger)
+    got = _engine_margins(engine)
+    assert sum(cost for *_, cost, _ in expected.values()) == pytest.approx(sum(row[2] for row in got.values()))
@@ -0,0 +1,26 @@
+from datetime import date
+
+import pandas as pd
+
+from modules.drug_edits import apply_markup, changed_records, changed_rows
+
+DRUGS = pd.DataFrame([
+    {"id": 1, "name": "Panadol", "category": "Pain Relief", "description": None, "price": 100.0,
+     "stock_quantity": 5, "expiry_date": date(2027, 1, 1), "supplier_id": 2},
+    {"id": 2, "name": "Amoxil", "category": "Antibiotic", "description": "500mg", "price": 50.0,
+     "stock_quantity": None, "expiry_date": None, "supplier_id": None},
+])
+
+
+def test_only_edited_columns_are_sent():
+    edited = DRUGS.copy()
+    edited.loc[0, "stock_quantity"] = 7
+    edited.loc[1, "price"] = 55.0
+    rows, originals = changed_records(*changed_rows(DRUGS, edited))
+    assert rows == [{"id": 1, "stock_quantity": 7}, {"id": 2, "price": 55.0}]
+    assert originals == [{"id": 1, "stock_quantity": 5}, {"id": 2, "price": 50.0}]
+
+
+def test_a_price_change_leaves_stock_out():
+    rows, originals = changed_records(*changed_rows(DRUGS, apply_markup(DRUGS, 10)))
+    assert all(set(row) == {"id", "price"} for row in rows + originals)
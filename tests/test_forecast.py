@@ -0,0 +1,19 @@
+from datetime import date, timedelta
+
+from modules.forecast import DemandHistory
+
+
+def test_basket_lines_split_across_pages_are_all_counted(tables):
+    yesterday = date.today() - timedelta(days=1)
+    # 🧺 Five-line baskets of one drug, so page boundaries fall inside a basket
+    tables["sales"] = [{"id": i, "drug_id": 1, "quantity_sold": 1,
+                        "date_sold": f"{yesterday}T08:{i // 5 // 60:02d}:{i // 5 % 60:02d}+00:00"}
+                       for i in range(2500)]
+    history = DemandHistory()
+    assert history.refresh(force=True) == 2500
+    assert history.window([1]).sum() == 2500
+
+    # 📴 A till that was offline syncs a morning sale after the rest
+    tables["sales"].append({"id": 2500, "drug_id": 1, "quantity_sold": 4, "date_sold": f"{yesterday}T07:00:00"})
+    assert history.refresh(force=True) == 1
+    assert history.window([1]).sum() == 2504
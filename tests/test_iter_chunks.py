@@ -0,0 +1,32 @@
+from modules import fetch_data as db
+
+
+def _basket_sales(n_baskets, lines):
+    """Sales where every line of a basket shares its `date_sold`."""
+    return [{"id": basket * lines + line, "drug_id": line, "quantity_sold": 1,
+             "date_sold": f"2026-01-01T10:{basket // 60:02d}:{basket % 60:02d}.5+00:00"}
+            for basket in range(n_baskets) for line in range(lines)]
+
+
+def test_ties_at_a_page_boundary_are_not_skipped(tables):
+    tables["sales"] = _basket_sales(5, 2)
+    for prefetch in (False, True):
+        chunks = list(db.iter_chunks("sales", "id, date_sold", key="date_sold", chunk_size=3,
+                                     tiebreak="id", prefetch=prefetch))
+        assert [row["id"] for rows in chunks for row in rows] == list(range(10))
+
+
+def test_after_a_pair_resumes_inside_a_tie(tables):
+    tables["sales"] = _basket_sales(3, 4)
+    rows = [row for rows in db.iter_chunks("sales", "id", key="date_sold", tiebreak="id", chunk_size=2,
+                                           after=(tables["sales"][5]["date_sold"], 5))
+            for row in rows]
+    assert [row["id"] for row in rows] == list(range(6, 12))
+
+
+def test_after_a_value_starts_above_it(tables):
+    tables["sales"] = _basket_sales(3, 2)
+    rows = [row for rows in db.iter_chunks("sales", "id", key="date_sold", tiebreak="id", chunk_size=2,
+                                           after=tables["sales"][1]["date_sold"])
+            for row in rows]
+    assert [row["id"] for row in rows] == [2, 3, 4, 5]
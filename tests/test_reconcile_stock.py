@@ -0,0 +1,28 @@
+from reconcile_stock import reconcile
+
+
+def test_expected_stock_is_the_ledger_without_earlier_reconciliations(tables):
+    tables["drugs"] = [{"id": 1, "name": "Amoxil", "stock_quantity": 7},
+                       {"id": 2, "name": "Panadol", "stock_quantity": 10},
+                       {"id": 3, "name": "Coartem", "stock_quantity": 3}]
+    tables["stock_movements"] = [
+        {"id": 1, "drug_id": 1, "change": 10, "reason": "opening", "created_at": "2026-03-02T09:00:00+00:00"},
+        {"id": 2, "drug_id": 2, "change": 10, "reason": "opening", "created_at": "2026-03-02T09:00:00+00:00"},
+        {"id": 3, "drug_id": 3, "change": 3, "reason": "opening", "created_at": "2026-03-02T09:00:00+00:00"},
+        # 🧾 A till offline since before the ledger began syncs its sale days later
+        {"id": 4, "drug_id": 1, "change": -5, "reason": "sale", "created_at": "2026-03-05T10:00:00+00:00"},
+        {"id": 5, "drug_id": 1, "change": 2, "reason": "purchase", "created_at": "2026-03-05T11:00:00+00:00"},
+        {"id": 6, "drug_id": 2, "change": -3, "reason": "sale", "created_at": "2026-03-05T12:00:00+00:00"},
+        # 🧮 Drug 3 was raised to 5 without a ledger row, then reconciled back to 3
+        {"id": 7, "drug_id": 3, "change": -2, "reason": "reconciliation", "created_at": "2026-03-06T00:00:00+00:00"},
+    ]
+    tables["sales"] = [{"id": 1, "drug_id": 1, "quantity_sold": 5, "date_sold": "2026-02-27T16:00:00"},
+                       {"id": 2, "drug_id": 2, "quantity_sold": 3, "date_sold": "2026-03-05T12:00:00"}]
+    tables["purchases"] = [{"id": 1, "drug_id": 1, "quantity_purchased": 2, "created_at": "2026-03-05T11:00:00+00:00"}]
+
+    report = reconcile().set_index("id")
+    assert report["expected"].to_dict() == {1: 7, 2: 7, 3: 3}
+    assert report["drift"].to_dict() == {1: 0, 2: 3, 3: 0}
+
+    history = reconcile(history_only=True).set_index("id")
+    assert history["expected"].to_dict() == {1: -3, 2: -3, 3: 0}
@@ -0,0 +1,15 @@
+from modules.replica import Replica
+
+
+def test_invoice_lines_split_across_pages_are_all_copied(tables, tmp_path):
+    # 🧾 Invoices of four lines, all stamped with the same created_at
+    tables["purchases"] = [{"id": i, "drug_id": i % 7, "supplier_id": 1, "quantity_purchased": 2, "unit_cost": 10.0,
+                            "entered_by": 1, "created_at": f"2026-01-01T08:{i // 4 // 60:02d}:{i // 4 % 60:02d}+00:00",
+                            "date_purchased": "2026-01-01", "expiry_date": None}
+                           for i in range(2002)]
+    replica = Replica(path=str(tmp_path / "replica.sqlite3"))
+    assert replica.sync(force=True) == 2002
+    assert replica.query("select count(*) as n from purchases")["n"][0] == 2002
+
+    tables["purchases"].append({**tables["purchases"][-1], "id": 2002, "created_at": "2026-01-01T09:00:00+00:00"})
+    assert replica.sync(force=True) == 1
@@ -0,0 +1,54 @@
+from datetime import date, timedelta
+
+from modules import fetch_data as db
+from modules.report_cache import ReportCache
+from modules.rollup import DailyRollup
+
+
+def test_basket_lines_split_across_pages_are_all_counted(tables, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "fetch_summary_totals", lambda *args, **kwargs: [])
+    # 🧺 Three-line baskets, so page boundaries (every 1000 rows) fall inside a basket
+    tables["sales"] = [{"id": i, "total_price": 10.0,
+                        "date_sold": f"{date.today()}T08:{i // 3 // 60:02d}:{i // 3 % 60:02d}+00:00"}
+                       for i in range(3000)]
+    rollup = DailyRollup(ReportCache(str(tmp_path / "reports.sqlite3")))
+    rollup.refresh()
+    assert rollup.totals(date.today(), date.max) == (30000.0, 0.0)
+
+    tables["sales"].extend({"id": 3000 + i, "total_price": 5.0, "date_sold": tables["sales"][-1]["date_sold"]}
+                           for i in range(2))
+    rollup.refresh(force=True)
+    assert rollup.totals(date.today(), date.max) == (30010.0, 0.0)
+
+
+def test_a_late_sale_below_the_watermark_is_counted_everywhere(tables, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "fetch_summary_totals", lambda *args, **kwargs: [])
+    today = date.today()
+    tables["sales"] = [{"id": 1, "total_price": 10.0, "date_sold": f"{today}T10:00:00+00:00"}]
+    cache_path = str(tmp_path / "reports.sqlite3")
+    here, elsewhere = DailyRollup(ReportCache(cache_path)), DailyRollup(ReportCache(cache_path))
+    here.refresh()
+    elsewhere.refresh()
+
+    # 📴 Rung up at 09:00 on a till that was offline, synced after the 10:00 sale
+    tables["sales"].append({"id": 2, "total_price": 5.0, "date_sold": f"{today}T09:00:00"})
+    for rollup in (here, elsewhere):
+        assert rollup.refresh(force=True) == 1
+        assert rollup.totals(today, date.max)[0] == 15.0
+        # 🔁 Re-reading the window does not count either sale twice
+        assert rollup.refresh(force=True) == 0
+        assert rollup.totals(today, date.max)[0] == 15.0
+
+
+def test_yesterday_stays_open_for_late_sales_until_the_window_passes(tables, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "fetch_summary_totals", lambda *args, **kwargs: [])
+    yesterday = date.today() - timedelta(days=1)
+    tables["sales"] = [{"id": 1, "total_price": 10.0, "date_sold": f"{yesterday}T22:00:00+00:00"}]
+    cache = ReportCache(str(tmp_path / "reports.sqlite3"))
+    rollup = DailyRollup(cache)
+    rollup.refresh()
+
+    tables["sales"].append({"id": 2, "total_price": 5.0, "date_sold": f"{yesterday}T21:00:00"})
+    rollup.refresh(force=True)
+    assert rollup.totals(yesterday, date.max)[0] == 15.0
+    assert f"{yesterday}" not in cache.load("sales_day")
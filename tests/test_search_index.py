@@ -0,0 +1,67 @@
+from modules.catalog import Catalog
+from modules.search_index import SearchIndex
+
+DRUGS = [
+    {"id": 1, "name": "Panadol Extra"},
+    {"id": 2, "name": "Paracetamol"},
+    {"id": 3, "name": "Amoxil"},
+    {"id": 4, "name": "Amoxicillin Capsules"},
+]
+
+
+def _indexed(rows):
+    index = SearchIndex()
+    index.sync(rows)
+    return index
+
+
+def _ids(results):
+    return [item_id for item_id, _, _ in results]
+
+
+def test_exact_and_prefix_matches_rank_first():
+    index = _indexed(DRUGS)
+    assert _ids(index.search("amoxil")) == [3, 4]
+    assert _ids(index.search("  PANA ")) == [1]
+    assert _ids(index.search("amox caps"))[0] == 4
+    assert index.search("") == [] and index.search("zzzz") == []
+
+
+def test_typos_still_find_the_drug():
+    index = _indexed(DRUGS)
+    assert _ids(index.search("paracetmol"))[0] == 2
+    assert _ids(index.search("amoxicilin"))[0] == 4
+
+
+def test_limit_and_ties_order_by_name():
+    index = _indexed([{"id": i, "name": name} for i, name in enumerate(["Zinc B", "Zinc A", "Zinc C"])])
+    assert [name for _, name, _ in index.search("zinc")] == ["Zinc A", "Zinc B", "Zinc C"]
+    assert len(index.search("zinc", limit=2)) == 2
+
+
+def test_sync_reindexes_only_what_changed():
+    index = _indexed(DRUGS)
+    added = []
+    original_add = index.add
+    index.add = lambda item_id, name: (added.append(item_id), original_add(item_id, name))
+
+    index.sync([{"id": 1, "name": "Panadol Extra"}, {"id": 2, "name": "Calpol"},
+                {"id": 4, "name": "Amoxicillin Capsules"}, {"id": 5, "name": None}])
+    assert sorted(added) == [2, 5]
+    assert len(index) == 4
+    # 🧹 Renamed and removed names leave no postings behind
+    assert _ids(index.search("paracetamol")) == [] and _ids(index.search("amoxil")) == [4]
+    assert _ids(index.search("calpol")) == [2]
+    assert not any(3 in ids or ids == set() for ids in index._trigrams.values())
+
+
+def test_catalog_search_follows_reloads():
+    rows = [dict(row) for row in DRUGS]
+    catalog = Catalog(lambda: [dict(row) for row in rows], ttl=3600)
+    assert _ids(catalog.search("amoxil")) == [3, 4]
+
+    del rows[2]
+    rows[0]["name"] = "Panadol Rapid"
+    catalog.invalidate()
+    assert _ids(catalog.search("amoxil")) == [4]
+    assert _ids(catalog.search("panadol rapid")) == [1]
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+from modules.stock_take import count_sheet, merge_counts, to_levels, variances
+from utils.validators import validate_counts
+
+DRUGS = [
+    {"id": 1, "name": "Panadol", "category": "Pain Relief", "stock_quantity": 20},
+    {"id": 2, "name": "Amoxil", "category": "Antibiotic", "stock_quantity": 8},
+    {"id": 3, "name": "Coartem", "category": None, "stock_quantity": None},
+]
+PRICES = {1: 100.0, 2: 500.0, 3: 1000.0}
+
+
+def test_upload_rows_are_validated_and_blank_counts_dropped():
+    upload = pd.DataFrame({"Drug Name": ["panadol ", "Amoxil", "Coartem", "Flagyl", ""],
+                           "Count": [5, None, -1, 2.5, 3]})
+    valid, errors = validate_counts(upload)
+    assert valid.to_dict("records") == [{"drug_name": "panadol", "counted": 5}]
+    assert errors["error"].tolist() == ["count must be a whole number of 0 or more",
+                                        "count must be a whole number of 0 or more", "missing drug"]
+
+    with pytest.raises(ValueError):
+        validate_counts(pd.DataFrame({"Drug Name": ["Panadol"]}))
+
+
+def test_counts_match_by_name_and_sum_across_rows():
+    valid, _ = validate_counts(pd.DataFrame({"drug": ["PANADOL", "Panadol", "Flagyl"], "qty": [12, 6, 4]}))
+    sheet, unmatched = merge_counts(count_sheet(DRUGS), valid)
+    assert dict(zip(sheet["id"], sheet["counted"].tolist())) == {1: 18, 2: pd.NA, 3: pd.NA}
+    assert unmatched["drug_name"].tolist() == ["Flagyl"]
+
+
+def test_counts_match_by_id_and_keep_earlier_counts():
+    sheet, _ = merge_counts(count_sheet(DRUGS), pd.DataFrame({"id": [2], "counted": [8]}))
+    valid, _ = validate_counts(pd.DataFrame({"drug_id": [3, 3, 42], "counted": [1, 2, 7]}))
+    sheet, unmatched = merge_counts(sheet, valid)
+    assert dict(zip(sheet["id"], sheet["counted"].tolist())) == {1: pd.NA, 2: 8, 3: 3}
+    assert unmatched["id"].tolist() == [42]
+
+
+def test_only_counted_drugs_that_differ_are_adjusted():
+    sheet, _ = merge_counts(count_sheet(DRUGS), pd.DataFrame({"id": [1, 2, 3], "counted": [19, 8, 2]}))
+    adjustments = variances(sheet, PRICES)
+    # 💰 Largest value first: 2 Coartem at 1000 outweigh 1 Panadol at 100
+    assert adjustments[["id", "variance", "value"]].to_dict("records") == [
+        {"id": 3, "variance": 2, "value": 2000.0}, {"id": 1, "variance": -1, "value": -100.0}]
+    assert to_levels(adjustments) == [{"id": 3, "stock_quantity": 2, "was": 0},
+                                      {"id": 1, "stock_quantity": 19, "was": 20}]
+
+
+def test_a_sheet_with_nothing_to_adjust_posts_nothing():
+    blank = variances(count_sheet(DRUGS), PRICES)
+    assert blank.empty and to_levels(blank) == []
+
+    sheet, _ = merge_counts(count_sheet(DRUGS), pd.DataFrame({"id": [1, 2], "counted": [20, 8]}))
+    assert to_levels(variances(sheet, PRICES)) == []
@@ -0,0 +1,127 @@
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from modules import fetch_data as db
+from modules import write_journal
+from modules.write_journal import APPLIED, CONFLICT, REJECTED, WriteJournal
+
+
+class Recorder:
+    """Stands in for a shared cache and remembers every call made to it."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, *args))
+
+
+class FakeServer:
+    """`apply_journal()` over an in-memory stock table, applying each request key once."""
+
+    def __init__(self, stock):
+        self.stock = stock
+        self.applied = {}
+        self.batches = []
+        self.lose_next_reply = False
+
+    def apply_journal(self, entries):
+        self.batches.append([entry["key"] for entry in entries])
+        outcomes = [self._apply(entry) for entry in entries]
+        if self.lose_next_reply:
+            # 📴 Committed on the server, but the connection drops before the reply arrives
+            self.lose_next_reply = False
+            raise ConnectionError("connection reset")
+        return outcomes
+
+    def _apply(self, entry):
+        key = entry["key"]
+        if key in self.applied:
+            return {"request_key": key, "status": APPLIED, "result": self.applied[key], "error": None}
+        items = entry["payload"]["items"]
+        if any(item["drug_id"] not in self.stock for item in items):
+            return {"request_key": key, "status": REJECTED, "result": None, "error": "drug not found"}
+        if any(self.stock[item["drug_id"]] < item["quantity_sold"] for item in items):
+            return {"request_key": key, "status": CONFLICT, "result": None, "error": "Insufficient stock"}
+        result = []
+        for item in items:
+            self.stock[item["drug_id"]] -= item["quantity_sold"]
+            result.append({"drug_id": item["drug_id"], "stock_quantity": self.stock[item["drug_id"]]})
+        self.applied[key] = result
+        return {"request_key": key, "status": APPLIED, "result": result, "error": None}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer({1: 10, 2: 3})
+    monkeypatch.setattr(db, "apply_journal", server.apply_journal)
+    monkeypatch.setattr(write_journal, "RETRY_DELAY_S", 0.01)
+    for name in ("drug_catalog", "lot_catalog", "rollup", "demand", "cogs", "replica"):
+        monkeypatch.setattr(write_journal, name, Recorder())
+    monkeypatch.setattr(write_journal, "USE_REPLICA", True)
+    return server
+
+
+def _settled(recorder, calls, timeout=5.0):
+    """True once `recorder` has seen `calls`; the worker updates caches just after `wait()` returns."""
+    deadline = time.monotonic() + timeout
+    while recorder.calls != calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return recorder.calls == calls
+
+
+def _sale(drug_id, quantity, sold_on=None):
+    sold_at = datetime.combine(sold_on, datetime.min.time()) if sold_on else datetime.now()
+    return {"items": [{"drug_id": drug_id, "quantity_sold": quantity}], "sold_by": 1,
+            "date_sold": sold_at.isoformat()}
+
+
+def test_a_sale_is_applied_once_per_request_key(server, tmp_path):
+    journal = WriteJournal(str(tmp_path / "journal.sqlite3"))
+    server.lose_next_reply = True
+    assert journal.submit("sale-1", "sales", _sale(1, 4), "till@example.com")
+    assert not journal.submit("sale-1", "sales", _sale(1, 4), "till@example.com")
+
+    entry = journal.wait("sale-1", timeout=5)
+    assert entry["status"] == APPLIED
+    # 🔁 Replayed after the lost reply, but the stock moved once
+    assert server.batches == [["sale-1"], ["sale-1"]]
+    assert server.stock[1] == 6
+    assert entry["result"] == [{"drug_id": 1, "stock_quantity": 6}]
+    # 📦 The catalog takes the balance the database returned
+    assert _settled(write_journal.drug_catalog, [("update", 1, {"stock_quantity": 6})])
+
+
+def test_refused_entries_are_kept_as_problems_and_not_retried(server, tmp_path):
+    journal = WriteJournal(str(tmp_path / "journal.sqlite3"))
+    journal.submit("short", "sales", _sale(2, 5))
+    journal.submit("gone", "sales", _sale(99, 1))
+    journal.submit("fine", "sales", _sale(1, 1))
+
+    assert [journal.wait(key, timeout=5)["status"] for key in ("short", "gone", "fine")] == \
+        [CONFLICT, REJECTED, APPLIED]
+    assert [(entry["request_key"], entry["error"]) for entry in journal.problems()] == \
+        [("short", "Insufficient stock"), ("gone", "drug not found")]
+    assert journal.pending_count() == 0
+    assert server.stock == {1: 9, 2: 3}
+    assert sorted(key for batch in server.batches for key in batch) == ["fine", "gone", "short"]
+
+    journal.dismiss("short")
+    assert [entry["request_key"] for entry in journal.problems()] == ["gone"]
+
+
+def test_a_backdated_sale_reopens_the_report_caches(server, tmp_path):
+    journal = WriteJournal(str(tmp_path / "journal.sqlite3"))
+    yesterday = date.today() - timedelta(days=1)
+    journal.submit("today", "sales", _sale(1, 1))
+    assert journal.wait("today", timeout=5)["status"] == APPLIED
+    assert write_journal.rollup.calls == []
+
+    journal.submit("yesterday", "sales", _sale(1, 2, sold_on=yesterday))
+    assert journal.wait("yesterday", timeout=5)["status"] == APPLIED
+    assert _settled(write_journal.replica, [("invalidate", yesterday)])
+    assert write_journal.rollup.calls == [("invalidate", yesterday)]
+    assert write_journal.demand.calls == [("invalidate",)]
+    assert write_journal.cogs.calls == [("reread_from", yesterday)]
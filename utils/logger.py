@@ -1 +1,203 @@
- 
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from modules import fetch_data as db
+
+# 📁 Entries not yet in the database; survives crashes and restarts
+SPOOL_PATH = os.getenv(
+    "AUDIT_SPOOL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "audit_spool.sqlite3"),
+)
+
+# 📦 Entries held in memory before further ones wait in the spool only
+QUEUE_SIZE = 10_000
+# 🚚 Most entries sent in one insert
+BATCH_SIZE = 200
+# ⏱️ Longest an entry waits for its batch to fill
+FLUSH_INTERVAL_S = 2.0
+# 🔁 First and longest retry delay while the database is unreachable
+RETRY_DELAY_S = 1.0
+MAX_RETRY_DELAY_S = 60.0
+
+_SCHEMA = """
+pragma journal_mode = wal;
+create table if not exists spool (
+    id    integer primary key autoincrement,
+    entry text not null
+);
+create table if not exists failed (
+    id        integer primary key,
+    entry     text not null,
+    error     text not null,
+    failed_at text not null
+);
+"""
+
+
+class AuditLogger:
+    """Write-behind audit trail for the `audit_logs` table.
+
+    `log()` only appends the entry to a local SQLite spool and puts it on a
+    bounded queue, so the caller never waits on the database. A background
+    thread bulk-inserts queued entries once `batch_size` are waiting or
+    `flush_interval` has passed, then removes them from the spool. If the
+    queue is full, or the process dies first, the entries stay in the spool
+    and are sent once the queue drains, or after a restart once the first
+    new entry starts the flusher. Only transient errors are retried; entries
+    the database refuses outright are moved to a `failed` table, so one bad
+    entry cannot hold up the rest, and are listed by `failed()`.
+    """
+
+    def __init__(self, sink: Callable[[list[db.Row]], object] = None, path: str = SPOOL_PATH,
+                 queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL_S):
+        self._sink = sink or (lambda entries: db.insert_audit_logs(entries))
+        self.path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._thread: Optional[threading.Thread] = None
+        self._in_flight = False
+        # The spool may still hold entries from an earlier run
+        self._spooled_only = True
+
+    def _spool(self) -> sqlite3.Connection:
+        """The spool connection; callers hold `_lock`."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute("pragma synchronous = normal")
+        return self._conn
+
+    def start(self):
+        """Start the background flusher (idempotent)."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+                    self._thread.start()
+
+    def log(self, action: str, performed_by: Optional[str], details: str = ""):
+        """Record an audit entry; returns as soon as it is spooled locally."""
+        entry = {
+            "action": action,
+            "performed_by": performed_by,
+            "details": details,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            # 🔑 Lets a batch that is sent twice be inserted once
+            "request_key": db.new_request_key(),
+        }
+        with self._lock:
+            with self._spool() as conn:
+                entry_id = conn.execute("insert into spool (entry) values (?)", (json.dumps(entry),)).lastrowid
+            try:
+                self._queue.put_nowait((entry_id, entry))
+            except queue.Full:
+                self._spooled_only = True
+        self.start()
+
+    def _next_batch(self) -> list[tuple[int, db.Row]]:
+        try:
+            batch = [self._queue.get(timeout=self._flush_interval)]
+        except queue.Empty:
+            return self._from_spool() if self._spooled_only else []
+        self._in_flight = True
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _from_spool(self) -> list[tuple[int, db.Row]]:
+        """Entries that only exist in the spool; read while nothing is queued or in flight."""
+        with self._lock:
+            if not self._queue.empty():
+                return []
+            rows = self._spool().execute("select id, entry from spool order by id limit ?",
+                                         (self._batch_size,)).fetchall()
+            self._spooled_only = len(rows) == self._batch_size
+            self._in_flight = bool(rows)
+        return [(entry_id, json.loads(entry)) for entry_id, entry in rows]
+
+    def _deliver(self, batch: list[tuple[int, db.Row]]) -> list[tuple[int, db.Row, str]]:
+        """Send a batch, retrying transient errors; returns the entries refused for good, with the error."""
+        delays = db.backoff_delays(RETRY_DELAY_S, MAX_RETRY_DELAY_S)
+        while True:
+            try:
+                self._sink([entry for _, entry in batch])
+                return []
+            except Exception as e:
+                if db.is_transient(e):
+                    time.sleep(next(delays))
+                    continue
+                if len(batch) == 1:
+                    return [(*batch[0], str(e))]
+                # 🔎 One bad entry fails the whole insert; send them one by one to find it
+                return [refused for item in batch for refused in self._deliver([item])]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            refused = self._deliver(batch)
+            with self._lock, self._spool() as conn:
+                conn.executemany("insert or replace into failed (id, entry, error, failed_at) values (?, ?, ?, ?)",
+                                 [(entry_id, json.dumps(entry), error, datetime.now(timezone.utc).isoformat())
+                                  for entry_id, entry, error in refused])
+                conn.executemany("delete from spool where id = ?", [(entry_id,) for entry_id, _ in batch])
+            self._in_flight = False
+
+    def failed(self, limit: int = 100) -> list[db.Row]:
+        """Entries the database refused, newest first, with the error it gave."""
+        with self._lock:
+            rows = self._spool().execute(
+                "select id, entry, error, failed_at from failed order by id desc limit ?", (limit,)).fetchall()
+        return [{"id": entry_id, **json.loads(entry), "error": error, "failed_at": failed_at}
+                for entry_id, entry, error, failed_at in rows]
+
+    def failed_count(self) -> int:
+        with self._lock:
+            return self._spool().execute("select count(*) from failed").fetchone()[0]
+
+    def retry_failed(self) -> int:
+        """Put refused entries back in the spool, e.g. after fixing the table; returns how many."""
+        with self._lock, self._spool() as conn:
+            moved = conn.execute("insert into spool (entry) select entry from failed order by id").rowcount
+            conn.execute("delete from failed")
+            self._spooled_only = True
+        self.start()
+        return moved
+
+    def discard_failed(self):
+        with self._lock, self._spool() as conn:
+            conn.execute("delete from failed")
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait up to `timeout` seconds for queued entries to reach the database."""
+        def pending():
+            return not self._queue.empty() or self._in_flight or self._spooled_only
+
+        if self._thread is None:
+            return not pending()
+        deadline = time.monotonic() + timeout
+        while pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not pending()
+
+
+# 🌐 Shared by every page that writes
+audit = AuditLogger()
+atexit.register(audit.flush)
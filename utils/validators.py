@@ -1 +1,134 @@
- 
+from datetime import date
+
+import pandas as pd
+
+# ------------------ Purchase Invoices ------------------ #
+# 📋 Columns an invoice file must provide (after alias normalisation)
+INVOICE_REQUIRED = ["drug_name", "supplier_name", "quantity", "unit_cost"]
+INVOICE_OPTIONAL = ["date_purchased", "expiry_date"]
+
+# 🔤 Header spellings accepted for each column
+INVOICE_ALIASES = {
+    "drug": "drug_name",
+    "drug_name": "drug_name",
+    "item": "drug_name",
+    "supplier": "supplier_name",
+    "supplier_name": "supplier_name",
+    "qty": "quantity",
+    "quantity": "quantity",
+    "quantity_purchased": "quantity",
+    "unit_cost": "unit_cost",
+    "cost": "unit_cost",
+    "unit_price": "unit_cost",
+    "date": "date_purchased",
+    "purchase_date": "date_purchased",
+    "date_purchased": "date_purchased",
+    "expiry": "expiry_date",
+    "expiry_date": "expiry_date",
+}
+
+
+def normalize_invoice_columns(df):
+    """Map invoice headers such as "Drug Name" or "Qty" onto the standard columns."""
+    keys = df.columns.astype(str).str.strip().str.lower().str.replace(r"[\s\-]+", "_", regex=True)
+    return df.rename(columns=dict(zip(df.columns, keys.map(lambda k: INVOICE_ALIASES.get(k, k)))))
+
+
+def validate_invoice(df, default_date=None):
+    """Validate every invoice row at once.
+
+    Returns `(valid, errors)`: `valid` holds clean, typed rows ready to
+    import; `errors` holds the rejected rows with an `error` column
+    explaining why. Raises `ValueError` if a required column is missing.
+    """
+    df = normalize_invoice_columns(df)
+    missing = [col for col in INVOICE_REQUIRED if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    out = pd.DataFrame(index=df.index)
+    out["drug_name"] = df["drug_name"].astype("string").str.strip()
+    out["supplier_name"] = df["supplier_name"].astype("string").str.strip()
+    out["quantity"] = pd.to_numeric(df["quantity"], errors="coerce")
+    out["unit_cost"] = pd.to_numeric(df["unit_cost"], errors="coerce")
+
+    default_date = default_date or date.today()
+    raw_dates = df["date_purchased"] if "date_purchased" in df.columns else pd.Series(pd.NA, index=df.index)
+    out["date_purchased"] = pd.to_datetime(raw_dates, errors="coerce").dt.date.where(raw_dates.notna(), default_date)
+
+    raw_expiry = df["expiry_date"] if "expiry_date" in df.columns else pd.Series(pd.NA, index=df.index)
+    out["expiry_date"] = pd.to_datetime(raw_expiry, errors="coerce").dt.date
+
+    checks = [
+        (out["drug_name"].isna() | (out["drug_name"] == ""), "missing drug name"),
+        (out["supplier_name"].isna() | (out["supplier_name"] == ""), "missing supplier name"),
+        (out["quantity"].isna() | (out["quantity"] < 1) | (out["quantity"] % 1 != 0),
+         "quantity must be a whole number of at least 1"),
+        (out["unit_cost"].isna() | (out["unit_cost"] <= 0), "unit cost must be above 0"),
+        (raw_dates.notna() & out["date_purchased"].isna(), "unreadable purchase date"),
+        (raw_dates.notna() & (pd.to_datetime(out["date_purchased"]) > pd.Timestamp(date.today())),
+         "purchase date is in the future"),
+        (raw_expiry.notna() & out["expiry_date"].isna(), "unreadable expiry date"),
+        (out["expiry_date"].notna() & (pd.to_datetime(out["expiry_date"]) <= pd.to_datetime(out["date_purchased"])),
+         "expiry date is not after the purchase date"),
+    ]
+    reasons = pd.Series("", index=df.index)
+    for mask, reason in checks:
+        mask = mask.fillna(False).astype(bool)
+        reasons[mask] = reasons[mask] + reason + "; "
+
+    bad = reasons != ""
+    errors = df[bad].assign(error=reasons[bad].str.rstrip("; "))
+    valid = out[~bad].astype({"quantity": int, "unit_cost": float})
+    return valid, errors
+
+
+# ------------------ Stock-Take Counts ------------------ #
+# 🔤 Header spellings accepted for each count sheet column; a sheet needs `counted` and `id` or `drug_name`
+COUNT_ALIASES = {
+    "id": "id",
+    "drug_id": "id",
+    "drug": "drug_name",
+    "drug_name": "drug_name",
+    "name": "drug_name",
+    "item": "drug_name",
+    "counted": "counted",
+    "count": "counted",
+    "qty": "counted",
+    "quantity": "counted",
+    "counted_quantity": "counted",
+}
+
+
+def validate_counts(df):
+    """Validate every row of an uploaded count sheet at once.
+
+    Returns `(valid, errors)` like `validate_invoice`; rows left blank in
+    `counted` were not counted and are dropped. `valid` keeps `id` when
+    the sheet has it and `drug_name` otherwise.
+    """
+    keys = df.columns.astype(str).str.strip().str.lower().str.replace(r"[\s\-]+", "_", regex=True)
+    df = df.rename(columns=dict(zip(df.columns, keys.map(lambda k: COUNT_ALIASES.get(k, k)))))
+    if "counted" not in df.columns or not {"id", "drug_name"} & set(df.columns):
+        raise ValueError("A count sheet needs a counted column and an id or drug name column")
+    df = df.loc[df["counted"].notna()]
+
+    out = pd.DataFrame(index=df.index)
+    key = "id" if "id" in df.columns else "drug_name"
+    out[key] = df[key] if key == "id" else df[key].astype("string").str.strip()
+    out["counted"] = pd.to_numeric(df["counted"], errors="coerce")
+
+    checks = [
+        (out[key].isna() | (out[key].astype("string").str.strip() == ""), "missing drug"),
+        (out["counted"].isna() | (out["counted"] < 0) | (out["counted"] % 1 != 0),
+         "count must be a whole number of 0 or more"),
+    ]
+    reasons = pd.Series("", index=df.index)
+    for mask, reason in checks:
+        mask = mask.fillna(False).astype(bool)
+        reasons[mask] = reasons[mask] + reason + "; "
+
+    bad = reasons != ""
+    errors = df[bad].assign(error=reasons[bad].str.rstrip("; "))
+    valid = out[~bad].astype({"counted": int})
+    return valid, errors